@@ -0,0 +1,134 @@
+import json
+import os
+import shutil
+import uuid
+import zipfile
+from datetime import datetime, timezone
+from pathlib import Path
+
+from .cad import hash_files
+from .models import File
+
+
+# Layout of a .oplp archive: the database and the stored files below ARCHIVE_DATA_DIR, and the manifest with the
+# SHA-256 digest of every stored file of the library
+ARCHIVE_DATA_DIR = 'data'
+ARCHIVE_FILE_DIRS = ('cad', 'files')
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+# Formats which are compressed already, e.g. FCStd files are ZIP containers. They are stored without recompression.
+COMPRESSED_SUFFIXES = frozenset({
+    '.fcstd', '.oplp', '.zip', '.7z', '.gz', '.bz2', '.xz', '.zst', '.3mf',
+    '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.odp',
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.pdf', '.mp4',
+})
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+# Returns the manifest of an archive. Raises ValueError for archives without manifest, e.g. created by older versions.
+def read_manifest(archive_path):
+    with zipfile.ZipFile(archive_path) as archive:
+        try:
+            return json.loads(archive.read(MANIFEST_NAME))
+        except KeyError:
+            raise ValueError(f"'{archive_path}' has no {MANIFEST_NAME}, it was not created by export_archive") from None
+
+
+# Returns the stored files of a library as dict arcname -> path: the files in data/cad and data/files, and the files
+# with a content hash which are kept in the blob store only, listed as data/cad/<file uuid><suffix> with the path of
+# their blob. Without blob_store only the files in the data directories are listed.
+def library_files(data_dir_path, connection = None, blob_store = None):
+    files = {}
+    for directory in ARCHIVE_FILE_DIRS:
+        directory_path = Path(data_dir_path) / directory
+        if not directory_path.is_dir():
+            continue
+        with os.scandir(directory_path) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    files[f"{ARCHIVE_DATA_DIR}/{directory}/{entry.name}"] = Path(entry.path)
+    if blob_store is not None:
+        stored = {path.stem for path in files.values()}
+        for file_uuid, name, digest in connection.exec_driver_sql(f"SELECT uuid, name, content_hash FROM {File.__tablename__} WHERE content_hash IS NOT NULL"):
+            if file_uuid not in stored and digest in blob_store:
+                files[f"{ARCHIVE_DATA_DIR}/{ARCHIVE_FILE_DIRS[0]}/{file_uuid}{Path(name).suffix}"] = blob_store.path(digest)
+    return dict(sorted(files.items()))
+
+
+# Returns the digests of the stored files as dict arcname -> digest. Stored files are named <file uuid><suffix>, their
+# digests are taken from File.content_hash for blobs and for files which still have the size and modification time of
+# their blob (see BlobStore.unchanged). Files without recorded digest and files which were changed, e.g. saved again
+# by FreeCAD, are hashed.
+def file_digests(connection, files, blob_store, workers = None):
+    recorded = dict(connection.exec_driver_sql(f"SELECT uuid, content_hash FROM {File.__tablename__} WHERE content_hash IS NOT NULL").fetchall())
+    digests = {}
+    unknown = {}
+    for arcname, path in files.items():
+        digest = recorded.get(Path(arcname).stem)
+        if digest is not None and (path == blob_store.path(digest) or blob_store.unchanged(digest, path)):
+            digests[arcname] = digest
+        else:
+            unknown[arcname] = path
+    hashed = hash_files(unknown.values(), workers = workers)
+    for arcname, path in unknown.items():
+        digest = hashed[Path(path)]
+        if isinstance(digest, Exception):
+            raise digest
+        digests[arcname] = digest
+    return digests
+
+
+def _zip_info(arcname, path, compress_type):
+    zinfo = zipfile.ZipInfo.from_file(path, arcname, strict_timestamps = False)
+    zinfo.compress_type = compress_type
+    return zinfo
+
+
+# Streams a file into the archive in large blocks, compressed with the compress type of zinfo
+def _write_file(archive, zinfo, path):
+    with open(path, 'rb') as source, archive.open(zinfo, 'w') as destination:
+        shutil.copyfileobj(source, destination, COPY_BUFFER_SIZE)
+
+
+# Writes a .oplp archive with the database and the stored files of a library. Already compressed formats are stored,
+# the other files are deflated, all of them are streamed into the archive.
+# With a base manifest (see read_manifest) the archive is incremental: it contains the database and only the files
+# which are new or changed since the base, the manifest lists all files with the id of the archive holding their
+# content. The archive is written to a temporary file and renamed when complete. Returns the manifest.
+def write_archive(archive_path, database_path, files, digests, base = None, compresslevel = 6):
+    archive_path = Path(archive_path)
+    base_files = base['files'] if base else {}
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'id': str(uuid.uuid4()),
+        'base': base['id'] if base else None,
+        'created': datetime.now(timezone.utc).isoformat(timespec = 'seconds'),
+        'database': f"{ARCHIVE_DATA_DIR}/{Path(database_path).name}",
+        'files': {},
+    }
+
+    members = []
+    for arcname, path in files.items():
+        digest = digests[arcname]
+        base_entry = base_files.get(arcname)
+        if base_entry is not None and base_entry['sha256'] == digest:
+            manifest['files'][arcname] = dict(base_entry)
+            continue
+        manifest['files'][arcname] = {'sha256': digest, 'size': path.stat().st_size, 'archive': manifest['id']}
+        members.append((arcname, path))
+
+    temporary_path = archive_path.with_name(f"{archive_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with zipfile.ZipFile(temporary_path, 'w', zipfile.ZIP_DEFLATED, compresslevel = compresslevel) as archive:
+            _write_file(archive, _zip_info(manifest['database'], database_path, zipfile.ZIP_DEFLATED), database_path)
+            for arcname, path in members:
+                compress_type = zipfile.ZIP_STORED if Path(arcname).suffix.lower() in COMPRESSED_SUFFIXES else zipfile.ZIP_DEFLATED
+                _write_file(archive, _zip_info(arcname, path, compress_type), path)
+            archive.writestr(MANIFEST_NAME, json.dumps(manifest, indent = 1))
+        os.replace(temporary_path, archive_path)
+    except BaseException:
+        temporary_path.unlink(missing_ok = True)
+        raise
+    return manifest
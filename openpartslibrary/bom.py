@@ -0,0 +1,127 @@
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from .models import Component, ComponentComponent, Material
+
+
+# Columns of the links between the components below the root, with the attributes of the child component
+EDGE_COLUMNS = ('parent_id', 'component_id', 'quantity', 'reference_designator',
+                'uuid', 'number', 'name', 'unit_price', 'currency', 'material', 'volume', 'density', 'is_leaf')
+
+# Exploding stops at this depth, also if the hierarchy contains a cycle
+MAX_BOM_DEPTH = 50
+
+_components = Component.__tablename__
+_links = ComponentComponent.__tablename__
+_materials = Material.__tablename__
+
+# Every link below the root once, with the attributes of the child. The recursion runs over the distinct components
+# (UNION), so shared subassemblies are read once and cycles end the recursion.
+_links_statement = f"""
+WITH RECURSIVE below(id) AS (
+    SELECT id FROM {_components} WHERE uuid = ?
+    UNION
+    SELECT l.child_component_id FROM {_links} l JOIN below ON l.parent_component_id = below.id
+)
+SELECT l.parent_component_id, l.child_component_id, COALESCE(l.quantity, 1), l.reference_designator,
+       c.uuid, c.number, c.name, c.unit_price, c.currency, c.material, c.volume, m.density,
+       NOT EXISTS (SELECT 1 FROM {_links} WHERE parent_component_id = c.id)
+FROM {_links} l JOIN {_components} c ON c.id = l.child_component_id LEFT JOIN {_materials} m ON m.name = c.material
+WHERE l.parent_component_id IN (SELECT id FROM below)
+"""
+
+
+# Multi-level bill of materials of a component. lines is a DataFrame with one row per occurrence of a component
+# in the hierarchy (ordered by level) with the attributes of the component, the rollups are computed vectorized over the leaf lines, the
+# assemblies themselves are made of their children.
+class BillOfMaterials:
+    def __init__(self, root, lines):
+        self.root = root
+        self.lines = lines
+
+        # costs are summed in cents, the mass in kg from the volume (m³) and the density (kg/m³) of the material
+        unit_price = pd.to_numeric(lines['unit_price'], errors = 'coerce').astype('float64')
+        lines['extended_cost'] = unit_price * lines['extended_quantity']
+        lines['extended_mass'] = lines['volume'].astype('float64') * lines['density'].astype('float64') * lines['extended_quantity']
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __repr__(self):
+        return f"<BillOfMaterials(root={self.root}, lines={len(self.lines)})>"
+
+    def leaves(self):
+        return self.lines[self.lines['is_leaf'].astype(bool)]
+
+    # Flattened (summarized) BOM: the total quantity of every component per unit of the root
+    def summary(self, leaves_only = True):
+        lines = self.leaves() if leaves_only else self.lines
+        return lines.groupby(['component_id', 'uuid', 'number', 'name'], sort = False, as_index = False) \
+            .agg(extended_quantity = ('extended_quantity', 'sum'), extended_cost = ('extended_cost', 'sum'), extended_mass = ('extended_mass', 'sum'))
+
+    # Returns the total cost of the leaf components per currency as exact Decimal values rounded to cents
+    def cost_by_currency(self):
+        leaves = self.leaves()
+        cents = np.rint(leaves['extended_cost'].to_numpy(dtype = 'float64', na_value = 0.0) * 100)
+        totals = pd.Series(cents, index = leaves['currency'].fillna('')).groupby(level = 0).sum()
+        return {currency or None: Decimal(int(total)).scaleb(-2) for currency, total in totals.items()}
+
+    # Returns the total mass of the leaf components in kg, and the number of leaf lines without volume or density
+    def mass(self):
+        extended_mass = self.leaves()['extended_mass']
+        return float(extended_mass.sum()), int(extended_mass.isna().sum())
+
+
+# Explodes the BOM below the component with the given uuid down to max_depth levels. The distinct links below the root
+# are read with one recursive query, the lines (one per path from the root) are expanded level by level in memory
+# with numpy index arithmetic, so shared subassemblies are read from the database only once.
+# Returns a BillOfMaterials, or None if there is no component with this uuid.
+def explode_bom(session, uuid, max_depth = MAX_BOM_DEPTH):
+    connection = session.connection()
+    root = connection.exec_driver_sql(f"SELECT id, uuid, number, name FROM {_components} WHERE uuid = ?", (uuid,)).first()
+    if root is None:
+        return None
+
+    edges = pd.DataFrame.from_records(connection.exec_driver_sql(_links_statement, (uuid,)).fetchall(), columns = EDGE_COLUMNS)
+    edge_parents = edges['parent_id'].to_numpy(dtype = 'int64')
+    edge_children = edges['component_id'].to_numpy(dtype = 'int64')
+    edge_quantities = edges['quantity'].to_numpy(dtype = 'float64')
+    # the links sorted by parent, the children of a parent are a contiguous range
+    order = np.argsort(edge_parents, kind = 'stable')
+    sorted_parents = edge_parents[order]
+
+    line_edges = []
+    line_levels = []
+    line_quantities = []
+    parents = np.array([root.id], dtype = 'int64')
+    parent_quantities = np.array([1.0])
+    for level in range(1, int(max_depth) + 1):
+        starts = np.searchsorted(sorted_parents, parents, side = 'left')
+        counts = np.searchsorted(sorted_parents, parents, side = 'right') - starts
+        total = int(counts.sum())
+        if total == 0:
+            break
+        # one line per (parent line, link of the parent)
+        parent_lines = np.repeat(np.arange(len(parents)), counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        edge_index = order[np.repeat(starts, counts) + offsets]
+        extended_quantities = parent_quantities[parent_lines] * edge_quantities[edge_index]
+
+        line_edges.append(edge_index)
+        line_levels.append(np.full(total, level))
+        line_quantities.append(extended_quantities)
+        parents = edge_children[edge_index]
+        parent_quantities = extended_quantities
+
+    if line_edges:
+        lines = edges.take(np.concatenate(line_edges)).reset_index(drop = True)
+        lines.insert(0, 'level', np.concatenate(line_levels))
+        lines.insert(5, 'extended_quantity', np.concatenate(line_quantities))
+    else:
+        lines = edges.iloc[0:0].reset_index(drop = True)
+        lines.insert(0, 'level', pd.Series(dtype = 'int64'))
+        lines.insert(5, 'extended_quantity', pd.Series(dtype = 'float64'))
+    lines['quantity'] = lines['quantity'].astype('float64')
+    return BillOfMaterials(dict(root._mapping), lines)
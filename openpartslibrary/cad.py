@@ -0,0 +1,114 @@
+import hashlib
+import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+
+# Block size for hashing files, large blocks keep the hashing I/O-bound
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+# Returns the SHA-256 hex digest of a file, read in large blocks into a reused buffer
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    buffer = bytearray(HASH_BLOCK_SIZE)
+    view = memoryview(buffer)
+    with open(file_path, 'rb', buffering = 0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            digest.update(view[:size])
+    return digest.hexdigest()
+
+
+# Hashes files in a thread pool (hashlib releases the GIL while hashing) and returns a dict path -> digest.
+# Files which can not be read are returned with the raised OSError instead of a digest.
+def hash_files(file_paths, workers = None):
+    file_paths = list(dict.fromkeys(Path(path) for path in file_paths))
+    workers = workers or min(32, (os.cpu_count() or 1) + 4)
+
+    def hash_or_error(file_path):
+        try:
+            return hash_file(file_path)
+        except OSError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        return dict(zip(file_paths, executor.map(hash_or_error, file_paths)))
+
+
+# FICLONE ioctl of Linux, shares the data blocks of two files on file systems with copy-on-write (Btrfs, XFS)
+_FICLONE = 0x40049409
+
+
+# Copies a file as a reflink where the file system supports it, otherwise with a kernel-side copy (sendfile or
+# copy_file_range through shutil.copyfile). Unlike a hardlink, changes to the copy never change the source.
+def clone_or_copy(source_path, destination_path):
+    try:
+        import fcntl
+        with open(source_path, 'rb') as source, open(destination_path, 'wb') as destination:
+            fcntl.ioctl(destination.fileno(), _FICLONE, source.fileno())
+    except (ImportError, OSError):
+        shutil.copyfile(source_path, destination_path)
+
+
+# Content-addressed storage of file contents. Every unique content is stored once under its SHA-256 digest
+# in <root>/<first two hex digits>/<digest>.
+class BlobStore:
+    def __init__(self, root_path):
+        self.root_path = Path(root_path)
+        self.root_path.mkdir(parents = True, exist_ok = True)
+
+    def path(self, digest):
+        return self.root_path / digest[:2] / digest
+
+    def __contains__(self, digest):
+        return self.path(digest).is_file()
+
+    # Stores the content of a file under its digest, returns True if the content was not stored before.
+    # The source is copied (or moved with move = True), never hardlinked, so later changes to the source file
+    # can not change the stored content.
+    def add(self, source_path, digest, move = False):
+        blob_path = self.path(digest)
+        if blob_path.is_file():
+            if move:
+                os.remove(source_path)
+            return False
+        blob_path.parent.mkdir(exist_ok = True)
+        temporary_path = blob_path.with_name(f"{digest}.{uuid.uuid4().hex}.tmp")
+        if move:
+            shutil.move(source_path, temporary_path)
+        else:
+            shutil.copyfile(source_path, temporary_path)
+        os.replace(temporary_path, blob_path)
+        return True
+
+    # Makes the content available under another path as a copy (a reflink where supported), so editing the file can
+    # not change the blob or other files with the same content. The copy gets the modification time of the blob,
+    # see unchanged().
+    def materialize(self, digest, destination_path):
+        destination_path = Path(destination_path)
+        blob_path = self.path(digest)
+        temporary_path = destination_path.with_name(f"{destination_path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            clone_or_copy(blob_path, temporary_path)
+            stat = blob_path.stat()
+            os.utime(temporary_path, ns = (stat.st_atime_ns, stat.st_mtime_ns))
+            os.replace(temporary_path, destination_path)
+        except BaseException:
+            temporary_path.unlink(missing_ok = True)
+            raise
+        return destination_path
+
+    # Returns True if a file made available with materialize still has the content of the blob, judged by size and
+    # modification time like rsync does, without reading the file
+    def unchanged(self, digest, file_path):
+        try:
+            blob_stat = self.path(digest).stat()
+            file_stat = os.stat(file_path)
+        except OSError:
+            return False
+        return file_stat.st_size == blob_stat.st_size and file_stat.st_mtime_ns == blob_stat.st_mtime_ns
@@ -0,0 +1,173 @@
+import json
+import uuid
+from datetime import datetime, timezone
+from itertools import groupby
+from operator import itemgetter
+from xml.sax.saxutils import escape, quoteattr
+
+from .models import Component, ComponentClosure, ComponentComponent, Supplier
+
+
+CYCLONEDX_SPEC_VERSION = '1.5'
+CYCLONEDX_XML_NAMESPACE = f'http://cyclonedx.org/schema/bom/{CYCLONEDX_SPEC_VERSION}'
+CYCLONEDX_FORMATS = ('json', 'xml')
+
+# Component columns exported as CycloneDX properties, named '<PROPERTY_PREFIX>:<column>'
+PROPERTY_COLUMNS = ('number', 'lifecycle_state', 'material', 'manufacturer_number')
+PROPERTY_PREFIX = 'openpartslibrary'
+
+_components = Component.__tablename__
+_links = ComponentComponent.__tablename__
+_closure = ComponentClosure.__tablename__
+_suppliers = Supplier.__tablename__
+
+_select_components = (
+    f"SELECT c.uuid, c.name, c.revision, c.description, s.name, {', '.join('c.' + column for column in PROPERTY_COLUMNS)} "
+    f"FROM {_components} c LEFT JOIN {_suppliers} s ON s.id = c.supplier_id"
+)
+
+
+# The bom-ref of a component, its uuid is unique in the library and stays the same across exports
+def bom_ref(component_uuid):
+    return str(component_uuid)
+
+
+# Converts a row of _select_components into a CycloneDX component, fields without value are left out
+def _component(row):
+    component_uuid, name, revision, description, supplier = row[:5]
+    component = {'type': 'device', 'bom-ref': bom_ref(component_uuid)}
+    if supplier is not None:
+        component['supplier'] = {'name': supplier}
+    component['name'] = name
+    if revision is not None:
+        component['version'] = str(revision)
+    if description is not None:
+        component['description'] = description
+    properties = [
+        {'name': f'{PROPERTY_PREFIX}:{column}', 'value': str(value)}
+        for column, value in zip(PROPERTY_COLUMNS, row[5:]) if value is not None
+    ]
+    if properties:
+        component['properties'] = properties
+    return component
+
+
+def _metadata(root, timestamp):
+    metadata = {
+        'timestamp': timestamp.isoformat(timespec = 'seconds').replace('+00:00', 'Z'),
+        'tools': {'components': [{'type': 'application', 'name': 'OpenPartsLibrary'}]},
+    }
+    if root is not None:
+        metadata['component'] = root
+    return metadata
+
+
+# Yields the exported components ordered by id straight from the database cursor. With root_id only the components
+# below the root (from the closure table) are exported.
+def _components_below(connection, root_id):
+    if root_id is None:
+        rows = connection.exec_driver_sql(f"{_select_components} ORDER BY c.id")
+    else:
+        rows = connection.exec_driver_sql(f"{_select_components} WHERE c.id IN (SELECT descendant_id FROM {_closure} WHERE ancestor_id = ?) ORDER BY c.id", (root_id,))
+    for row in rows:
+        yield _component(row)
+
+
+# Yields the dependencies as (parent uuid, [child uuids]), grouped in one pass over the links ordered by parent.
+# With root_id only the links inside the hierarchy below the root are exported.
+def _dependencies_below(connection, root_id):
+    select_links = (
+        f"SELECT p.uuid, c.uuid FROM {_links} l JOIN {_components} p ON p.id = l.parent_component_id "
+        f"JOIN {_components} c ON c.id = l.child_component_id"
+    )
+    if root_id is None:
+        rows = connection.exec_driver_sql(f"{select_links} ORDER BY l.parent_component_id, l.child_component_id")
+    else:
+        rows = connection.exec_driver_sql(
+            f"{select_links} WHERE l.parent_component_id = ? "
+            f"OR l.parent_component_id IN (SELECT descendant_id FROM {_closure} WHERE ancestor_id = ?) "
+            f"ORDER BY l.parent_component_id, l.child_component_id", (root_id, root_id))
+    for parent, children in groupby(rows, key = itemgetter(0)):
+        yield parent, [child for _, child in children]
+
+
+def _root(connection, root_uuid):
+    if root_uuid is None:
+        return None, None
+    root_id = connection.exec_driver_sql(f"SELECT id FROM {_components} WHERE uuid = ?", (root_uuid,)).scalar()
+    if root_id is None:
+        raise ValueError(f"Component '{root_uuid}' does not exist")
+    return root_id, _component(connection.exec_driver_sql(f"{_select_components} WHERE c.id = ?", (root_id,)).first())
+
+
+# Writes the library, or with root_uuid the hierarchy below one component, as CycloneDX 1.5 JSON to a text stream.
+# Components and dependencies are written while they are read from the database, so the memory use does not grow
+# with the size of the library.
+def write_cyclonedx_json(connection, stream, root_uuid = None, serial_number = None, timestamp = None):
+    root_id, root = _root(connection, root_uuid)
+    header = {
+        'bomFormat': 'CycloneDX',
+        'specVersion': CYCLONEDX_SPEC_VERSION,
+        'serialNumber': f"urn:uuid:{serial_number or uuid.uuid4()}",
+        'version': 1,
+        'metadata': _metadata(root, timestamp or datetime.now(timezone.utc)),
+    }
+    stream.write(json.dumps(header, ensure_ascii = False)[:-1])
+    stream.write(',\n"components": [')
+    for i, component in enumerate(_components_below(connection, root_id)):
+        stream.write(('\n' if i == 0 else ',\n') + json.dumps(component, ensure_ascii = False))
+    stream.write('\n],\n"dependencies": [')
+    for i, (parent, children) in enumerate(_dependencies_below(connection, root_id)):
+        dependency = {'ref': bom_ref(parent), 'dependsOn': [bom_ref(child) for child in children]}
+        stream.write(('\n' if i == 0 else ',\n') + json.dumps(dependency, ensure_ascii = False))
+    stream.write('\n]\n}\n')
+
+
+def _component_xml(component, indent):
+    lines = [f'{indent}<component type="device" bom-ref={quoteattr(component["bom-ref"])}>']
+    if 'supplier' in component:
+        lines.append(f'{indent}  <supplier><name>{escape(component["supplier"]["name"])}</name></supplier>')
+    lines.append(f'{indent}  <name>{escape(component["name"])}</name>')
+    if 'version' in component:
+        lines.append(f'{indent}  <version>{escape(component["version"])}</version>')
+    if 'description' in component:
+        lines.append(f'{indent}  <description>{escape(component["description"])}</description>')
+    if 'properties' in component:
+        lines.append(f'{indent}  <properties>')
+        lines.extend(f'{indent}    <property name={quoteattr(p["name"])}>{escape(p["value"])}</property>' for p in component['properties'])
+        lines.append(f'{indent}  </properties>')
+    lines.append(f'{indent}</component>\n')
+    return '\n'.join(lines)
+
+
+# Writes the same BOM as write_cyclonedx_json as CycloneDX 1.5 XML to a text stream
+def write_cyclonedx_xml(connection, stream, root_uuid = None, serial_number = None, timestamp = None):
+    root_id, root = _root(connection, root_uuid)
+    metadata = _metadata(root, timestamp or datetime.now(timezone.utc))
+    stream.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    stream.write(f'<bom xmlns="{CYCLONEDX_XML_NAMESPACE}" serialNumber="urn:uuid:{serial_number or uuid.uuid4()}" version="1">\n')
+    stream.write('  <metadata>\n')
+    stream.write(f'    <timestamp>{metadata["timestamp"]}</timestamp>\n')
+    stream.write('    <tools>\n      <components>\n        <component type="application"><name>OpenPartsLibrary</name></component>\n      </components>\n    </tools>\n')
+    if root is not None:
+        stream.write(_component_xml(root, '    '))
+    stream.write('  </metadata>\n  <components>\n')
+    for component in _components_below(connection, root_id):
+        stream.write(_component_xml(component, '    '))
+    stream.write('  </components>\n  <dependencies>\n')
+    for parent, children in _dependencies_below(connection, root_id):
+        stream.write(f'    <dependency ref={quoteattr(bom_ref(parent))}>\n')
+        stream.write(''.join(f'      <dependency ref={quoteattr(bom_ref(child))}/>\n' for child in children))
+        stream.write('    </dependency>\n')
+    stream.write('  </dependencies>\n</bom>\n')
+
+
+# Exports the library, or the hierarchy below the component with root_uuid, as CycloneDX file in the given format
+# ('json' or 'xml'). Returns the path of the file.
+def export_cyclonedx(connection, file_path, format = 'json', root_uuid = None):
+    if format not in CYCLONEDX_FORMATS:
+        raise ValueError(f"Unknown CycloneDX format '{format}', expected one of {CYCLONEDX_FORMATS}")
+    write = write_cyclonedx_json if format == 'json' else write_cyclonedx_xml
+    with open(file_path, 'w', encoding = 'utf-8', newline = '\n') as stream:
+        write(connection, stream, root_uuid = root_uuid)
+    return file_path
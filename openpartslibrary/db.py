@@ -1,18 +1,46 @@
+import io
+import json
 import os
+import tempfile
+import threading
 import uuid
-from datetime import datetime
+from contextlib import contextmanager
 from pathlib import Path
 
 import math
 import pandas as pd
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
-from .models import Base, Supplier, File, Component, ComponentComponent, ComponentFile, ComponentSupplier, Material
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from .cad import BlobStore, hash_file, hash_files
+from .migrations import check_query_plans, migrate
+from .models import Base, CadMetadata, Supplier, File, Component, ComponentComponent, Material
+from .profiles import IMPORT_PRAGMAS, configure_engine, temporary_pragmas
+from .search import rebuild_search_index, search_components
+from .pagination import page_components
+from .bom import MAX_BOM_DEPTH, explode_bom
+from .tree import load_tree
+from .archive import file_digests, library_files, read_manifest, write_archive
+from .cyclonedx import export_cyclonedx
+from .snapshot import snapshot_database
+from .mount import ArchiveFiles, mount_archive
+from .merge import MergeReport, merge_archive
+from .fcstd import FCSTD_SUFFIX, cached_digests, extract_cad_metadata
+from .thumbnails import THUMBNAIL_SIZES, ThumbnailCache, precompute_thumbnails
+from .graph import GraphCache, create_modification_counters
+from .hierarchy import contains, create_hierarchy_index, is_cycle_error, rebuild_hierarchy_index, where_used
+from .purge import LIBRARY_TABLES, clear_directory, delete_components, delete_library_rows, remove_files, stored_file_paths, unreferenced_digests
+from .valuation import inventory_value
+from .importer import ImportReport, SupplierIndex, import_components, import_suppliers, link_cad_files
+from .spreadsheet import DEFAULT_CHUNK_SIZE, MULTI_SHEET_FORMATS, find_spreadsheets, iter_spreadsheet_chunks, parse_spreadsheets, spreadsheet_format
 
 
 class PartsLibrary:
-    def __init__(self, db_path = None, data_dir_path = None):
+    # profile selects the SQLite settings of the database connections, one of 'default', 'web', 'bulk-import' and
+    # 'read-only' (see profiles.SQLITE_PROFILES) or a dict of pragmas. With 'read-only' the schema is not created or migrated.
+    # With immutable = True the database is opened read-only as a file which does not change, without locking and
+    # without checking for changes of other connections.
+    def __init__(self, db_path = None, data_dir_path = None, profile = 'default', immutable = False):
         package_dir = Path(__file__).resolve().parent
 
         if data_dir_path is not None:
@@ -26,6 +54,11 @@ class PartsLibrary:
         self.data_cad_dir_path.mkdir(parents=True, exist_ok=True)
         self.data_files_dir_path.mkdir(parents=True, exist_ok=True)
 
+        # Content-addressed storage, every unique file content is stored once under its SHA-256 digest
+        self.blob_store = BlobStore(self.data_dir_path / "blobs")
+        # Resized thumbnails of the CAD files by content hash, limited in size (see thumbnails.ThumbnailCache)
+        self.thumbnail_cache = ThumbnailCache(self.data_dir_path / "thumbnails")
+
         if db_path is not None:
             self.db_path = Path(db_path).expanduser().resolve()
         else:
@@ -34,20 +67,219 @@ class PartsLibrary:
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
 
         # Initialize the database and its connection
-        self.engine = create_engine(f"sqlite:///{self.db_path.as_posix()}")
-        Base.metadata.create_all(self.engine)
+        self.profile = profile
+        if immutable:
+            self.engine = create_engine(f"sqlite:///file:{self.db_path.as_posix()}?mode=ro&immutable=1&uri=true")
+        else:
+            self.engine = create_engine(f"sqlite:///{self.db_path.as_posix()}")
+        configure_engine(self.engine, profile)
+        if profile != 'read-only':
+            migrate(self.engine)
+        # self.session is a thread-local session registry, every thread works with its own session. Threads which are
+        # done with the database, e.g. at the end of a web request, should call remove_session.
         self.session_factory = sessionmaker(bind=self.engine)
-        self.session = self.session_factory()
+        self.session = scoped_session(self.session_factory)
+        self.graph_cache = GraphCache()
+        # Stored files of a mounted archive (see mount), None for libraries in a data directory
+        self.archive = None
 
         self.sample_data_dir_path = package_dir / 'sample'
 
-    def _read_spreadsheet(self, spreadsheet_file_path, sheet_name, dtype=None):
-        spreadsheet_path = Path(spreadsheet_file_path).expanduser().resolve()
-        suffix = spreadsheet_path.suffix.lower()
-        engine = None
-        if suffix == '.ods':
-            engine = 'odf'
-        return pd.read_excel(spreadsheet_path, sheet_name=sheet_name, dtype=dtype, engine=engine)
+    # Opens a .oplp archive (see export_archive) as read-only library without extracting the stored files. The database
+    # is extracted once into cache_dir_path and reused as long as the archive does not change, the stored files are
+    # read from the archive with read_stored_file. Archives with base contain only the files changed since their base.
+    @classmethod
+    def mount(cls, archive_path, cache_dir_path = None):
+        archive_cache_path, database_path, archive = mount_archive(archive_path, cache_dir_path = cache_dir_path)
+        library = cls(db_path = database_path, data_dir_path = archive_cache_path, profile = 'read-only', immutable = True)
+        library.archive = archive
+        print(f"[ INFO ] Mounted the archive {archive.archive_path}.")
+        return library
+
+    # Returns the content of the stored file with the given name in the directory 'cad' or 'files', from the archive
+    # of a mounted library without copying if it is stored uncompressed (as memoryview). Raises KeyError if the file
+    # does not exist.
+    def read_stored_file(self, name, directory = 'cad'):
+        if self.archive is not None:
+            return self.archive.read(self.archive.stored_name(name, directory = directory))
+        try:
+            return (self.data_dir_path / directory / Path(name).name).read_bytes()
+        except FileNotFoundError:
+            raise KeyError(f"No stored file '{name}' in '{directory}'") from None
+
+    # Returns the path of the content of the stored file <file uuid><suffix> in the directory 'cad' or 'files': the
+    # file in the data directory if there is one, e.g. a copy opened for editing, otherwise the blob of its content
+    # hash. Raises KeyError if the file does not exist.
+    def stored_file_path(self, name, directory = 'cad'):
+        path = self.data_dir_path / directory / Path(name).name
+        if path.is_file():
+            return path
+        digest = self.session.query(File.content_hash).filter_by(uuid = Path(name).stem).scalar()
+        if digest is None or digest not in self.blob_store:
+            raise KeyError(f"No stored file '{name}' in '{directory}'")
+        return self.blob_store.path(digest)
+
+    # Returns the path of a private copy of the stored file <file uuid><suffix> for editing, e.g. with FreeCAD. The copy
+    # is made from the blob in the data directory on first use, so changes to it never change the blob or other files
+    # with the same content. Raises KeyError if the file does not exist.
+    def edit_stored_file(self, name, directory = 'cad'):
+        path = self.data_dir_path / directory / Path(name).name
+        if not path.is_file():
+            digest = self.session.query(File.content_hash).filter_by(uuid = Path(name).stem).scalar()
+            if digest is None or digest not in self.blob_store:
+                raise KeyError(f"No stored file '{name}' in '{directory}'")
+            self.blob_store.materialize(digest, path)
+        return path
+
+    # Searches the components by name, number, description, material and supplier name with the full-text search index.
+    # Words in the query have to match all, a trailing '*' matches words by prefix ('ISO47*' finds 'ISO4762').
+    # Returns a list of dicts with the id, uuid, number and name of the components ranked by BM25 (best match first),
+    # the score and an HTML snippet with the matched terms in <mark> elements.
+    def search(self, query, limit = 50, offset = 0, include_archived = False):
+        return search_components(self.session.connection(), query, limit = limit, offset = offset, include_archived = include_archived)
+
+    # Returns a page of components ordered by 'number', 'name' or 'date_modified' with the id as tiebreaker. The next
+    # page is requested with the next_cursor of the returned page, which is None on the last page. Every page is read
+    # with an index seek, so later pages are as fast as the first one. With columns, e.g. ('uuid', 'number', 'name'),
+    # the page contains dicts of these columns instead of Component objects. With load, e.g. ('cad_file', 'supplier'),
+    # these relationships are loaded for the whole page at once.
+    def list_components(self, order_by = 'number', cursor = None, limit = 50, descending = False, include_archived = True, columns = None, load = ()):
+        return page_components(self.session, order_by = order_by, cursor = cursor, limit = limit, descending = descending, include_archived = include_archived, columns = columns, load = load)
+
+    # Loads the hierarchy below the component with the given uuid, down to depth levels of children, with a single
+    # recursive query. Returns the root TreeNode (see tree.TreeNode) or None if the component does not exist.
+    def load_tree(self, uuid, depth = 5):
+        return load_tree(self.session, uuid, depth = depth)
+
+    # Explodes the multi-level bill of materials below the component with the given uuid with a single recursive query.
+    # Returns a BillOfMaterials (see bom.BillOfMaterials) with one line per occurrence of a component and the extended
+    # quantities per unit of the root, with the cost rollup per currency and the mass rollup from the material
+    # densities. Returns None if the component does not exist.
+    def explode_bom(self, uuid, max_depth = MAX_BOM_DEPTH):
+        return explode_bom(self.session, uuid, max_depth = max_depth)
+
+    # Returns the component hierarchy as ComponentGraph (see graph.ComponentGraph) with compact adjacency arrays and
+    # to_networkx(), to_cytoscape() and to_cytoscape_json(). The graph is built with two queries and cached until
+    # a component or link changes. With root_uuid it contains only the component and everything below it, otherwise
+    # all linked components, with include_unlinked also the components without links. The returned graph is shared
+    # between callers and must not be modified.
+    def component_graph(self, root_uuid = None, include_archived = True, include_unlinked = False):
+        return self.graph_cache.get(self.session, root_uuid = root_uuid, include_archived = include_archived, include_unlinked = include_unlinked)
+
+    # Exports the library, or with root_uuid the hierarchy below one component, as CycloneDX 1.5 hardware BOM to
+    # file_path in the format 'json' or 'xml'. The BOM is streamed from the database to the file, the memory use does
+    # not depend on the size of the library. Returns the path of the file.
+    def export_cyclonedx(self, file_path, format = 'json', root_uuid = None):
+        with self.engine.connect() as connection:
+            return export_cyclonedx(connection, file_path, format = format, root_uuid = root_uuid)
+
+    # Writes a point-in-time consistent copy of the database to destination_path while the library stays in use, with
+    # compact = True a compacted copy (VACUUM INTO). Writers are blocked at most for short steps, see
+    # snapshot.snapshot_database. Returns the path of the copy.
+    def snapshot(self, destination_path, compact = False):
+        return snapshot_database(self.engine, destination_path, compact = compact)
+
+    # Exports a snapshot of the database and the stored CAD and attached files into a .oplp archive. With base, the
+    # path of an earlier archive, only the files which were added or changed since the base are included next to the
+    # database, restoring then needs the base archive as well. With compact = True the database is compacted in the
+    # archive. Returns the manifest of the archive (see archive.write_archive).
+    def export_archive(self, archive_path, base = None, workers = None, compact = False):
+        base_manifest = read_manifest(base) if base is not None else None
+        with tempfile.TemporaryDirectory(dir = Path(archive_path).parent) as temporary_dir_path:
+            database_path = self.snapshot(Path(temporary_dir_path) / self.db_path.name, compact = compact)
+            # files are stored before their File rows are committed, so every file of the snapshot is listed
+            with self.engine.connect() as connection:
+                files = library_files(self.data_dir_path, connection, self.blob_store)
+                digests = file_digests(connection, files, self.blob_store, workers = workers)
+            manifest = write_archive(archive_path, database_path, files, digests, base = base_manifest)
+        included = sum(1 for entry in manifest['files'].values() if entry['archive'] == manifest['id'])
+        print(f"[ INFO ] Exported the library to {archive_path} with {included} of {len(manifest['files'])} files.")
+        return manifest
+
+    # Merges the library of a .oplp archive into this library. Components, suppliers, materials and files are matched by
+    # uuid, rows which exist in this library are kept unchanged and new rows are inserted with their links. File
+    # contents are copied from the archive only if they are not stored yet. Returns a MergeReport (see
+    # merge.merge_archive), links which would create a cycle in the hierarchy are listed in its rejected_links.
+    def import_archive(self, archive_path, batch_size = 5000):
+        archive = ArchiveFiles(archive_path)
+        try:
+            with tempfile.TemporaryDirectory(dir = self.data_dir_path) as temporary_dir_path, self.bulk_import():
+                database_path = archive.extract(archive.database_name(), Path(temporary_dir_path) / 'parts.db')
+                report = merge_archive(self.session, archive, database_path, self.blob_store, self.data_dir_path, MergeReport(archive_path), batch_size = batch_size)
+        finally:
+            archive.close()
+        if report.inserted.get(File.__tablename__):
+            self.precompute_thumbnails()
+        print(f"[ INFO ] Merged {archive_path} with {report.inserted.get(Component.__tablename__, 0)} new components in {report.elapsed:.1f} s.")
+        return report
+
+    # Returns the components which contain the component with the given uuid, directly or in one of their subassemblies,
+    # with direct_only only the direct parents. Looked up in the closure table of the hierarchy with a single index range scan.
+    def where_used(self, uuid, direct_only = False):
+        return where_used(self.session, uuid, direct_only = direct_only)
+
+    # Returns True if the component with descendant_uuid is part of the component with ancestor_uuid at any depth
+    def contains(self, ancestor_uuid, descendant_uuid):
+        return contains(self.session, ancestor_uuid, descendant_uuid)
+
+    # Adds the component with child_uuid to the component with parent_uuid. Raises ValueError if one of the components
+    # does not exist or if the link would create a cycle, i.e. the parent is the child itself or one of its descendants.
+    # Links added through Component.children are checked by the database as well and raise an IntegrityError on flush.
+    def add_child(self, parent_uuid, child_uuid, quantity = 1, reference_designator = None):
+        parent = self.session.query(Component).filter_by(uuid = parent_uuid).first()
+        child = self.session.query(Component).filter_by(uuid = child_uuid).first()
+        if parent is None or child is None:
+            raise ValueError(f"Component '{parent_uuid if parent is None else child_uuid}' does not exist")
+        link = ComponentComponent(parent_component_id = parent.id, child_component_id = child.id, quantity = quantity, reference_designator = reference_designator)
+        self.session.add(link)
+        try:
+            self.session.commit()
+        except Exception as e:
+            self.session.rollback()
+            if is_cycle_error(e):
+                raise ValueError(f"Adding '{child.number}' to '{parent.number}' would create a cycle in the component hierarchy") from e
+            raise
+        return link
+
+    # Rebuilds the closure table of the component hierarchy from the links, returns the number of rows
+    def rebuild_hierarchy_index(self):
+        with self.engine.begin() as connection:
+            count = rebuild_hierarchy_index(connection)
+        print(f'[ INFO ] Rebuilt the hierarchy index with {count} rows.')
+        return count
+
+    # Rebuilds the full-text search index from the components and suppliers tables, returns the number of indexed components
+    def rebuild_search_index(self):
+        with self.engine.begin() as connection:
+            count = rebuild_search_index(connection)
+        print(f'[ INFO ] Rebuilt the search index with {count} components.')
+        return count
+
+    # Checks with EXPLAIN QUERY PLAN that the common lookups (see migrations.INDEXED_QUERIES) are index seeks.
+    # Returns a dict query name -> query plan of the lookups which scan a table, an empty dict if all use an index.
+    def check_indexes(self, queries = None):
+        with self.engine.connect() as connection:
+            return check_query_plans(connection, queries)
+
+    # Returns a new session, independent of self.session, which has to be closed by the caller
+    def new_session(self):
+        return self.session_factory()
+
+    # Closes the session of the current thread and returns its connection to the pool. The next use of self.session
+    # in this thread starts a new session.
+    def remove_session(self):
+        self.session.remove()
+
+    # Switches the database connections to the fast, unsafe import settings of the profile (see profiles.IMPORT_PRAGMAS)
+    # while the context is active, the profile settings are restored afterwards. Does nothing for profiles without
+    # import settings.
+    @contextmanager
+    def bulk_import(self):
+        pragmas = IMPORT_PRAGMAS.get(self.profile) if isinstance(self.profile, str) else None
+        if pragmas:
+            self.session.commit()
+        with temporary_pragmas(self.engine, pragmas):
+            yield
 
     def get_default_sample_spreadsheet_path(self):
         for candidate in ("components.ods", "components.xlsx"):
@@ -56,54 +288,164 @@ class PartsLibrary:
                 return candidate_path
         raise FileNotFoundError(f"No supported sample spreadsheet found in {self.sample_data_dir_path}")
 
-    # Imports components and their suppliers from a spreadsheet (*.xlsx) into the parts library database.
-    def import_from_spreadsheet(self, spreadsheet_file_path, components_sheet_name = 'components', components_cad_dir_path = None, suppliers_sheet_name = 'suppliers'):
-        # convert component and supplier sheets to pandas dataframes
-        components_df = self._read_spreadsheet(spreadsheet_file_path, components_sheet_name, dtype={'number': str})
-        suppliers_df = self._read_spreadsheet(spreadsheet_file_path, suppliers_sheet_name)
-
-        # add components from spreadsheet to database
-        components = []
-        for _, row in components_df.iterrows():
-
-            # check if required fields are present
-            if pd.isna(row["uuid"]):
-                print(f"[ ERROR ] Component is missing a UUID. Skipping import of this component.")
-                continue
-            if pd.isna(row["number"]):
-                print(f"[ ERROR ] Component is missing a number. Skipping import of this component.")
-                continue
-            if pd.isna(row["name"]):
-                print(f"[ ERROR ] Component is missing a name. Skipping import of this component.")
-                continue
-
-            # create component object
-            component = Component(
-                uuid = row["uuid"],
-                number = str(row["number"]),
-                name = row["name"],
-                description = row.get("description"),
-                revision = str(row.get("revision")),
-                lifecycle_state = row.get("lifecycle_state"),
-                owner = row.get("owner"),
-                material = row.get("material"),
-                unit_price = row.get("unit_price"),
-                currency = row.get("currency"),
-                date_created = datetime.utcnow(),
-                date_modified = datetime.utcnow()
-            )
-
-            # Add component to collection
-            #components.append(component)
-
-            self.session.add(component)
-            self.session.commit()
-
-        # add all components to the session and commit
-        #self.session.add_all(components)
-        #self.session.commit()
-        #print(f"Imported {len(components)} comnponents successfully from {spreadsheet_file_path}")
+    # Imports components and their suppliers from a spreadsheet (*.ods, *.xlsx, *.csv or *.parquet) into the parts library database.
+    # The components sheet is streamed in chunks of chunk_size rows, every chunk is validated and inserted with batched
+    # executemany inserts before the next one is read, so the memory use does not depend on the size of the file.
+    # All chunks are written in a single transaction (or one transaction per rows_per_transaction rows).
+    # The optional progress callback is called with the ImportReport after every chunk, see ImportReport.rows_per_second.
+    #
+    # With mode = 'insert' rows whose uuid already exists in the library are rejected. With mode = 'upsert' the sheet is
+    # synchronized with the library: unchanged rows are skipped, changed rows are updated and, with archive_missing = True,
+    # components which are no longer contained in the sheet are archived.
+    # New suppliers of the suppliers sheet are inserted before the components, and every component is linked to its supplier
+    # by supplier_uuid or supplier_name. Suppliers which are referenced but not found are listed in report.unknown_suppliers.
+    # With components_cad_dir_path, the files named in the cad_file_name column are read from this directory and linked
+    # to the components, each unique file content is stored only once (see add_cad_file).
+    # Returns an ImportReport with the number of imported rows and the rejected rows including the reason.
+    def import_from_spreadsheet(self, spreadsheet_file_path, components_sheet_name = 'components', components_cad_dir_path = None, suppliers_sheet_name = 'suppliers', mode = 'insert', archive_missing = False, batch_size = 5000, rows_per_transaction = None, chunk_size = DEFAULT_CHUNK_SIZE, progress = None):
+        components_chunks = iter_spreadsheet_chunks(spreadsheet_file_path, components_sheet_name, chunk_size = chunk_size, dtype = {'number': str})
+
+        # csv and parquet files only contain a components sheet
+        suppliers_chunks = None
+        if suppliers_sheet_name is not None and spreadsheet_format(spreadsheet_file_path) in MULTI_SHEET_FORMATS:
+            suppliers_chunks = iter_spreadsheet_chunks(spreadsheet_file_path, suppliers_sheet_name, chunk_size = chunk_size)
+
+        report = ImportReport(source = spreadsheet_file_path)
+        cad_file_names = {} if components_cad_dir_path is not None else None
+        with self.bulk_import():
+            self._import_sheets(report, components_chunks, suppliers_chunks, mode = mode, archive_missing = archive_missing, batch_size = batch_size, rows_per_transaction = rows_per_transaction, progress = progress, cad_file_names = cad_file_names)
+
+            # link the components to the CAD files named in the cad_file_name column
+            if cad_file_names:
+                link_cad_files(self.session, report, cad_file_names, components_cad_dir_path, self.blob_store, batch_size = batch_size)
+        if report.cad_files_linked:
+            self.precompute_thumbnails()
+        return report
+
+    # Imports several spreadsheets, given as a list of files or as a directory, like import_from_spreadsheet.
+    # The sheets are parsed in a pool of worker processes (workers = None uses all cores, workers = 1 parses in this
+    # process), while this process is the single writer which inserts the parsed chunks in bulk. The files are imported
+    # in the given order (sorted by name for a directory), so the result does not depend on which worker finishes first.
+    # Returns a list with one ImportReport per file. A file which can not be parsed or imported does not stop the import
+    # of the other files, the error is stored in report.error.
+    def import_from_spreadsheets(self, spreadsheet_file_paths, components_sheet_name = 'components', suppliers_sheet_name = 'suppliers', mode = 'insert', batch_size = 5000, rows_per_transaction = None, chunk_size = DEFAULT_CHUNK_SIZE, workers = None, progress = None):
+        sheet_names = {components_sheet_name: {'number': str}}
+        if suppliers_sheet_name is not None:
+            sheet_names[suppliers_sheet_name] = None
+
+        reports = []
+        with self.bulk_import():
+            for spreadsheet_file_path, sheets in parse_spreadsheets(find_spreadsheets(spreadsheet_file_paths), sheet_names, chunk_size = chunk_size, workers = workers):
+                report = ImportReport(source = spreadsheet_file_path)
+                reports.append(report)
+                if isinstance(sheets, Exception):
+                    report.error = f"{type(sheets).__name__}: {sheets}"
+                    continue
+                try:
+                    self._import_sheets(report, sheets[components_sheet_name], sheets.get(suppliers_sheet_name), mode = mode, batch_size = batch_size, rows_per_transaction = rows_per_transaction, progress = progress)
+                except Exception as e:
+                    report.error = f"{type(e).__name__}: {e}"
+        return reports
+
+    # Imports the chunks of a components sheet and optionally of a suppliers sheet, see import_from_spreadsheet
+    def _import_sheets(self, report, components_chunks, suppliers_chunks = None, mode = 'insert', archive_missing = False, batch_size = 5000, rows_per_transaction = None, progress = None, cad_file_names = None):
+        # add suppliers first, so that the components can be linked to them
+        if suppliers_chunks is not None:
+            import_suppliers(self.session, suppliers_chunks, report, batch_size = batch_size)
+
+        # add components from spreadsheet to database, linked to their suppliers through an in-memory index
+        supplier_index = SupplierIndex(self.session)
+        import_components(self.session, components_chunks, report, mode = mode, archive_missing = archive_missing, batch_size = batch_size, rows_per_transaction = rows_per_transaction, progress = progress, supplier_index = supplier_index, cad_file_names = cad_file_names)
+        return report
     
+    # Adds a CAD file to the library. The content is hashed and stored once in the blob store under its SHA-256 digest,
+    # the file is read from the blob (see stored_file_path) until it is opened for editing (see edit_stored_file).
+    # With move = True the source file is moved into the blob store instead of being copied, e.g. for uploaded
+    # temporary files.
+    # Returns the new File, which is added to the session but not committed.
+    def add_cad_file(self, source_path, name = None, description = 'This is a CAD file.', move = False):
+        source_path = Path(source_path)
+        name = name or source_path.name
+        digest = hash_file(source_path)
+        self.blob_store.add(source_path, digest, move = move)
+        file = File(uuid = str(uuid.uuid4()), name = name, description = description, content_hash = digest)
+        self.session.add(file)
+        return file
+
+    # Hashes and stores the content of CAD files in the blob store without creating File rows, e.g. to fill the
+    # blob store ahead of an import. Accepts a list of files or a directory and returns a dict path -> digest.
+    def ingest_cad_files(self, file_paths, workers = None):
+        if isinstance(file_paths, (str, os.PathLike)) and Path(file_paths).is_dir():
+            file_paths = sorted(path for path in Path(file_paths).iterdir() if path.is_file())
+        digests = hash_files(file_paths, workers = workers)
+        for file_path, digest in digests.items():
+            if not isinstance(digest, Exception):
+                self.blob_store.add(file_path, digest)
+        return digests
+
+    # Returns a function which opens the stored content of a file, the blob or the stored file of the library, or the
+    # member of the archive of a mounted library
+    def _stored_file_opener(self, file_uuid, name, digest):
+        stored_name = f"{file_uuid}{Path(name).suffix}"
+
+        def open_file():
+            if self.archive is not None:
+                return io.BytesIO(self.read_stored_file(stored_name))
+            if digest is not None and digest in self.blob_store:
+                return self.blob_store.path(digest)
+            return self.data_cad_dir_path / stored_name
+        return open_file
+
+    # Returns the path of the thumbnail of the CAD file with the given file uuid, extracted from the FCStd file and
+    # resized to size pixels (one of thumbnails.THUMBNAIL_SIZES, default thumbnails.THUMBNAIL_SIZE) on first use.
+    # Returns None if the file does not exist, has no content hash or no thumbnail.
+    def thumbnail(self, file_uuid, size = None):
+        if size is not None and size not in THUMBNAIL_SIZES:
+            raise ValueError(f"Unsupported thumbnail size {size}, expected one of {THUMBNAIL_SIZES}")
+        row = self.session.connection().exec_driver_sql(f"SELECT name, content_hash FROM {File.__tablename__} WHERE uuid = ?", (file_uuid,)).first()
+        if row is None or row[1] is None:
+            return None
+        try:
+            return self.thumbnail_cache.thumbnail(row[1], self._stored_file_opener(file_uuid, row[0], row[1]), size = size)
+        except (OSError, KeyError):
+            return None
+
+    # Extracts the thumbnails of all FCStd files of the library which are not cached yet. With background = True the
+    # thumbnails are extracted by a background thread, which is returned, otherwise the number of extracted thumbnails
+    # is returned. Called after imports, thumbnails which are not cached are otherwise extracted on first request.
+    def precompute_thumbnails(self, size = None, background = True):
+        with self.engine.connect() as connection:
+            rows = connection.exec_driver_sql(f"SELECT uuid, name, content_hash FROM {File.__tablename__} WHERE content_hash IS NOT NULL AND lower(name) LIKE ?", (f"%{FCSTD_SUFFIX}",)).fetchall()
+        files = {}
+        for file_uuid, name, digest in rows:
+            files.setdefault(digest, self._stored_file_opener(file_uuid, name, digest))
+        if not background:
+            return precompute_thumbnails(self.thumbnail_cache, files, size = size)
+        thread = threading.Thread(target = precompute_thumbnails, args = (self.thumbnail_cache, files), kwargs = {'size': size}, name = 'thumbnails', daemon = True)
+        thread.start()
+        return thread
+
+    # Extracts the metadata of the FreeCAD documents of the library (see fcstd.read_fcstd_metadata) in a process pool
+    # and caches it by content hash, so files which were read before are skipped, unless force = True. Returns the
+    # number of extracted files and a dict digest -> error of the files which could not be read.
+    def extract_cad_metadata(self, workers = None, force = False):
+        with self.engine.connect() as connection:
+            files = {arcname: path for arcname, path in library_files(self.data_dir_path, connection, self.blob_store).items() if Path(arcname).suffix.lower() == FCSTD_SUFFIX}
+            digests = file_digests(connection, files, self.blob_store, workers = workers)
+            cached = set() if force else cached_digests(connection)
+        pending = {digest: files[arcname] for arcname, digest in digests.items() if digest not in cached}
+        extracted, errors = extract_cad_metadata(self.engine, pending, workers = workers)
+        print(f"[ INFO ] Extracted the metadata of {extracted} CAD files, {len(set(digests.values())) - len(pending)} were extracted before, {len(errors)} could not be read.")
+        return extracted, errors
+
+    # Returns the metadata extracted from the CAD file of the component with the given uuid (see extract_cad_metadata),
+    # None if the component has no CAD file or its metadata was not extracted yet
+    def cad_metadata(self, uuid):
+        row = self.session.connection().exec_driver_sql(
+            f"SELECT m.data FROM {Component.__tablename__} c JOIN {File.__tablename__} f ON f.id = c.cad_file_id "
+            f"JOIN {CadMetadata.__tablename__} m ON m.content_hash = f.content_hash WHERE c.uuid = ?", (uuid,)).first()
+        return json.loads(row[0]) if row is not None and row[0] is not None else None
+
     def add_sample_data(self, components_spredsheet_path, components_cad_dir_path):
         pass
 
@@ -279,28 +621,51 @@ class PartsLibrary:
         self.session.commit()
     '''       
 
-    def delete_all(self):
+    # Clears the parts library: all library tables are emptied in a single transaction with plain DELETE statements and
+    # the stored files are removed in parallel. With vacuum = True the tables are dropped and recreated and the database
+    # file is compacted with VACUUM afterwards. User accounts are kept. Returns the number of deleted rows per table and
+    # the number of removed files.
+    def delete_all(self, vacuum = False, workers = None):
         print('[ INFO ] Clearing the parts library.')
-        self.session.query(ComponentComponent).delete()
-        self.session.query(ComponentSupplier).delete()
-        self.session.query(ComponentFile).delete()
-        self.session.query(Component).delete()
-        self.session.query(Supplier).delete()
-        self.session.query(File).delete()
-        self.session.query(Material).delete()
-        self.session.commit()
-        
-        for filename in os.listdir(self.data_cad_dir_path):
-            filepath = os.path.join(self.data_cad_dir_path, filename)
-            if os.path.isfile(filepath) and filename != "README.md":
-                os.remove(filepath)
-                print(f"[ INFO ] Deleted: {filename}")
-
-        for filename in os.listdir(self.data_files_dir_path):
-            filepath = os.path.join(self.data_files_dir_path, filename)
-            if os.path.isfile(filepath) and filename != "README.md":
-                os.remove(filepath)
-                print(f"[ INFO ] Deleted: {filename}")
+        counts = delete_library_rows(self.session)
+        if vacuum:
+            self.session.close()
+            Base.metadata.drop_all(self.engine, tables = LIBRARY_TABLES)
+            Base.metadata.create_all(self.engine, tables = LIBRARY_TABLES)
+            # the search index, hierarchy and counter triggers were dropped together with the tables
+            with self.engine.begin() as connection:
+                rebuild_search_index(connection)
+                create_hierarchy_index(connection)
+                create_modification_counters(connection)
+            with self.engine.connect().execution_options(isolation_level = 'AUTOCOMMIT') as connection:
+                connection.exec_driver_sql('VACUUM')
+
+        counts['stored_files'] = clear_directory(self.data_cad_dir_path, workers = workers) + clear_directory(self.data_files_dir_path, workers = workers)
+        counts['blobs'] = clear_directory(self.blob_store.root_path, keep = (), workers = workers)
+        counts['thumbnails'] = self.thumbnail_cache.clear()
+        return counts
+
+    # Removes a part of the library: the archived components (archived = True) and/or the components of one supplier
+    # (supplier_uuid), together with their hierarchy and file link rows. Files which are no longer referenced by any
+    # remaining component are deleted with their stored files and blobs. Returns the number of deleted rows per table
+    # and the number of removed files.
+    def purge(self, archived = False, supplier_uuid = None, workers = None):
+        conditions = []
+        parameters = []
+        if archived:
+            conditions.append("is_archived = 1")
+        if supplier_uuid is not None:
+            conditions.append(f"supplier_id IN (SELECT id FROM {Supplier.__tablename__} WHERE uuid = ?)")
+            parameters.append(supplier_uuid)
+        if not conditions:
+            raise ValueError("purge requires archived = True and/or a supplier_uuid, use delete_all to clear the library")
+
+        counts, deleted_files = delete_components(self.session, " AND ".join(conditions), tuple(parameters))
+        file_paths = stored_file_paths((file_uuid for file_uuid, _, _ in deleted_files), (self.data_cad_dir_path, self.data_files_dir_path))
+        counts['stored_files'] = remove_files(file_paths, workers = workers)
+        digests = unreferenced_digests(self.session, (content_hash for _, _, content_hash in deleted_files))
+        counts['blobs'] = remove_files((self.blob_store.path(digest) for digest in digests), workers = workers)
+        return counts
            
     def add_sample_materials(self):
         # Adding sample materials
@@ -325,14 +690,20 @@ class PartsLibrary:
         else:
             print(f"Material '{material_name}' already exists. Skipping addition.")
 
-    # Prints the total value of all components in the parts library database.
-    # Currently not relevant, because the components counts is not being tracked.
-    def total_value(self):
+    # Returns the inventory value (unit_price * quantity) of the library, computed by a single aggregate query in the
+    # database and grouped by currency and optionally by 'supplier', 'supplier_uuid', 'lifecycle_state' or 'material'.
+    # The quantities are taken from Component.quantity or from a mapping of component uuid -> quantity.
+    # Returns a list of dicts with the group keys, 'components', 'quantity' and the exact 'value' as Decimal.
+    def inventory_value(self, group_by = ('currency',), quantities = None, include_archived = False):
+        return inventory_value(self.session, group_by = group_by, quantities = quantities, include_archived = include_archived)
+
+    # Returns the total value of all components in the parts library database as Decimal for one currency, or with
+    # currency = None as dict currency -> Decimal like BillOfMaterials.cost_by_currency, values in different currencies
+    # are never added up.
+    def total_value(self, currency = None, quantities = None):
         from decimal import Decimal
-        all_components = self.session.query(Component).all()
-
-        total_value = Decimal(0.0)
-        for component in all_components:
-            total_value = Decimal(total_value) + (Decimal(component.unit_price) * component.quantity)
 
-        return total_value
+        totals = {group['currency']: group['value'] for group in self.inventory_value(quantities = quantities)}
+        if currency is None:
+            return totals
+        return totals.get(currency, Decimal(0))
@@ -0,0 +1,194 @@
+import json
+import os
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from xml.etree import ElementTree
+
+from .models import CadMetadata
+
+
+# Version of the extracted metadata, results of older versions are extracted again
+EXTRACTOR_VERSION = 1
+
+FCSTD_SUFFIX = '.fcstd'
+
+# Value elements of FreeCAD properties and their conversion
+_VALUE_ELEMENTS = {
+    'String': str,
+    'Uuid': str,
+    'Bool': lambda value: value == 'true',
+    'Integer': int,
+    'Float': float,
+}
+
+# Placement of an object as position and rotation quaternion (Q0..Q3 = x, y, z, w)
+def _placement(attributes):
+    return {
+        'position': [float(attributes.get(key, 0.0)) for key in ('Px', 'Py', 'Pz')],
+        'rotation': [float(attributes.get(key, 0.0)) for key in ('Q0', 'Q1', 'Q2', 'Q3')],
+    }
+
+
+# Reads the properties of the document and its objects from a Document.xml or GuiDocument.xml stream with iterparse,
+# elements are cleared once read. Returns (attributes of the root element, document properties, dict object name ->
+# object) where every object has its type (Document.xml only) and its properties with simple values: strings,
+# booleans, numbers, placements, maps, enumerations resolved to their names and the names of the shape members.
+def _parse_document(stream, object_tags = ('Object',)):
+    root = None
+    document_properties = {}
+    objects = {}
+    path = []
+    properties = None
+    property_name = None
+    property_type = None
+    value = None
+    enum_names = None
+    for event, element in ElementTree.iterparse(stream, events = ('start', 'end')):
+        tag = element.tag
+        if event == 'start':
+            path.append(tag)
+            parent = path[-2] if len(path) > 1 else None
+            if root is None:
+                root = element
+            elif tag in object_tags and parent in ('Objects', 'ObjectData', 'ViewProviderData'):
+                name = element.get('name')
+                obj = objects.setdefault(name, {'name': name, 'properties': {}})
+                if element.get('type'):
+                    obj['type'] = element.get('type')
+                properties = obj['properties']
+            elif tag == 'Properties' and parent == root.tag:
+                properties = document_properties
+            elif tag == 'Property' and properties is not None:
+                property_name = element.get('name')
+                property_type = element.get('type')
+                value = None
+                enum_names = None
+            elif property_name is None:
+                pass
+            elif tag == 'CustomEnumList':
+                enum_names = []
+            elif tag == 'Enum' and enum_names is not None:
+                enum_names.append(element.get('value'))
+            elif tag == 'Item' and parent == 'Map' and isinstance(value, dict):
+                value[element.get('key')] = element.get('value')
+            elif parent == 'Property' and value is None:
+                if tag in _VALUE_ELEMENTS and 'value' in element.attrib:
+                    value = _VALUE_ELEMENTS[tag](element.get('value'))
+                elif tag == 'PropertyPlacement':
+                    value = _placement(element.attrib)
+                elif tag == 'Part' and element.get('file'):
+                    value = element.get('file')
+                elif tag == 'Map':
+                    value = {}
+        else:
+            path.pop()
+            if tag == 'Property' and property_name is not None:
+                if property_type == 'App::PropertyEnumeration' and enum_names and isinstance(value, int) and 0 <= value < len(enum_names):
+                    value = enum_names[value]
+                if value is not None:
+                    properties[property_name] = value
+                property_name = None
+                element.clear()
+            elif tag in object_tags or tag == 'Properties':
+                if tag == 'Properties' and path and path[-1] == root.tag:
+                    properties = None
+                element.clear()
+    attributes = dict(root.attrib) if root is not None else {}
+    return attributes, document_properties, objects
+
+
+# Extracts the metadata of a FreeCAD document (FCStd file) from its Document.xml and GuiDocument.xml without FreeCAD.
+# Returns a dict with the versions and properties of the document (label, dates, author, license, ...), the number
+# of objects per type and the objects with their label, placement, shape member and other simple properties, e.g.
+# the lengths of pads and the parameters of fasteners, and their visibility. Bounding boxes are not recorded in the
+# XML, the shapes are only referenced as BREP members. Raises zipfile.BadZipFile or KeyError for files which are
+# not FreeCAD documents and ElementTree.ParseError for malformed XML.
+def read_fcstd_metadata(file_path):
+    with zipfile.ZipFile(file_path) as archive:
+        with archive.open('Document.xml') as stream:
+            attributes, document_properties, objects = _parse_document(stream)
+        visibility = {}
+        if 'GuiDocument.xml' in archive.NameToInfo:
+            with archive.open('GuiDocument.xml') as stream:
+                _, _, view_providers = _parse_document(stream, object_tags = ('ViewProvider',))
+            visibility = {name: provider['properties'].get('Visibility') for name, provider in view_providers.items()}
+        has_thumbnail = 'thumbnails/Thumbnail.png' in archive.NameToInfo
+
+    object_list = []
+    for name, obj in objects.items():
+        properties = obj['properties']
+        visible = properties.pop('Visibility', None)
+        object_list.append({
+            'name': name,
+            'type': obj.get('type'),
+            'label': properties.pop('Label', name),
+            'placement': properties.pop('Placement', None),
+            'shape': properties.pop('Shape', None),
+            'visible': visibility.get(name, visible),
+            'properties': properties,
+        })
+    return {
+        'schema_version': attributes.get('SchemaVersion'),
+        'program_version': attributes.get('ProgramVersion'),
+        'file_version': attributes.get('FileVersion'),
+        'properties': document_properties,
+        'object_count': len(object_list),
+        'object_types': dict(Counter(obj['type'] for obj in object_list if obj['type'])),
+        'objects': object_list,
+        'has_thumbnail': has_thumbnail,
+    }
+
+
+# Worker of the process pool, returns (digest, metadata as JSON, error)
+def _extract(item):
+    digest, file_path = item
+    try:
+        return digest, json.dumps(read_fcstd_metadata(file_path), separators = (',', ':')), None
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile, ElementTree.ParseError) as e:
+        return digest, None, f"{type(e).__name__}: {e}"[:1000]
+
+
+# Returns the digests of the files whose metadata was extracted by the current extractor version
+def cached_digests(connection):
+    return set(connection.exec_driver_sql(f"SELECT content_hash FROM {CadMetadata.__tablename__} WHERE extractor_version = ?", (EXTRACTOR_VERSION,)).scalars())
+
+
+# Extracts the metadata of files given as dict digest -> path in a process pool and stores it in the cad_metadata
+# table by digest, also for files which could not be read, so they are not read again. The results are committed
+# in batches, an interrupted run keeps its progress. Returns the number of extracted files and the dict
+# digest -> error of the files which could not be read.
+def extract_cad_metadata(engine, files, workers = None, batch_size = 500):
+    workers = workers or os.cpu_count() or 1
+    statement = f"INSERT OR REPLACE INTO {CadMetadata.__tablename__} (content_hash, extractor_version, data, error, date_extracted) VALUES (?, ?, ?, ?, ?)"
+    items = list(files.items())
+    errors = {}
+    extracted = 0
+
+    def store(results):
+        timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')
+        with engine.begin() as connection:
+            connection.exec_driver_sql(statement, [(digest, EXTRACTOR_VERSION, data, error, timestamp) for digest, data, error in results])
+
+    def run(results):
+        nonlocal extracted
+        batch = []
+        for result in results:
+            batch.append(result)
+            if result[2] is not None:
+                errors[result[0]] = result[2]
+            if len(batch) >= batch_size:
+                store(batch)
+                extracted += len(batch)
+                batch = []
+        if batch:
+            store(batch)
+            extracted += len(batch)
+
+    if workers == 1 or len(items) < 2:
+        run(map(_extract, items))
+    else:
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            run(executor.map(_extract, items, chunksize = max(1, min(64, len(items) // (workers * 4)))))
+    return extracted - len(errors), errors
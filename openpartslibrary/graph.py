@@ -0,0 +1,237 @@
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+from .models import Component, ComponentClosure, ComponentComponent, ModificationCounter
+from .profiles import begin_transaction
+
+
+# Counters of the changes of the components and their links, invalidate the cached component graphs. Archiving or
+# restoring a component only changes the graphs without archived components, it increments the archive counter.
+HIERARCHY_COUNTER = 'hierarchy'
+ARCHIVE_COUNTER = 'archive'
+
+_components = Component.__tablename__
+_links = ComponentComponent.__tablename__
+_closure = ComponentClosure.__tablename__
+_counters = ModificationCounter.__tablename__
+
+
+def _changed(columns):
+    return ' OR '.join(f"old.{column} IS NOT new.{column}" for column in columns)
+
+
+# Triggers as name -> (event, counter). Updates only count if they change a column of the graph, e.g. a new price
+# keeps the cached graphs.
+COUNTER_TRIGGERS = {
+    f"{_counters}_{_components}_insert": (f"AFTER INSERT ON {_components}", HIERARCHY_COUNTER),
+    f"{_counters}_{_components}_update": (f"AFTER UPDATE OF id, uuid, number, name ON {_components} WHEN {_changed(('id', 'uuid', 'number', 'name'))}", HIERARCHY_COUNTER),
+    f"{_counters}_{_components}_archive": (f"AFTER UPDATE OF is_archived ON {_components} WHEN COALESCE(old.is_archived, 0) IS NOT COALESCE(new.is_archived, 0)", ARCHIVE_COUNTER),
+    f"{_counters}_{_components}_delete": (f"AFTER DELETE ON {_components}", HIERARCHY_COUNTER),
+    f"{_counters}_{_links}_insert": (f"AFTER INSERT ON {_links}", HIERARCHY_COUNTER),
+    f"{_counters}_{_links}_update": (f"AFTER UPDATE OF parent_component_id, child_component_id, quantity ON {_links} WHEN {_changed(('parent_component_id', 'child_component_id', 'quantity'))}", HIERARCHY_COUNTER),
+    f"{_counters}_{_links}_delete": (f"AFTER DELETE ON {_links}", HIERARCHY_COUNTER),
+}
+
+# Every insert, delete and relevant update of a component or link, also through plain SQL or another process,
+# increments a counter in the same transaction
+COUNTER_SCHEMA = {
+    name: f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN UPDATE {_counters} SET counter = counter + 1 WHERE name = '{counter}'; END"
+    for name, (event, counter) in COUNTER_TRIGGERS.items()
+}
+
+
+# Creates the counters and their triggers if they do not exist yet
+def create_modification_counters(connection):
+    for name in (HIERARCHY_COUNTER, ARCHIVE_COUNTER):
+        connection.exec_driver_sql(f"INSERT OR IGNORE INTO {_counters} (name, counter) VALUES (?, 0)", (name,))
+    for statement in COUNTER_SCHEMA.values():
+        connection.exec_driver_sql(statement)
+
+
+# Replaces the counter triggers of older versions, which counted every update of a component or link
+def recreate_modification_counters(connection):
+    for (trigger,) in connection.exec_driver_sql(f"SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE '{_counters}%'").fetchall():
+        connection.exec_driver_sql(f"DROP TRIGGER {trigger}")
+    create_modification_counters(connection)
+
+
+# Increments the hierarchy counter once for all components and links inserted inside the context instead of once per
+# row by the insert triggers. Like search.bulk_index_inserts the triggers are dropped inside the explicitly opened
+# transaction and recreated on exit, also if the inserts fail, so the context must not contain a commit.
+@contextmanager
+def bulk_counter_inserts(connection):
+    names = tuple(f"{_counters}_{table}_insert" for table in (_components, _links))
+    existing = set(connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name IN (?, ?)", names).scalars())
+    if not existing:
+        yield
+        return
+    begin_transaction(connection)
+    for name in existing:
+        connection.exec_driver_sql(f"DROP TRIGGER {name}")
+    try:
+        yield
+        connection.exec_driver_sql(f"UPDATE {_counters} SET counter = counter + 1 WHERE name = ?", (HIERARCHY_COUNTER,))
+    finally:
+        for name in existing:
+            connection.exec_driver_sql(COUNTER_SCHEMA[name])
+
+
+# Returns the current values of all modification counters as dict name -> value
+def modification_counters(connection):
+    return dict(connection.exec_driver_sql(f"SELECT name, counter FROM {_counters}").fetchall())
+
+
+# The component hierarchy as compact arrays: the nodes ordered by component id, and the links as node indexes in
+# compressed sparse row form, the children of node i are children[offsets[i]:offsets[i + 1]]. The NetworkX and
+# Cytoscape representations are built on first use and kept with the graph.
+class ComponentGraph:
+    def __init__(self, ids, uuids, numbers, names, parents, children, quantities):
+        self.ids = ids
+        self.uuids = uuids
+        self.numbers = numbers
+        self.names = names
+        self.parents = parents
+        self.children = children
+        self.quantities = quantities
+        self.offsets = np.searchsorted(parents, np.arange(len(ids) + 1))
+        for array in (self.ids, self.parents, self.children, self.quantities, self.offsets):
+            array.flags.writeable = False
+        self._networkx = None
+        self._cytoscape = None
+        self._cytoscape_json = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        return f"<ComponentGraph(nodes={len(self.ids)}, edges={len(self.children)})>"
+
+    # Returns the node index of the component with the given id, None if it is not part of the graph
+    def index(self, component_id):
+        i = int(np.searchsorted(self.ids, component_id))
+        return i if i < len(self.ids) and self.ids[i] == component_id else None
+
+    # Returns the node indexes of the children of a node
+    def children_of(self, i):
+        return self.children[self.offsets[i]:self.offsets[i + 1]]
+
+    # Returns a frozen NetworkX DiGraph with an edge from every assembly to each of its children. The nodes are the
+    # component uuids with the id, number and name as attributes, the edges have the quantity as attribute.
+    # nx.DiGraph(graph) returns a modifiable copy.
+    def to_networkx(self):
+        if self._networkx is None:
+            import networkx as nx
+
+            graph = nx.DiGraph()
+            graph.add_nodes_from(
+                (uuid, {'id': int(id), 'number': number, 'name': name})
+                for id, uuid, number, name in zip(self.ids, self.uuids, self.numbers, self.names)
+            )
+            graph.add_edges_from(
+                (self.uuids[parent], self.uuids[child], {'quantity': float(quantity)})
+                for parent, child, quantity in zip(self.parents.tolist(), self.children.tolist(), self.quantities)
+            )
+            self._networkx = nx.freeze(graph)
+        return self._networkx
+
+    # Returns the graph as Cytoscape.js elements, {'nodes': [...], 'edges': [...]} with the component uuids as node ids
+    def to_cytoscape(self):
+        if self._cytoscape is None:
+            self._cytoscape = {
+                'nodes': [
+                    {'data': {'id': uuid, 'label': name, 'number': number}}
+                    for uuid, number, name in zip(self.uuids, self.numbers, self.names)
+                ],
+                'edges': [
+                    {'data': {'source': self.uuids[parent], 'target': self.uuids[child], 'quantity': float(quantity)}}
+                    for parent, child, quantity in zip(self.parents.tolist(), self.children.tolist(), self.quantities)
+                ],
+            }
+        return self._cytoscape
+
+    # Returns to_cytoscape() serialized as JSON text
+    def to_cytoscape_json(self):
+        if self._cytoscape_json is None:
+            self._cytoscape_json = json.dumps(self.to_cytoscape(), separators = (',', ':'))
+        return self._cytoscape_json
+
+
+# Builds the component graph with one query for the nodes and one for the links. With root_uuid the graph contains
+# the component and everything below it (from the closure table), otherwise all components which are part of a link,
+# with include_unlinked also the components without links. Returns None if there is no component with root_uuid.
+def build_component_graph(session, root_uuid = None, include_archived = True, include_unlinked = False):
+    connection = session.connection()
+    conditions = []
+    link_condition = ""
+    parameters = ()
+    if root_uuid is not None:
+        root_id = f"(SELECT id FROM {_components} WHERE uuid = ?)"
+        below = f"(SELECT descendant_id FROM {_closure} WHERE ancestor_id = {root_id})"
+        conditions.append(f"(id = {root_id} OR id IN {below})")
+        link_condition = f"WHERE parent_component_id = {root_id} OR parent_component_id IN {below}"
+        parameters = (root_uuid, root_uuid)
+    elif not include_unlinked:
+        conditions.append(f"(id IN (SELECT parent_component_id FROM {_links}) OR id IN (SELECT child_component_id FROM {_links}))")
+    if not include_archived:
+        conditions.append("COALESCE(is_archived, 0) = 0")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    nodes = connection.exec_driver_sql(f"SELECT id, uuid, number, name FROM {_components} {where} ORDER BY id", parameters).fetchall()
+    if root_uuid is not None and not nodes:
+        return None
+    links = connection.exec_driver_sql(
+        f"SELECT parent_component_id, child_component_id, COALESCE(quantity, 1) FROM {_links} {link_condition} "
+        f"ORDER BY parent_component_id, child_component_id", parameters).fetchall()
+
+    ids = np.fromiter((row[0] for row in nodes), dtype = 'int64', count = len(nodes))
+    link_parents = np.fromiter((row[0] for row in links), dtype = 'int64', count = len(links))
+    link_children = np.fromiter((row[1] for row in links), dtype = 'int64', count = len(links))
+    quantities = np.fromiter((row[2] for row in links), dtype = 'float64', count = len(links))
+
+    # links to components outside of the graph, e.g. archived ones, are dropped
+    parents = np.searchsorted(ids, link_parents)
+    children = np.searchsorted(ids, link_children)
+    keep = (parents < len(ids)) & (children < len(ids))
+    keep[keep] = (ids[parents[keep]] == link_parents[keep]) & (ids[children[keep]] == link_children[keep])
+    return ComponentGraph(ids, [row[1] for row in nodes], [row[2] for row in nodes], [row[3] for row in nodes],
+                          parents[keep], children[keep], quantities[keep])
+
+
+# Keeps the most recently used component graphs per filter together with the values of the counters at build time,
+# the hierarchy counter and for graphs without archived components also the archive counter. A graph is rebuilt when
+# one of them has changed since, so every lookup costs one query while nothing changed.
+class GraphCache:
+    def __init__(self, max_entries = 16):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session, root_uuid = None, include_archived = True, include_unlinked = False):
+        key = (root_uuid, bool(include_archived), bool(include_unlinked))
+        # the counter is read before the graph, a change in between only causes an unneeded rebuild later on
+        counters = modification_counters(session.connection())
+        counter = counters.get(HIERARCHY_COUNTER)
+        if counter is not None and not include_archived:
+            counter = (counter, counters.get(ARCHIVE_COUNTER))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and counter is not None and entry[0] == counter:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        graph = build_component_graph(session, root_uuid, include_archived = include_archived, include_unlinked = include_unlinked)
+        if counter is not None:
+            with self._lock:
+                self._entries[key] = (counter, graph)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last = False)
+        return graph
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,126 @@
+from sqlalchemy import exc, select
+
+from .models import Component, ComponentClosure, ComponentComponent
+
+
+# Message of the error raised by the database for a link which would make a component its own descendant
+CYCLE_ERROR = 'link would create a cycle in the component hierarchy'
+
+_closure = ComponentClosure.__tablename__
+_links = ComponentComponent.__tablename__
+
+
+# The paths added (or removed) by a link parent -> child: every ancestor of the parent, including the parent itself,
+# to every descendant of the child, including the child itself, with the number of paths per length. A trigger can not
+# contain a WITH clause, so the sets are subqueries.
+def _link_paths(parent, child):
+    return (
+        f"SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth + 1 AS depth, SUM(a.paths * d.paths) AS paths "
+        f"FROM (SELECT {parent} AS ancestor_id, 0 AS depth, 1 AS paths "
+        f"UNION ALL SELECT ancestor_id, depth, paths FROM {_closure} WHERE descendant_id = {parent}) a, "
+        f"(SELECT {child} AS descendant_id, 0 AS depth, 1 AS paths "
+        f"UNION ALL SELECT descendant_id, depth, paths FROM {_closure} WHERE ancestor_id = {child}) d "
+        f"GROUP BY a.ancestor_id, d.descendant_id, a.depth + d.depth + 1"
+    )
+
+
+def _add_link(parent, child):
+    return (
+        f"INSERT INTO {_closure} (ancestor_id, descendant_id, depth, paths) {_link_paths(parent, child)} "
+        f"ON CONFLICT (ancestor_id, descendant_id, depth) DO UPDATE SET paths = paths + excluded.paths;"
+    )
+
+
+# Without cycles the paths to the parent and from the child do not run over the link, so they stay as they are and
+# only the rows between the two sets are decremented
+def _remove_link(parent, child):
+    between = (
+        f"ancestor_id IN (SELECT {parent} UNION ALL SELECT ancestor_id FROM {_closure} WHERE descendant_id = {parent}) "
+        f"AND descendant_id IN (SELECT {child} UNION ALL SELECT descendant_id FROM {_closure} WHERE ancestor_id = {child})"
+    )
+    return (
+        f"UPDATE {_closure} SET paths = paths - COALESCE((SELECT p.paths FROM ({_link_paths(parent, child)}) p "
+        f"WHERE p.ancestor_id = {_closure}.ancestor_id AND p.descendant_id = {_closure}.descendant_id AND p.depth = {_closure}.depth), 0) "
+        f"WHERE {between}; "
+        f"DELETE FROM {_closure} WHERE paths <= 0 AND {between};"
+    )
+
+
+def _check_link(parent, child):
+    return (
+        f"SELECT RAISE(ABORT, '{_links}: {CYCLE_ERROR}') WHERE {parent} = {child} "
+        f"OR EXISTS (SELECT 1 FROM {_closure} WHERE ancestor_id = {child} AND descendant_id = {parent});"
+    )
+
+
+_parent_child = 'parent_component_id, child_component_id'
+
+# The closure table is kept in sync with the links by triggers, so every change of the hierarchy, also through plain
+# SQL, updates it in the same transaction. Links which would create a cycle are rejected before they are written.
+HIERARCHY_SCHEMA = (
+    f"CREATE TRIGGER IF NOT EXISTS {_closure}_check_insert BEFORE INSERT ON {_links} BEGIN "
+    f"{_check_link('new.parent_component_id', 'new.child_component_id')} END",
+    f"CREATE TRIGGER IF NOT EXISTS {_closure}_check_update BEFORE UPDATE OF {_parent_child} ON {_links} BEGIN "
+    f"{_check_link('new.parent_component_id', 'new.child_component_id')} END",
+    f"CREATE TRIGGER IF NOT EXISTS {_closure}_insert AFTER INSERT ON {_links} BEGIN "
+    f"{_add_link('new.parent_component_id', 'new.child_component_id')} END",
+    f"CREATE TRIGGER IF NOT EXISTS {_closure}_delete AFTER DELETE ON {_links} BEGIN "
+    f"{_remove_link('old.parent_component_id', 'old.child_component_id')} END",
+    f"CREATE TRIGGER IF NOT EXISTS {_closure}_update AFTER UPDATE OF {_parent_child} ON {_links} BEGIN "
+    f"{_remove_link('old.parent_component_id', 'old.child_component_id')} "
+    f"{_add_link('new.parent_component_id', 'new.child_component_id')} END",
+)
+
+
+# Creates the triggers which maintain the closure table if they do not exist yet
+def create_hierarchy_index(connection):
+    for statement in HIERARCHY_SCHEMA:
+        connection.exec_driver_sql(statement)
+
+
+# Returns True if the exception was raised for a link which would create a cycle
+def is_cycle_error(error):
+    return isinstance(error, exc.DBAPIError) and CYCLE_ERROR in str(error.orig)
+
+
+# Refills the closure table from the links, one path length at a time, e.g. for databases which were changed while
+# the triggers did not exist. Raises ValueError if the links contain a cycle. Returns the number of rows.
+def rebuild_hierarchy_index(connection):
+    create_hierarchy_index(connection)
+    connection.exec_driver_sql(f"DELETE FROM {_closure}")
+    count = connection.exec_driver_sql(
+        f"INSERT INTO {_closure} (ancestor_id, descendant_id, depth, paths) "
+        f"SELECT parent_component_id, child_component_id, 1, count(*) FROM {_links} GROUP BY {_parent_child}").rowcount
+    depth = 1
+    while count:
+        # a component below itself means a cycle, the next lengths would never run out
+        cycle = connection.exec_driver_sql(
+            f"SELECT c.number FROM {_closure} cl JOIN {Component.__tablename__} c ON c.id = cl.ancestor_id "
+            f"WHERE cl.depth = ? AND cl.ancestor_id = cl.descendant_id", (depth,)).scalars().all()
+        if cycle:
+            raise ValueError(f"The component hierarchy contains a cycle through the components {', '.join(map(str, cycle))}")
+        count = connection.exec_driver_sql(
+            f"INSERT INTO {_closure} (ancestor_id, descendant_id, depth, paths) "
+            f"SELECT cl.ancestor_id, l.child_component_id, cl.depth + 1, SUM(cl.paths) "
+            f"FROM {_closure} cl JOIN {_links} l ON l.parent_component_id = cl.descendant_id "
+            f"WHERE cl.depth = ? GROUP BY cl.ancestor_id, l.child_component_id", (depth,)).rowcount
+        depth += 1
+    return connection.exec_driver_sql(f"SELECT count(*) FROM {_closure}").scalar()
+
+
+# Returns the components which contain the component with the given uuid, directly or in a subassembly (with
+# direct_only only the direct parents), ordered by number. A single range scan of the closure index per lookup.
+def where_used(session, uuid, direct_only = False):
+    component_id = select(Component.id).where(Component.uuid == uuid).scalar_subquery()
+    ancestors = select(ComponentClosure.ancestor_id).where(ComponentClosure.descendant_id == component_id)
+    if direct_only:
+        ancestors = ancestors.where(ComponentClosure.depth == 1)
+    return list(session.scalars(select(Component).where(Component.id.in_(ancestors)).order_by(Component.number, Component.id)))
+
+
+# Returns True if the component with descendant_uuid is contained in the component with ancestor_uuid at any depth
+def contains(session, ancestor_uuid, descendant_uuid):
+    ancestor_id = select(Component.id).where(Component.uuid == ancestor_uuid).scalar_subquery()
+    descendant_id = select(Component.id).where(Component.uuid == descendant_uuid).scalar_subquery()
+    statement = select(ComponentClosure.depth).where(ComponentClosure.ancestor_id == ancestor_id, ComponentClosure.descendant_id == descendant_id).limit(1)
+    return session.execute(statement).first() is not None
@@ -0,0 +1,440 @@
+import hashlib
+import time
+import uuid
+from datetime import datetime
+from itertools import repeat
+from pathlib import Path
+
+import pandas as pd
+
+from .cad import hash_files
+from .graph import bulk_counter_inserts
+from .models import Component, File, Supplier
+from .search import bulk_index_inserts
+
+
+# Columns of the components sheet which are required for a component to be imported
+REQUIRED_COMPONENT_COLUMNS = ('uuid', 'number', 'name')
+
+# Columns of the components table which are written by the import. supplier_id is resolved from the
+# supplier_uuid or supplier_name column of the sheet, all other columns are copied 1:1 from the sheet.
+COMPONENT_COLUMNS = ('uuid', 'number', 'name', 'description', 'revision', 'lifecycle_state', 'owner', 'material', 'unit_price', 'currency', 'supplier_id')
+
+# Modes of import_components, see there
+IMPORT_MODES = ('insert', 'upsert')
+
+# Columns which are stored as text, even if the spreadsheet engine parsed them as numbers
+COMPONENT_TEXT_COLUMNS = ('uuid', 'number', 'name', 'revision', 'supplier_uuid', 'supplier_name', 'cad_file_name')
+
+# Columns of the suppliers sheet, street_number is stored as house_number
+REQUIRED_SUPPLIER_COLUMNS = ('uuid', 'name')
+SUPPLIER_COLUMNS = ('uuid', 'name', 'description', 'street', 'house_number', 'postal_code', 'city', 'country')
+SUPPLIER_TEXT_COLUMNS = ('uuid', 'name', 'house_number', 'postal_code')
+SUPPLIER_COLUMN_ALIASES = {'street_number': 'house_number'}
+
+
+# Structured result of a spreadsheet import, replaces the former print() per rejected row
+class ImportReport:
+    def __init__(self, source = None):
+        self.source = source
+        self.rows_read = 0
+        self.imported = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.archived = 0
+        self.suppliers_imported = 0
+        self.unknown_suppliers = {}
+        self.cad_files_linked = 0
+        self.cad_blobs_stored = 0
+        self.missing_cad_files = []
+        self.rejected = []
+        self.transactions = 0
+        self.elapsed = 0.0
+        self.error = None
+
+    # Records a list of rejected rows, row numbers are 1-based spreadsheet rows including the header
+    def reject(self, rows, uuids, reason):
+        for row, row_uuid in zip(rows, uuids):
+            self.rejected.append({'row': int(row), 'uuid': None if pd.isna(row_uuid) else row_uuid, 'reason': reason})
+
+    @property
+    def rejected_counts(self):
+        counts = {}
+        for rejected_row in self.rejected:
+            counts[rejected_row['reason']] = counts.get(rejected_row['reason'], 0) + 1
+        return counts
+
+    @property
+    def rows_per_second(self):
+        if self.elapsed <= 0:
+            return 0.0
+        return self.rows_read / self.elapsed
+
+    def to_dict(self):
+        return {
+            'source': str(self.source) if self.source is not None else None,
+            'rows_read': self.rows_read,
+            'imported': self.imported,
+            'updated': self.updated,
+            'unchanged': self.unchanged,
+            'archived': self.archived,
+            'suppliers_imported': self.suppliers_imported,
+            'unknown_suppliers': self.unknown_suppliers,
+            'cad_files_linked': self.cad_files_linked,
+            'cad_blobs_stored': self.cad_blobs_stored,
+            'missing_cad_files': self.missing_cad_files,
+            'rejected': len(self.rejected),
+            'rejected_counts': self.rejected_counts,
+            'transactions': self.transactions,
+            'elapsed': self.elapsed,
+            'rows_per_second': self.rows_per_second,
+            'error': self.error,
+        }
+
+    def __repr__(self):
+        return f"<ImportReport(rows_read={self.rows_read}, imported={self.imported}, updated={self.updated}, unchanged={self.unchanged}, archived={self.archived}, rejected={len(self.rejected)}, elapsed={self.elapsed:.2f}s)>"
+
+
+# Converts the text columns of the sheet into strings, e.g. a revision parsed as 1.0 becomes '1'
+def _as_text(series):
+    if pd.api.types.is_string_dtype(series):
+        return series.str.strip()
+
+    def convert(value):
+        if pd.isna(value):
+            return None
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return str(value).strip()
+    return series.map(convert)
+
+
+# Validates the required columns of the whole dataframe at once and returns the accepted rows.
+# Rejected rows are recorded in the report. Rows whose uuid is contained in existing_uuids are rejected as well.
+# When importing in chunks, seen_uuids collects the accepted uuids to detect duplicates across chunks.
+def validate_components(components_df, report, existing_uuids = (), seen_uuids = None):
+    return _validate_rows(components_df, report, 'Components', REQUIRED_COMPONENT_COLUMNS, COMPONENT_TEXT_COLUMNS, '', existing_uuids, seen_uuids)
+
+
+# Validates the suppliers sheet like validate_components, the reasons of rejected rows start with 'supplier'
+def validate_suppliers(suppliers_df, report, existing_uuids = (), seen_uuids = None):
+    suppliers_df = suppliers_df.rename(columns = SUPPLIER_COLUMN_ALIASES)
+    return _validate_rows(suppliers_df, report, 'Suppliers', REQUIRED_SUPPLIER_COLUMNS, SUPPLIER_TEXT_COLUMNS, 'supplier ', existing_uuids, seen_uuids)
+
+
+def _validate_rows(df, report, sheet_label, required_columns, text_columns, reason_prefix, existing_uuids, seen_uuids):
+    df = df.copy()
+    for column in required_columns:
+        if column not in df.columns:
+            raise ValueError(f"{sheet_label} sheet is missing the required column '{column}'")
+    for column in text_columns:
+        if column in df.columns:
+            df[column] = _as_text(df[column])
+
+    # Spreadsheet row numbers: the index is 0-based and the first row holds the header
+    row_numbers = df.index.to_series() + 2
+
+    accepted = pd.Series(True, index=df.index)
+    for column in required_columns:
+        missing = accepted & (df[column].isna() | (df[column] == ''))
+        report.reject(row_numbers[missing], df['uuid'][missing], f"{reason_prefix}missing {column}")
+        accepted &= ~missing
+
+    duplicated = accepted & df['uuid'].duplicated(keep='first')
+    if seen_uuids is not None and len(seen_uuids):
+        duplicated |= accepted & df['uuid'].isin(seen_uuids)
+    report.reject(row_numbers[duplicated], df['uuid'][duplicated], f"{reason_prefix}duplicate uuid in sheet")
+    accepted &= ~duplicated
+
+    if len(existing_uuids):
+        existing = accepted & df['uuid'].isin(existing_uuids)
+        report.reject(row_numbers[existing], df['uuid'][existing], f"{reason_prefix}uuid already exists")
+        accepted &= ~existing
+
+    if seen_uuids is not None:
+        seen_uuids.update(df['uuid'][accepted])
+    return df[accepted]
+
+
+# Converts the accepted rows into parameter tuples for an executemany insert into the components table.
+# The tuples are passed to the driver as they are, so the values are converted into their stored form here:
+# datetimes use the storage format of the SQLite DateTime type and booleans are stored as integers.
+def component_records(components_df, timestamp = None):
+    timestamp = (timestamp or datetime.utcnow()).strftime('%Y-%m-%d %H:%M:%S.%f')
+    columns = []
+    for column in COMPONENT_COLUMNS:
+        if column in components_df.columns:
+            values = components_df[column].astype(object)
+            columns.append(values.where(values.notna(), None).tolist())
+        else:
+            columns.append([None] * len(components_df))
+    return list(zip(*columns, repeat(timestamp), repeat(timestamp), repeat(0)))
+
+
+# Normalized supplier name for matching components to suppliers by name
+def _supplier_name_key(name):
+    if name is None or pd.isna(name):
+        return None
+    return ' '.join(str(name).split()).casefold()
+
+
+# Inserts the suppliers of the suppliers sheet which do not exist in the library yet, existing suppliers are kept
+# as they are. The suppliers are committed before the components are imported, so that components can be linked.
+def import_suppliers(session, chunks, report, batch_size = 5000):
+    table = Supplier.__table__
+    default_description = table.c.description.default.arg
+    timestamp = datetime.utcnow()
+    seen_uuids = set()
+    try:
+        existing_uuids = set(session.connection().exec_driver_sql(f"SELECT uuid FROM {table.name}").scalars())
+        for suppliers_df in chunks:
+            accepted_df = validate_suppliers(suppliers_df, report, seen_uuids = seen_uuids)
+            accepted_df = accepted_df[~accepted_df['uuid'].isin(existing_uuids)]
+            columns = [column for column in SUPPLIER_COLUMNS if column in accepted_df.columns]
+            records_df = accepted_df[columns].astype(object)
+            records = records_df.where(records_df.notna(), None).to_dict('records')
+            for record in records:
+                for column in SUPPLIER_COLUMNS:
+                    record.setdefault(column, None)
+                if record['description'] is None:
+                    record['description'] = default_description
+                record['date_created'] = timestamp
+                record['date_modified'] = timestamp
+            for start in range(0, len(records), batch_size):
+                session.execute(table.insert(), records[start:start + batch_size])
+            report.suppliers_imported += len(records)
+        session.commit()
+        report.transactions += 1
+    except Exception:
+        session.rollback()
+        raise
+    return report
+
+
+# In-memory index of the suppliers of the library. It is built with a single query once per import and
+# resolves the supplier of every component without a query per row.
+class SupplierIndex:
+    def __init__(self, session):
+        self.ids_by_uuid = {}
+        self.ids_by_name = {}
+        rows = session.connection().exec_driver_sql(f"SELECT id, uuid, name FROM {Supplier.__tablename__} ORDER BY id")
+        for supplier_id, supplier_uuid, name in rows:
+            self.ids_by_uuid[supplier_uuid] = supplier_id
+            self.ids_by_name.setdefault(_supplier_name_key(name), supplier_id)
+
+    # Returns the supplier ids for the rows of a components dataframe, matched by supplier_uuid first and by
+    # supplier_name second. Referenced suppliers which are not found are counted in report.unknown_suppliers.
+    def resolve(self, components_df, report):
+        supplier_ids = pd.Series(pd.NA, index = components_df.index, dtype = 'Int64')
+        references = pd.Series(None, index = components_df.index, dtype = object)
+        for column, ids, key in (('supplier_uuid', self.ids_by_uuid, None), ('supplier_name', self.ids_by_name, _supplier_name_key)):
+            if column not in components_df.columns:
+                continue
+            values = components_df[column].astype(object)
+            values = values.where(values.notna() & (values != ''), None)
+            keys = values.map(key) if key is not None else values
+            supplier_ids = supplier_ids.fillna(keys.map(ids).astype('Int64'))
+            references = references.where(references.notna(), values)
+
+        unknown = references.notna() & supplier_ids.isna()
+        for reference, count in references[unknown].value_counts().items():
+            report.unknown_suppliers[reference] = report.unknown_suppliers.get(reference, 0) + int(count)
+        return supplier_ids
+
+
+# Fingerprint of the imported columns of a component, used to detect changed rows when re-importing a sheet.
+# Numbers are compared as floats, so a price stored as 1 in the database matches a price of 1.0 in the sheet.
+def component_fingerprint(values):
+    normalized = []
+    for value in values:
+        if value is None:
+            normalized.append('')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            normalized.append(repr(float(value)))
+        else:
+            normalized.append(str(value))
+    return hashlib.blake2b('\x1f'.join(normalized).encode('utf-8'), digest_size = 16).digest()
+
+
+# Loads the id, archive state and fingerprint of all components in a single query, keyed by uuid.
+# The fingerprints are computed from the stored values, so changes made in the library since the last
+# import are detected as well.
+def load_component_fingerprints(session):
+    columns = ('id', 'is_archived') + COMPONENT_COLUMNS
+    rows = session.connection().exec_driver_sql(f"SELECT {', '.join(columns)} FROM {Component.__tablename__}")
+    return {row[2]: (row[0], bool(row[1]), component_fingerprint(row[2:])) for row in rows}
+
+
+# Writes component records in batches of executemany statements. With rows_per_transaction set to None all
+# batches are written in a single transaction which is committed by commit(), otherwise the session is committed
+# after every rows_per_transaction rows.
+class ComponentWriter:
+    def __init__(self, session, report, batch_size = 5000, rows_per_transaction = None):
+        self.session = session
+        self.report = report
+        self.batch_size = batch_size
+        self.rows_per_transaction = rows_per_transaction
+        self.rows_in_transaction = 0
+        table = Component.__tablename__
+        columns = COMPONENT_COLUMNS + ('date_created', 'date_modified', 'is_archived')
+        self.insert_statement = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        assignments = [f"{column} = ?" for column in COMPONENT_COLUMNS[1:]] + ['date_modified = ?', 'is_archived = 0']
+        self.update_statement = f"UPDATE {table} SET {', '.join(assignments)} WHERE id = ?"
+        self.archive_statement = f"UPDATE {table} SET is_archived = 1, date_modified = ? WHERE id = ?"
+
+    # Inserts records created by component_records(), the search index and the hierarchy counter are updated once per batch
+    def write(self, records):
+        for start in range(0, len(records), self.batch_size):
+            batch = records[start:start + self.batch_size]
+            connection = self.session.connection()
+            with bulk_index_inserts(connection), bulk_counter_inserts(connection):
+                connection.exec_driver_sql(self.insert_statement, batch)
+            self._written(len(batch))
+        self.report.imported += len(records)
+
+    # Updates existing components, takes (id, record) tuples with records created by component_records()
+    def update(self, records):
+        self._execute(self.update_statement, [record[1:len(COMPONENT_COLUMNS)] + (record[len(COMPONENT_COLUMNS) + 1], component_id) for component_id, record in records])
+        self.report.updated += len(records)
+
+    def archive(self, component_ids, timestamp = None):
+        timestamp = (timestamp or datetime.utcnow()).strftime('%Y-%m-%d %H:%M:%S.%f')
+        self._execute(self.archive_statement, [(timestamp, component_id) for component_id in component_ids])
+        self.report.archived += len(component_ids)
+
+    def _execute(self, statement, parameters):
+        for start in range(0, len(parameters), self.batch_size):
+            batch = parameters[start:start + self.batch_size]
+            self.session.connection().exec_driver_sql(statement, batch)
+            self._written(len(batch))
+
+    def _written(self, count):
+        self.rows_in_transaction += count
+        if self.rows_per_transaction is not None and self.rows_in_transaction >= self.rows_per_transaction:
+            self.commit()
+
+    def commit(self):
+        if self.rows_in_transaction:
+            self.session.commit()
+            self.report.transactions += 1
+            self.rows_in_transaction = 0
+
+
+# Validates and writes components chunk by chunk, used by PartsLibrary.import_from_spreadsheet.
+# Each chunk is validated and written before the next chunk is read from the iterator. The optional progress
+# callback is called with the report after every chunk.
+#
+# mode = 'insert': rows with an uuid which already exists in the library are rejected.
+# mode = 'upsert': rows with an existing uuid are compared with the stored component by fingerprint. Unchanged rows
+#                  are skipped and only changed rows are updated. With archive_missing, components which are not
+#                  contained in the sheet are archived.
+#
+# With a SupplierIndex the supplier of every component is resolved from its supplier_uuid or supplier_name.
+# With a cad_file_names dict the cad_file_name of every accepted row is collected by component uuid, see link_cad_files.
+def import_components(session, chunks, report, mode = 'insert', archive_missing = False, batch_size = 5000, rows_per_transaction = None, progress = None, supplier_index = None, cad_file_names = None):
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"Unknown import mode '{mode}', expected one of {IMPORT_MODES}")
+    if archive_missing and mode != 'upsert':
+        raise ValueError("archive_missing requires mode = 'upsert'")
+
+    started = time.perf_counter()
+    elapsed = report.elapsed
+    seen_uuids = set()
+    writer = ComponentWriter(session, report, batch_size, rows_per_transaction)
+    try:
+        if mode == 'upsert':
+            existing = load_component_fingerprints(session)
+            existing_uuids = ()
+        else:
+            existing = {}
+            existing_uuids = set(session.connection().exec_driver_sql(f"SELECT uuid FROM {Component.__tablename__}").scalars())
+
+        for components_df in chunks:
+            report.rows_read += len(components_df)
+            accepted_df = validate_components(components_df, report, existing_uuids, seen_uuids)
+            if supplier_index is not None:
+                accepted_df = accepted_df.assign(supplier_id = supplier_index.resolve(accepted_df, report))
+            if cad_file_names is not None and 'cad_file_name' in accepted_df.columns:
+                with_cad_file = accepted_df['cad_file_name'].notna() & (accepted_df['cad_file_name'] != '')
+                cad_file_names.update(zip(accepted_df['uuid'][with_cad_file], accepted_df['cad_file_name'][with_cad_file]))
+            records = component_records(accepted_df)
+            if existing:
+                new_records = []
+                changed_records = []
+                for record in records:
+                    stored = existing.get(record[0])
+                    if stored is None:
+                        new_records.append(record)
+                    elif stored[1] or stored[2] != component_fingerprint(record[:len(COMPONENT_COLUMNS)]):
+                        changed_records.append((stored[0], record))
+                    else:
+                        report.unchanged += 1
+                writer.write(new_records)
+                writer.update(changed_records)
+            else:
+                writer.write(records)
+            report.elapsed = elapsed + time.perf_counter() - started
+            if progress is not None:
+                progress(report)
+
+        if archive_missing:
+            writer.archive([component_id for component_uuid, (component_id, is_archived, _) in existing.items() if not is_archived and component_uuid not in seen_uuids])
+        writer.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        report.elapsed = elapsed + time.perf_counter() - started
+    return report
+
+
+# Validates and writes a single components dataframe
+def import_components_dataframe(session, components_df, report, mode = 'insert', archive_missing = False, batch_size = 5000, rows_per_transaction = None):
+    return import_components(session, [components_df], report, mode, archive_missing, batch_size, rows_per_transaction)
+
+
+# Links components to their CAD files. cad_file_names maps component uuids to file names in components_cad_dir_path.
+# The files are hashed in a thread pool and every unique content is stored once in the blob store. Each component
+# gets its own File row referencing the blob by its digest, the content is not copied again for it. Components which
+# already reference a CAD file with the same content are skipped.
+def link_cad_files(session, report, cad_file_names, components_cad_dir_path, blob_store, workers = None, batch_size = 5000):
+    components_cad_dir_path = Path(components_cad_dir_path).expanduser().resolve()
+    source_paths = {component_uuid: components_cad_dir_path / file_name for component_uuid, file_name in cad_file_names.items()}
+    digests = hash_files(source_paths.values(), workers = workers)
+    for source_path, digest in digests.items():
+        if isinstance(digest, Exception):
+            report.missing_cad_files.append(str(source_path))
+        elif blob_store.add(source_path, digest):
+            report.cad_blobs_stored += 1
+
+    try:
+        connection = session.connection()
+        stored_digests = {row[1]: (row[0], row[2]) for row in connection.exec_driver_sql(
+            f"SELECT c.id, c.uuid, f.content_hash FROM {Component.__tablename__} c LEFT JOIN {File.__tablename__} f ON f.id = c.cad_file_id")}
+        timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')
+        file_records = []
+        component_file_uuids = []
+        for component_uuid, source_path in source_paths.items():
+            digest = digests[source_path]
+            stored = stored_digests.get(component_uuid)
+            if isinstance(digest, Exception) or stored is None or stored[1] == digest:
+                continue
+            file_uuid = str(uuid.uuid4())
+            file_records.append((file_uuid, source_path.name, 'This is a CAD file.', digest, timestamp, timestamp))
+            component_file_uuids.append((stored[0], file_uuid))
+
+        # the ids of the inserted files are read back with a single query, this process is the only writer
+        last_file_id = connection.exec_driver_sql(f"SELECT COALESCE(MAX(id), 0) FROM {File.__tablename__}").scalar()
+        for start in range(0, len(file_records), batch_size):
+            connection.exec_driver_sql(f"INSERT INTO {File.__tablename__} (uuid, name, description, content_hash, date_created, date_modified) VALUES (?, ?, ?, ?, ?, ?)", file_records[start:start + batch_size])
+        file_ids = dict((row[1], row[0]) for row in connection.exec_driver_sql(f"SELECT id, uuid FROM {File.__tablename__} WHERE id > ?", (last_file_id,)))
+        links = [(file_ids[file_uuid], component_id) for component_id, file_uuid in component_file_uuids]
+        for start in range(0, len(links), batch_size):
+            connection.exec_driver_sql(f"UPDATE {Component.__tablename__} SET cad_file_id = ? WHERE id = ?", links[start:start + batch_size])
+        session.commit()
+        report.transactions += 1
+        report.cad_files_linked += len(links)
+    except Exception:
+        session.rollback()
+        raise
+    return report
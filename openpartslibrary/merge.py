@@ -0,0 +1,261 @@
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+
+from .archive import ARCHIVE_FILE_DIRS
+from .graph import bulk_counter_inserts
+from .hierarchy import is_cycle_error
+from .profiles import begin_transaction
+from .models import Component, ComponentComponent, ComponentFile, File, Material, Supplier
+from .search import bulk_index_inserts
+
+
+# Result of merging another library into this one
+class MergeReport:
+    def __init__(self, source = None):
+        self.source = source
+        self.inserted = {}
+        self.existing = {}
+        self.conflicts = []
+        self.rejected_links = []
+        self.blobs_copied = 0
+        self.missing_files = []
+        self.elapsed = 0.0
+
+    def to_dict(self):
+        return {
+            'source': str(self.source) if self.source is not None else None,
+            'inserted': dict(self.inserted),
+            'existing': dict(self.existing),
+            'conflicts': list(self.conflicts),
+            'rejected_links': list(self.rejected_links),
+            'blobs_copied': self.blobs_copied,
+            'missing_files': list(self.missing_files),
+            'elapsed': self.elapsed,
+        }
+
+    def __repr__(self):
+        return f"<MergeReport(inserted={self.inserted}, existing={self.existing}, blobs_copied={self.blobs_copied}, rejected_links={len(self.rejected_links)})>"
+
+
+# Returns the columns of a table which exist in the source database as well, without the id. Databases of older
+# versions lack some columns, these are left at their defaults.
+def _merged_columns(source, model):
+    source_columns = {row[1] for row in source.execute(f"PRAGMA table_info({model.__tablename__})")}
+    return [column.name for column in model.__table__.columns if column.name != 'id' and column.name in source_columns]
+
+
+# Copies the rows of a table with uuid from the source database in batches. Rows whose uuid exists already are kept
+# as they are, new rows are inserted, after transform(values) which may change the values or return None to skip the
+# row. Returns a dict source id -> id in this library for the new and the existing rows.
+def _merge_rows(source, connection, model, columns, report, batch_size, transform = None):
+    table = model.__tablename__
+    target_ids = dict(connection.exec_driver_sql(f"SELECT uuid, id FROM {table}").fetchall())
+    last_id = connection.exec_driver_sql(f"SELECT COALESCE(MAX(id), 0) FROM {table}").scalar()
+    insert_statement = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    uuid_index = columns.index('uuid')
+    id_map = {}
+    new_ids = {}
+    cursor = source.execute(f"SELECT id, {', '.join(columns)} FROM {table} ORDER BY id")
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        batch = []
+        for row in rows:
+            values = row[1:]
+            target_id = target_ids.get(values[uuid_index])
+            if target_id is not None:
+                id_map[row[0]] = target_id
+                continue
+            if transform is not None:
+                values = transform(values)
+                if values is None:
+                    continue
+            new_ids[values[uuid_index]] = row[0]
+            batch.append(values)
+        if batch:
+            connection.exec_driver_sql(insert_statement, batch)
+    # the ids of the inserted rows are read back with a single query, this process is the only writer
+    for row_uuid, row_id in connection.exec_driver_sql(f"SELECT uuid, id FROM {table} WHERE id > ?", (last_id,)):
+        id_map[new_ids[row_uuid]] = row_id
+    report.inserted[table] = len(new_ids)
+    report.existing[table] = len(id_map) - len(new_ids)
+    return id_map
+
+
+# Inserts component links which do not exist yet. A batch which contains a link that would create a cycle is
+# inserted again row by row, the links which exist already are ignored and the cycles are rejected.
+def _merge_component_links(source, connection, component_ids, report, batch_size):
+    table = ComponentComponent.__tablename__
+    columns = _merged_columns(source, ComponentComponent)
+    if 'parent_component_id' not in columns:
+        return
+    insert_statement = f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    parent_index = columns.index('parent_component_id')
+    child_index = columns.index('child_component_id')
+    inserted = 0
+    cursor = source.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id")
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        batch = []
+        for row in rows:
+            values = list(row)
+            values[parent_index] = component_ids.get(row[parent_index])
+            values[child_index] = component_ids.get(row[child_index])
+            if values[parent_index] is not None and values[child_index] is not None:
+                batch.append(tuple(values))
+        if not batch:
+            continue
+        # the rows of a batch inserted before a cycle was detected are rolled back, so the retry counts every row once
+        begin_transaction(connection)
+        try:
+            with connection.begin_nested():
+                inserted += connection.exec_driver_sql(insert_statement, batch).rowcount
+        except Exception as e:
+            if not is_cycle_error(e):
+                raise
+            for values in batch:
+                try:
+                    inserted += connection.exec_driver_sql(insert_statement, values).rowcount
+                except Exception as e:
+                    if not is_cycle_error(e):
+                        raise
+                    uuids = dict(connection.exec_driver_sql(f"SELECT id, uuid FROM {Component.__tablename__} WHERE id IN (?, ?)", (values[parent_index], values[child_index])).fetchall())
+                    report.rejected_links.append((uuids[values[parent_index]], uuids[values[child_index]]))
+    report.inserted[table] = inserted
+
+
+# Inserts links of components to attached files which do not exist yet
+def _merge_file_links(source, connection, component_ids, file_ids, report, batch_size):
+    table = ComponentFile.__tablename__
+    columns = _merged_columns(source, ComponentFile)
+    if 'component_id' not in columns:
+        return
+    insert_statement = (
+        f"INSERT INTO {table} ({', '.join(columns)}) SELECT {', '.join('?' * len(columns))} "
+        f"WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE component_id = ? AND file_id = ?)"
+    )
+    component_index = columns.index('component_id')
+    file_index = columns.index('file_id')
+    inserted = 0
+    cursor = source.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id")
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        batch = []
+        for row in rows:
+            values = list(row)
+            values[component_index] = component_ids.get(row[component_index])
+            values[file_index] = file_ids.get(row[file_index])
+            if values[component_index] is not None and values[file_index] is not None:
+                batch.append(tuple(values) + (values[component_index], values[file_index]))
+        if batch:
+            inserted += connection.exec_driver_sql(insert_statement, batch).rowcount
+    report.inserted[table] = inserted
+
+
+# Returns the stored files of an archive as dict file uuid -> (directory, member name, file name)
+def _stored_files(archive):
+    prefix = f"{archive.data_dir()}/"
+    stored = {}
+    for name in archive.names():
+        if not name.startswith(prefix):
+            continue
+        directory, _, file_name = name[len(prefix):].partition('/')
+        if directory in ARCHIVE_FILE_DIRS and file_name and '/' not in file_name:
+            stored[Path(file_name).stem] = (directory, name, file_name)
+    return stored
+
+
+# Merges the library of an archive (see mount.ArchiveFiles) into this library, the database of the archive has to be
+# extracted to database_path. Suppliers, materials, files and components are matched by uuid: rows which exist in this
+# library are kept unchanged, new rows are inserted in batches while the source tables are read, with the ids of
+# suppliers, CAD files, components and files remapped in memory. Materials whose name exists under another uuid are
+# reported as conflicts. The links of the hierarchy and to attached files are added if they do not exist, links which
+# would create a cycle are rejected. The content of new files is copied from the archive into the blob store only if
+# it does not contain it yet, files without content hash into the data directory. Everything is written in a single transaction; the stored files are written before it is
+# committed and are left behind if the merge fails.
+def merge_archive(session, archive, database_path, blob_store, data_dir_path, report, batch_size = 5000):
+    started = time.perf_counter()
+    data_dir_path = Path(data_dir_path)
+    stored_files = _stored_files(archive)
+    source = sqlite3.connect(f"file:{Path(database_path).as_posix()}?mode=ro", uri = True)
+    try:
+        connection = session.connection()
+
+        supplier_ids = {}
+        columns = _merged_columns(source, Supplier)
+        if 'uuid' in columns:
+            supplier_ids = _merge_rows(source, connection, Supplier, columns, report, batch_size)
+
+        columns = _merged_columns(source, Material)
+        if 'uuid' in columns:
+            name_index = columns.index('name')
+            material_names = set(connection.exec_driver_sql(f"SELECT name FROM {Material.__tablename__}").scalars())
+
+            def new_material(values):
+                if values[name_index] in material_names:
+                    report.conflicts.append({'table': Material.__tablename__, 'uuid': values[columns.index('uuid')], 'name': values[name_index]})
+                    return None
+                material_names.add(values[name_index])
+                return values
+
+            _merge_rows(source, connection, Material, columns, report, batch_size, transform = new_material)
+
+        file_ids = {}
+        columns = _merged_columns(source, File)
+        if 'uuid' in columns:
+            uuid_index = columns.index('uuid')
+            hash_index = columns.index('content_hash') if 'content_hash' in columns else None
+
+            def copy_file(values):
+                stored = stored_files.get(values[uuid_index])
+                if stored is None:
+                    report.missing_files.append(values[uuid_index])
+                    return values
+                directory, member, file_name = stored
+                digest = values[hash_index] if hash_index is not None else None
+                if digest is None:
+                    archive.extract(member, data_dir_path / directory / file_name)
+                    return values
+                if digest not in blob_store:
+                    temporary_path = blob_store.root_path / f"{file_name}.{uuid.uuid4().hex}.tmp"
+                    archive.extract(member, temporary_path)
+                    blob_store.add(temporary_path, digest, move = True)
+                    report.blobs_copied += 1
+                return values
+
+            file_ids = _merge_rows(source, connection, File, columns, report, batch_size, transform = copy_file)
+
+        # the hierarchy counter is incremented once for all new components and links
+        with bulk_counter_inserts(connection):
+            component_ids = {}
+            columns = _merged_columns(source, Component)
+            if 'uuid' in columns:
+                remapped = [(columns.index(column), ids) for column, ids in (('supplier_id', supplier_ids), ('cad_file_id', file_ids)) if column in columns]
+
+                def remap_component(values):
+                    values = list(values)
+                    for index, ids in remapped:
+                        values[index] = ids.get(values[index])
+                    return tuple(values)
+
+                # the search index is filled once for all new components
+                with bulk_index_inserts(connection):
+                    component_ids = _merge_rows(source, connection, Component, columns, report, batch_size, transform = remap_component)
+
+            _merge_component_links(source, connection, component_ids, report, batch_size)
+        _merge_file_links(source, connection, component_ids, file_ids, report, batch_size)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        source.close()
+        report.elapsed = time.perf_counter() - started
+    return report
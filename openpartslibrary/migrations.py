@@ -0,0 +1,125 @@
+from .graph import create_modification_counters, recreate_modification_counters
+from .hierarchy import rebuild_hierarchy_index
+from .models import Base, Component, ComponentClosure, ComponentComponent, ComponentFile, File, Supplier
+from .search import rebuild_search_index
+
+
+# Adds a column of a model to an existing table, does nothing if the column exists already
+def add_column(connection, column):
+    table = column.table
+    existing_columns = {row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({table.name})")}
+    if column.name in existing_columns:
+        return
+    column_type = column.type.compile(dialect = connection.dialect)
+    connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+
+
+# Creates the indexes declared in the models which do not exist yet
+def create_indexes(connection, tables = None):
+    for table in tables or Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst = True)
+
+
+def _add_legacy_columns(connection):
+    add_column(connection, Component.__table__.c.material)
+    add_column(connection, Component.__table__.c.quantity)
+    add_column(connection, File.__table__.c.content_hash)
+
+
+def _add_lookup_indexes(connection):
+    create_indexes(connection, (Component.__table__, ComponentComponent.__table__, ComponentFile.__table__, File.__table__))
+
+
+def _add_listing_indexes(connection):
+    # rows without date_modified would drop out of the keyset pagination by date_modified
+    connection.exec_driver_sql(f"UPDATE {Component.__tablename__} SET date_modified = COALESCE(date_created, CURRENT_TIMESTAMP) WHERE date_modified IS NULL")
+    create_indexes(connection, (Component.__table__,))
+
+
+def _add_bom_columns(connection):
+    add_column(connection, ComponentComponent.__table__.c.quantity)
+    add_column(connection, ComponentComponent.__table__.c.reference_designator)
+    add_column(connection, Component.__table__.c.volume)
+    connection.exec_driver_sql(f"UPDATE {ComponentComponent.__tablename__} SET quantity = 1 WHERE quantity IS NULL")
+
+
+# Ordered schema migrations as (version, description, function). Every function gets a connection inside a transaction
+# and has to be idempotent. New migrations are appended with the next version number, released ones are never changed.
+MIGRATIONS = (
+    (1, 'add the material, quantity and content_hash columns', _add_legacy_columns),
+    (2, 'add indexes for component, file and hierarchy lookups', _add_lookup_indexes),
+    (3, 'add the full-text search index of the components', rebuild_search_index),
+    (4, 'add indexes for listing the components by name and modification date', _add_listing_indexes),
+    (5, 'add quantities and reference designators to the component hierarchy and the component volume', _add_bom_columns),
+    (6, 'add the closure table of the component hierarchy', rebuild_hierarchy_index),
+    (7, 'add the modification counter of the component hierarchy', create_modification_counters),
+    (8, 'count only the changes of the component hierarchy which change its graph', recreate_modification_counters),
+)
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+# Returns the schema version recorded in the database (SQLite user_version, 0 for databases without version)
+def schema_version(connection):
+    return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def _set_schema_version(connection, version):
+    connection.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+
+# Creates the missing tables and brings the schema of an existing database to SCHEMA_VERSION by applying the pending
+# migrations in order, each one in its own transaction together with the new version number. Returns the list of
+# applied versions.
+def migrate(engine):
+    with engine.begin() as connection:
+        new_database = not connection.exec_driver_sql("SELECT count(*) FROM sqlite_master WHERE type = 'table'").scalar()
+        Base.metadata.create_all(connection)
+        current_version = schema_version(connection)
+
+    # the migrations also create the parts of the schema which are not declared in the models, like the search index
+    applied = []
+    for version, description, migration in MIGRATIONS:
+        if version <= current_version:
+            continue
+        with engine.begin() as connection:
+            migration(connection)
+            _set_schema_version(connection, version)
+        if not new_database:
+            print(f"[ INFO ] Migrated the database schema to version {version}: {description}")
+        applied.append(version)
+    return applied
+
+
+# Common lookups which have to be index seeks, as name -> (SQL, parameters)
+INDEXED_QUERIES = {
+    'component by uuid': (f"SELECT * FROM {Component.__tablename__} WHERE uuid = ?", ('',)),
+    'component by number': (f"SELECT * FROM {Component.__tablename__} WHERE number = ?", ('',)),
+    'components page by name': (f"SELECT * FROM {Component.__tablename__} WHERE (name, id) > (?, ?) ORDER BY name, id LIMIT 50", ('', 0)),
+    'components page by modification date': (f"SELECT * FROM {Component.__tablename__} WHERE (date_modified, id) > (?, ?) ORDER BY date_modified, id LIMIT 50", ('', 0)),
+    'components by lifecycle state': (f"SELECT * FROM {Component.__tablename__} WHERE lifecycle_state = ?", ('',)),
+    'active components by lifecycle state': (f"SELECT * FROM {Component.__tablename__} WHERE is_archived = 0 AND lifecycle_state = ?", ('',)),
+    'components by supplier': (f"SELECT * FROM {Component.__tablename__} WHERE supplier_id = ?", (0,)),
+    'component by cad file': (f"SELECT * FROM {Component.__tablename__} WHERE cad_file_id = ?", (0,)),
+    'files of component': (f"SELECT file_id FROM {ComponentFile.__tablename__} WHERE component_id = ?", (0,)),
+    'components of file': (f"SELECT component_id FROM {ComponentFile.__tablename__} WHERE file_id = ?", (0,)),
+    'children of component': (f"SELECT child_component_id FROM {ComponentComponent.__tablename__} WHERE parent_component_id = ?", (0,)),
+    'parents of component': (f"SELECT parent_component_id FROM {ComponentComponent.__tablename__} WHERE child_component_id = ?", (0,)),
+    'assemblies containing component': (f"SELECT DISTINCT ancestor_id FROM {ComponentClosure.__tablename__} WHERE descendant_id = ?", (0,)),
+    'component contained in assembly': (f"SELECT 1 FROM {ComponentClosure.__tablename__} WHERE ancestor_id = ? AND descendant_id = ? LIMIT 1", (0, 0)),
+    'file by uuid': (f"SELECT * FROM {File.__tablename__} WHERE uuid = ?", ('',)),
+    'file by content hash': (f"SELECT * FROM {File.__tablename__} WHERE content_hash = ?", ('',)),
+    'supplier by uuid': (f"SELECT * FROM {Supplier.__tablename__} WHERE uuid = ?", ('',)),
+}
+
+
+# Runs EXPLAIN QUERY PLAN for the queries (default INDEXED_QUERIES) and returns a dict name -> list of plan steps
+# for the queries which scan a table instead of searching an index. An empty dict means all queries use an index.
+def check_query_plans(connection, queries = None):
+    full_scans = {}
+    for name, (statement, parameters) in (queries or INDEXED_QUERIES).items():
+        plan = [row[3] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+        if any(step.startswith('SCAN') for step in plan):
+            full_scans[name] = plan
+    return full_scans
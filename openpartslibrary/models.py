@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Numeric, Enum, ForeignKey, UniqueConstraint, Boolean, Text
+from sqlalchemy import Column, Integer, String, Float, DateTime, Numeric, Enum, ForeignKey, UniqueConstraint, Boolean, Text, Index
 from sqlalchemy.orm import DeclarativeBase, relationship, backref
 from flask_login import UserMixin
 from datetime import datetime
@@ -15,13 +15,33 @@ class ComponentComponent(Base):
     id = Column(Integer, primary_key=True)
 
     parent_component_id = Column(Integer, ForeignKey("components.id"), nullable=False)
-    child_component_id = Column(Integer, ForeignKey("components.id"), nullable=False)
+    child_component_id = Column(Integer, ForeignKey("components.id"), nullable=False, index=True)
+    quantity = Column(Float, default=1)                 # units of the child per unit of the parent
+    reference_designator = Column(String(200))          # e.g. 'R1, R2' or the position in the drawing
 
     __table_args__ = (UniqueConstraint("parent_component_id", "child_component_id", name="uq_parent_child"),)
 
     def __repr__(self):
         return f"<ComponentComponent(id={self.id}, parent_component_id={self.parent_component_id}, child_component_id={self.child_component_id})>"
 
+class ComponentClosure(Base):
+    __tablename__ = 'component_closure'
+
+    # One row per ancestor, descendant and path length (depth 1 = direct child) with the number of paths of this length,
+    # maintained by the triggers in hierarchy.py
+    ancestor_id = Column(Integer, primary_key=True)
+    descendant_id = Column(Integer, primary_key=True)
+    depth = Column(Integer, primary_key=True)
+    paths = Column(Integer, nullable=False, default=1)
+
+    __table_args__ = (
+        Index('ix_component_closure_descendant_id_ancestor_id', 'descendant_id', 'ancestor_id', 'depth'),
+        {'sqlite_with_rowid': False},
+    )
+
+    def __repr__(self):
+        return f"<ComponentClosure(ancestor_id={self.ancestor_id}, descendant_id={self.descendant_id}, depth={self.depth}, paths={self.paths})>"
+
 class ComponentSupplier(Base):
     __tablename__ = 'component_supplier'
 
@@ -32,10 +52,10 @@ class ComponentFile(Base):
 
     id = Column(Integer, primary_key=True)
     component_id = Column(Integer, ForeignKey('components.id'), nullable=False)
-    file_id = Column(Integer, ForeignKey('files.id'), nullable=False)
+    file_id = Column(Integer, ForeignKey('files.id'), nullable=False, index=True)
     date_linked = Column(DateTime, default=datetime.utcnow)
 
-    __table__args__ = (UniqueConstraint('component_id', 'file_id', name='uq_component_file'),)
+    __table_args__ = (Index('ix_component_file_component_id_file_id', 'component_id', 'file_id'),)
 
 '''
 Tables
@@ -56,19 +76,21 @@ class Component(Base):
 
     id = Column(Integer, unique=True, primary_key=True)
     uuid = Column(String(32), unique=True, nullable=False)
-    name = Column(String(200), nullable=False)
-    number = Column(String(50), nullable=False)
+    name = Column(String(200), nullable=False, index=True)
+    number = Column(String(50), nullable=False, index=True)
 
     description = Column(String(1000))
     revision = Column(String(10))
-    lifecycle_state = Column(String(50))
+    lifecycle_state = Column(String(50), index=True)
     owner = Column(String(100))
     material = Column(String(200))
     unit_price = Column(Numeric(10, 2))
     currency = Column(String(3))
+    quantity = Column(Integer, default=0)       # units in stock
+    volume = Column(Float)                      # m³, the mass is computed from the density of the material
     
     # CAD related
-    cad_file_id = Column(Integer, ForeignKey('files.id'))
+    cad_file_id = Column(Integer, ForeignKey('files.id'), index=True)
     cad_file = relationship('File', back_populates='cad_component', uselist=False, foreign_keys=[cad_file_id])
 
     # Supplier
@@ -79,20 +101,26 @@ class Component(Base):
     # Many-to-many relationship with Files
     files = relationship('File', secondary='component_file', back_populates='components')
     
-    # Enables multi-level hierarchies - components that this component is parent of
+    # Enables multi-level hierarchies - components that this component is parent of.
+    # Loaded on access only, whole subtrees are loaded with PartsLibrary.load_tree
     children = relationship(
         "Component",
         secondary = "component_component",
         primaryjoin = id == ComponentComponent.parent_component_id,
         secondaryjoin = id == ComponentComponent.child_component_id,
-        backref = backref("parents", lazy="joined"),
-        lazy = "joined",
+        backref = backref("parents", lazy="select"),
+        lazy = "select",
     )
 
     date_created = Column(DateTime, default=datetime.utcnow)
-    date_modified = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    date_modified = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     is_archived = Column(Boolean, default=False)
 
+    __table_args__ = (
+        Index('ix_components_supplier_id_is_archived', 'supplier_id', 'is_archived'),
+        Index('ix_components_is_archived_lifecycle_state', 'is_archived', 'lifecycle_state'),
+    )
+
     def __repr__(self):
         return f"<Component(id={self.id}, number={self.number}, name={self.name})>"
 
@@ -126,6 +154,7 @@ class File(Base):
     uuid = Column(String(32), unique=True, nullable=False)
     name = Column(String(200), nullable=False)
     description = Column(String(1000))
+    content_hash = Column(String(64), index=True)       # SHA-256 of the content, key of the blob in the blob store
     date_created = Column(DateTime, default=datetime.utcnow)
     date_modified = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -174,6 +203,29 @@ class Material(Base):
     def __repr__(self):
         return f"<Material {self.name}>"
 
+# Counters which are incremented by triggers on every change of the counted tables, used to invalidate caches
+class ModificationCounter(Base):
+    __tablename__ = "modification_counters"
+
+    name = Column(String(50), primary_key=True)
+    counter = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ModificationCounter {self.name}: {self.counter}>"
+
+# Metadata extracted from CAD files (see fcstd.py), cached by the SHA-256 of the file content
+class CadMetadata(Base):
+    __tablename__ = "cad_metadata"
+
+    content_hash = Column(String(64), primary_key=True)
+    extractor_version = Column(Integer, nullable=False)
+    data = Column(Text)                         # JSON, None if the file could not be read
+    error = Column(String(1000))
+    date_extracted = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<CadMetadata {self.content_hash}>"
+
 # Future feature, not part of MVP
 class Requirement(Base):
     __tablename__ = "requirements"
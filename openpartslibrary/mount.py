@@ -0,0 +1,162 @@
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import uuid
+import zipfile
+from pathlib import Path
+
+from sqlalchemy import create_engine
+
+from .archive import ARCHIVE_DATA_DIR, MANIFEST_NAME
+from .migrations import migrate
+
+
+# Default directory for the databases extracted from mounted archives
+DEFAULT_CACHE_DIR = Path(tempfile.gettempdir()) / 'openpartslibrary-archives'
+
+COPY_BUFFER_SIZE = 16 * 1024 * 1024
+
+# Local file header: signature, versions, flags, method, time, date, crc, sizes, file name length, extra field length
+_LOCAL_HEADER = struct.Struct('<4s5HL2L2H')
+
+
+# The files of a .oplp archive, read in place. The central directory is read on first access, members which are
+# stored without compression (e.g. FCStd files) are returned as zero-copy views of the memory-mapped archive.
+class ArchiveFiles:
+    def __init__(self, archive_path):
+        self.archive_path = Path(archive_path)
+        self._zip = None
+        self._mmap = None
+        self._database_name = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        with self._lock:
+            if self._zip is None:
+                self._zip = zipfile.ZipFile(self.archive_path)
+                with open(self.archive_path, 'rb') as f:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        return self._zip
+
+    def __contains__(self, name):
+        return self.info(name) is not None
+
+    # Returns the ZipInfo of a member, None if the archive does not contain it
+    def info(self, name):
+        return self._open().NameToInfo.get(name)
+
+    def names(self):
+        return self._open().namelist()
+
+    # Returns the member name of the database, taken from the manifest. Archives of older versions have no manifest
+    # and contain the data directory as it was, with the database as <data directory>/parts.db.
+    def database_name(self):
+        if self._database_name is None:
+            if MANIFEST_NAME in self:
+                with self.open(MANIFEST_NAME) as f:
+                    self._database_name = json.load(f)['database']
+            else:
+                names = [name for name in self.names() if name.count('/') == 1 and name.endswith('/parts.db')]
+                if not names:
+                    raise ValueError(f"'{self.archive_path}' contains no library database")
+                self._database_name = names[0]
+        return self._database_name
+
+    # Returns the directory of the database and the stored files in the archive
+    def data_dir(self):
+        return self.database_name().rpartition('/')[0] or ARCHIVE_DATA_DIR
+
+    # Returns the member name of a stored file of the library ('cad' or 'files' directory)
+    def stored_name(self, name, directory = 'cad'):
+        return f"{self.data_dir()}/{directory}/{Path(name).name}"
+
+    def _info(self, name):
+        info = self.info(name)
+        if info is None:
+            raise KeyError(f"'{self.archive_path}' has no member '{name}'")
+        return info
+
+    # Returns the position of the data of a stored member in the archive, after its local header
+    def _data_offset(self, info):
+        header = _LOCAL_HEADER.unpack_from(self._mmap, info.header_offset)
+        return info.header_offset + _LOCAL_HEADER.size + header[-2] + header[-1]
+
+    # Returns the content of a member. Stored members are returned as memoryview of the mapped archive without
+    # copying, compressed ones as bytes. Raises KeyError if the archive does not contain the member.
+    def read(self, name):
+        info = self._info(name)
+        if info.compress_type == zipfile.ZIP_STORED:
+            start = self._data_offset(info)
+            return memoryview(self._mmap)[start:start + info.file_size]
+        return self._zip.read(info)
+
+    # Returns a binary file object of a member for reading it in parts
+    def open(self, name):
+        return self._open().open(self._info(name))
+
+    # Copies a member into a file, stored members straight from the mapped archive
+    def extract(self, name, destination_path):
+        info = self._info(name)
+        with open(destination_path, 'wb') as destination:
+            if info.compress_type == zipfile.ZIP_STORED:
+                start = self._data_offset(info)
+                view = memoryview(self._mmap)
+                for offset in range(start, start + info.file_size, COPY_BUFFER_SIZE):
+                    destination.write(view[offset:min(offset + COPY_BUFFER_SIZE, start + info.file_size)])
+                view.release()
+            else:
+                with self._zip.open(info) as source:
+                    shutil.copyfileobj(source, destination, COPY_BUFFER_SIZE)
+        return destination_path
+
+    def close(self):
+        with self._lock:
+            if self._zip is not None:
+                self._zip.close()
+                try:
+                    self._mmap.close()
+                except BufferError:
+                    # views returned by read are still in use, the mapping is released with them
+                    pass
+                self._zip = None
+                self._mmap = None
+
+
+# Prepares a .oplp archive for opening in place. Every archive path has its own cache directory, the database is
+# extracted into it and migrated to the current schema once per version of the archive (size and modification time)
+# and reused by later mounts, older versions of the same archive are removed. Returns the cache directory of the
+# archive, the path of the database and the ArchiveFiles.
+def mount_archive(archive_path, cache_dir_path = None):
+    archive_path = Path(archive_path).expanduser().resolve()
+    cache_dir_path = Path(cache_dir_path or DEFAULT_CACHE_DIR)
+    stat = archive_path.stat()
+    path_key = hashlib.sha256(str(archive_path).encode('utf-8')).hexdigest()[:16]
+    version = f"{stat.st_size}-{stat.st_mtime_ns}"
+    archive_cache_path = cache_dir_path / f"{archive_path.stem}-{path_key}"
+    database_path = archive_cache_path / f"parts-{version}.db"
+    files = ArchiveFiles(archive_path)
+    if database_path.is_file():
+        return archive_cache_path, database_path, files
+
+    archive_cache_path.mkdir(parents = True, exist_ok = True)
+    for stale_path in archive_cache_path.glob('parts-*.db'):
+        stale_path.unlink(missing_ok = True)
+    temporary_path = database_path.with_name(f"{database_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        files.extract(files.database_name(), temporary_path)
+        # archives of older versions are migrated once here, the mounted database is opened read-only
+        engine = create_engine(f"sqlite:///{temporary_path.as_posix()}")
+        try:
+            migrate(engine)
+        finally:
+            engine.dispose()
+        os.replace(temporary_path, database_path)
+    except BaseException:
+        temporary_path.unlink(missing_ok = True)
+        raise
+    return archive_cache_path, database_path, files
@@ -0,0 +1,100 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import selectinload
+
+from .models import Component
+
+
+# Sort keys of the component listing. Every key is indexed and combined with the id as tiebreaker, so the order is
+# stable and a page is read by seeking the index to the position of the cursor instead of skipping rows with OFFSET.
+PAGE_ORDERS = {
+    'number': Component.number,
+    'name': Component.name,
+    'date_modified': Component.date_modified,
+}
+
+MAX_PAGE_SIZE = 1000
+
+
+# One page of a listing with the cursor of the next page, next_cursor is None on the last page
+class Page:
+    def __init__(self, items, next_cursor = None):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __repr__(self):
+        return f"<Page(items={len(self.items)}, next_cursor={self.next_cursor})>"
+
+
+# Encodes the position after the last row of a page as an opaque, URL-safe cursor
+def encode_cursor(order_by, descending, value, id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([order_by, bool(descending), value, id], separators = (',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+# Decodes a cursor created by encode_cursor, returns the (value, id) position. Raises ValueError if the cursor is
+# malformed or was created for another order.
+def decode_cursor(cursor, order_by, descending):
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_order_by, cursor_descending, value, id = json.loads(payload)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor '{cursor}'") from e
+    if cursor_order_by != order_by or cursor_descending != bool(descending) or not isinstance(id, int):
+        raise ValueError(f"Cursor '{cursor}' does not belong to the order '{order_by}'")
+    if order_by == 'date_modified' and value is not None:
+        value = datetime.fromisoformat(value)
+    return value, id
+
+
+# Returns a page of components ordered by order_by (see PAGE_ORDERS) and id, starting after the cursor of the
+# previous page. With columns, the page contains dicts of these Component columns instead of Component objects.
+# The relationships named in load (e.g. 'cad_file', 'supplier') are loaded for the whole page with one query each
+# instead of one query per component.
+def page_components(session, order_by = 'number', cursor = None, limit = 50, descending = False, include_archived = True, columns = None, load = ()):
+    if order_by not in PAGE_ORDERS:
+        raise ValueError(f"Unknown order '{order_by}', expected one of {tuple(PAGE_ORDERS)}")
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    sort_column = PAGE_ORDERS[order_by]
+
+    if columns is not None:
+        columns = tuple(dict.fromkeys(('id', order_by) + tuple(columns)))
+        statement = select(*(Component.__table__.c[column] for column in columns))
+    else:
+        statement = select(Component).options(*(selectinload(getattr(Component, name)) for name in load))
+    if not include_archived:
+        statement = statement.where(Component.is_archived.is_not(True))
+    if cursor:
+        position = tuple_(sort_column, Component.id)
+        value, id = decode_cursor(cursor, order_by, descending)
+        statement = statement.where(position < tuple_(value, id) if descending else position > tuple_(value, id))
+    if descending:
+        statement = statement.order_by(sort_column.desc(), Component.id.desc())
+    else:
+        statement = statement.order_by(sort_column, Component.id)
+    # one row more than requested tells whether there is a next page
+    statement = statement.limit(limit + 1)
+
+    if columns is not None:
+        items = [dict(row) for row in session.execute(statement).mappings()]
+        last = (lambda item: (item[order_by], item['id']))
+    else:
+        items = list(session.scalars(statement).unique())
+        last = (lambda item: (getattr(item, order_by), item.id))
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(order_by, descending, *last(items[-1]))
+    return Page(items, next_cursor)
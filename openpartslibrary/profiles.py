@@ -0,0 +1,131 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+# SQLite settings per performance profile, applied with PRAGMA statements to every new connection of the engine.
+# 'default' keeps the SQLite defaults (rollback journal, synchronous = FULL).
+SQLITE_PROFILES = {
+    'default': {},
+    # concurrent readers next to a single writer, durable commits without an fsync per transaction
+    'web': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+    # large page cache for index updates, imports additionally switch to IMPORT_PRAGMAS while they run
+    'bulk-import': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -256 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 30000,
+    },
+    # no writes, e.g. for a reporting process next to the web app, the journal mode is left as it is
+    'read-only': {
+        'query_only': 'ON',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+}
+
+# Fast, unsafe settings per profile, used only for the duration of an import (see bulk_import). With synchronous = OFF
+# a power loss during the import can corrupt the database, an application crash can not.
+IMPORT_PRAGMAS = {
+    'bulk-import': {
+        'synchronous': 'OFF',
+    },
+}
+
+
+# Returns the pragmas of a profile, given by name or as a dict of pragmas
+def profile_pragmas(profile):
+    if profile is None:
+        return {}
+    if isinstance(profile, dict):
+        return dict(profile)
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown SQLite profile '{profile}', expected one of {tuple(SQLITE_PROFILES)}")
+    return dict(SQLITE_PROFILES[profile])
+
+
+# Executes the pragmas on a DBAPI (sqlite3) connection
+def apply_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+    finally:
+        cursor.close()
+
+
+# Returns the current values of the pragmas on a DBAPI (sqlite3) connection
+def read_pragmas(dbapi_connection, names):
+    cursor = dbapi_connection.cursor()
+    try:
+        return {name: cursor.execute(f"PRAGMA {name}").fetchone()[0] for name in names}
+    finally:
+        cursor.close()
+
+
+# pysqlite opens a transaction only before INSERT, UPDATE and DELETE statements (legacy transaction control), DDL like
+# DROP TRIGGER outside of a transaction is committed at once. Opens the transaction of a connection explicitly if none
+# is open yet, so DDL which follows is rolled back together with the other statements of the transaction.
+def begin_transaction(connection):
+    if not connection.connection.driver_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN')
+
+
+# Applies the pragmas of a profile to every new connection of the engine through a connect event. Also restores
+# the pragmas changed by temporary_pragmas when a connection is returned to the pool before the context exits.
+def configure_engine(engine, profile):
+    pragmas = profile_pragmas(profile)
+    if pragmas:
+        @event.listens_for(engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            apply_pragmas(dbapi_connection, pragmas)
+
+    @event.listens_for(engine, 'checkin')
+    def restore_sqlite_pragmas(dbapi_connection, connection_record):
+        restore = connection_record.info.pop('restore_pragmas', None)
+        if restore and dbapi_connection is not None:
+            apply_pragmas(dbapi_connection, restore)
+    return pragmas
+
+
+# Switches every connection which is checked out of the pool of an engine set up with configure_engine to the given
+# pragmas while the context is active. The previous values are restored on the changed connections when the context
+# exits, also on connections which are still held by a session. Pragmas like synchronous can not be changed inside a
+# transaction, so sessions should be committed before entering; connections which are in a transaction on exit are
+# restored when they are returned to the pool.
+@contextmanager
+def temporary_pragmas(engine, pragmas):
+    if not pragmas:
+        yield
+        return
+
+    changed = []
+
+    def switch_sqlite_pragmas(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info['restore_pragmas'] = read_pragmas(dbapi_connection, pragmas)
+        apply_pragmas(dbapi_connection, pragmas)
+        changed.append((dbapi_connection, connection_record))
+
+    event.listen(engine, 'checkout', switch_sqlite_pragmas)
+    try:
+        yield
+    finally:
+        event.remove(engine, 'checkout', switch_sqlite_pragmas)
+        for dbapi_connection, connection_record in changed:
+            # skips connections which were restored at checkin or closed since
+            if connection_record.dbapi_connection is not dbapi_connection or dbapi_connection.in_transaction:
+                continue
+            restore = connection_record.info.pop('restore_pragmas', None)
+            if restore:
+                apply_pragmas(dbapi_connection, restore)
@@ -0,0 +1,140 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .models import CadMetadata, Component, ComponentClosure, ComponentComponent, ComponentFile, ComponentSupplier, File, Material, Supplier
+from .profiles import begin_transaction
+from .search import create_search_index, drop_search_index
+
+
+# Tables of the parts library in the order in which they can be cleared, link tables first.
+# The users table is not part of the library and is never cleared.
+LIBRARY_TABLES = (ComponentClosure.__table__, ComponentComponent.__table__, ComponentSupplier.__table__, ComponentFile.__table__, Component.__table__, Supplier.__table__, File.__table__, Material.__table__, CadMetadata.__table__)
+
+
+def _default_workers():
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+# Removes files in a thread pool, returns the number of removed files. Files which are already gone are ignored.
+def remove_files(file_paths, workers = None):
+    def remove(file_path):
+        try:
+            os.remove(file_path)
+            return 1
+        except FileNotFoundError:
+            return 0
+
+    with ThreadPoolExecutor(max_workers = workers or _default_workers()) as executor:
+        return sum(executor.map(remove, file_paths))
+
+
+# Removes the content of a directory with scandir and a thread pool, keeping the directory itself and the files
+# named in keep. Subdirectories are emptied and removed. Returns the number of removed files.
+def clear_directory(directory_path, keep = ('README.md',), workers = None):
+    if not os.path.isdir(directory_path):
+        return 0
+    file_paths = []
+    directory_paths = []
+    stack = [str(directory_path)]
+    while stack:
+        current = stack.pop()
+        with os.scandir(current) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks = False):
+                    stack.append(entry.path)
+                    directory_paths.append(entry.path)
+                elif current != str(directory_path) or entry.name not in keep:
+                    file_paths.append(entry.path)
+    removed = remove_files(file_paths, workers)
+    for subdirectory_path in reversed(directory_paths):
+        os.rmdir(subdirectory_path)
+    return removed
+
+
+# Deletes all rows of the library tables in a single transaction with plain DELETE statements, without loading
+# any rows into the session. Returns the number of deleted rows per table.
+def delete_library_rows(session):
+    counts = {}
+    try:
+        connection = session.connection()
+        # the DDL has to be part of the transaction, a failed DELETE must not leave the library without search index
+        begin_transaction(connection)
+        # dropping and recreating the search index is much faster than deleting its rows through the triggers
+        drop_search_index(connection)
+        for table in LIBRARY_TABLES:
+            counts[table.name] = connection.exec_driver_sql(f"DELETE FROM {table.name}").rowcount
+        create_search_index(connection)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    session.expunge_all()
+    return counts
+
+
+# Deletes the given components together with their link rows, and the files which are no longer referenced by any
+# remaining component. component_filter is an SQL condition on the components table with its parameters.
+# Returns the row counts per table and the (uuid, name, content_hash) tuples of the deleted files.
+def delete_components(session, component_filter, parameters = ()):
+    components = Component.__tablename__
+    component_component = ComponentComponent.__tablename__
+    component_file = ComponentFile.__tablename__
+    files = File.__tablename__
+    counts = {}
+    try:
+        connection = session.connection()
+        connection.exec_driver_sql("DROP TABLE IF EXISTS temp.purge_components")
+        connection.exec_driver_sql(f"CREATE TEMP TABLE purge_components AS SELECT id FROM {components} WHERE {component_filter}", parameters)
+        connection.exec_driver_sql("DROP TABLE IF EXISTS temp.purge_files")
+        connection.exec_driver_sql(
+            f"CREATE TEMP TABLE purge_files AS "
+            f"SELECT cad_file_id AS id FROM {components} WHERE id IN (SELECT id FROM purge_components) AND cad_file_id IS NOT NULL "
+            f"UNION SELECT file_id FROM {component_file} WHERE component_id IN (SELECT id FROM purge_components)")
+
+        counts[component_component] = connection.exec_driver_sql(
+            f"DELETE FROM {component_component} WHERE parent_component_id IN (SELECT id FROM purge_components) "
+            f"OR child_component_id IN (SELECT id FROM purge_components)").rowcount
+        counts[component_file] = connection.exec_driver_sql(f"DELETE FROM {component_file} WHERE component_id IN (SELECT id FROM purge_components)").rowcount
+        counts[components] = connection.exec_driver_sql(f"DELETE FROM {components} WHERE id IN (SELECT id FROM purge_components)").rowcount
+
+        # files which are still referenced by a remaining component are kept
+        orphan_filter = (f"id IN (SELECT id FROM purge_files) "
+                         f"AND id NOT IN (SELECT cad_file_id FROM {components} WHERE cad_file_id IS NOT NULL) "
+                         f"AND id NOT IN (SELECT file_id FROM {component_file})")
+        deleted_files = connection.exec_driver_sql(f"SELECT uuid, name, content_hash FROM {files} WHERE {orphan_filter}").fetchall()
+        counts[files] = connection.exec_driver_sql(f"DELETE FROM {files} WHERE {orphan_filter}").rowcount
+
+        connection.exec_driver_sql("DROP TABLE temp.purge_components")
+        connection.exec_driver_sql("DROP TABLE temp.purge_files")
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    session.expire_all()
+    return counts, deleted_files
+
+
+# Returns the paths of the stored files of deleted File rows. Stored files are named <file uuid><suffix>,
+# the directories are scanned once instead of guessing the suffix per file.
+def stored_file_paths(file_uuids, directory_paths):
+    file_uuids = set(file_uuids)
+    file_paths = []
+    if not file_uuids:
+        return file_paths
+    for directory_path in directory_paths:
+        if not os.path.isdir(directory_path):
+            continue
+        with os.scandir(directory_path) as entries:
+            for entry in entries:
+                if entry.is_file() and os.path.splitext(entry.name)[0] in file_uuids:
+                    file_paths.append(entry.path)
+    return file_paths
+
+
+# Returns the digests out of the given ones which are no longer referenced by any File row
+def unreferenced_digests(session, digests):
+    digests = {digest for digest in digests if digest}
+    if not digests:
+        return set()
+    referenced = set(session.connection().exec_driver_sql(f"SELECT DISTINCT content_hash FROM {File.__tablename__} WHERE content_hash IS NOT NULL").scalars())
+    return digests - referenced
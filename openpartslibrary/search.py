@@ -0,0 +1,131 @@
+import html
+import re
+from contextlib import contextmanager
+
+from .models import Component, Supplier
+from .profiles import begin_transaction
+
+
+# FTS5 index over the searchable text of the components, the rowid is the id of the component
+SEARCH_TABLE = 'components_fts'
+
+# Indexed columns with their BM25 weight, matches in the name or number rank above matches in the description
+SEARCH_COLUMNS = {
+    'name': 10.0,
+    'number': 10.0,
+    'description': 1.0,
+    'material': 2.0,
+    'supplier': 2.0,
+}
+
+# Markers around the matched terms in snippets, replaced after the text has been HTML-escaped
+_MATCH_START = '\x02'
+_MATCH_END = '\x03'
+
+_components = Component.__tablename__
+_suppliers = Supplier.__tablename__
+_columns = ', '.join(SEARCH_COLUMNS)
+_select_component_text = (
+    f"SELECT c.id, c.name, c.number, c.description, c.material, s.name "
+    f"FROM {_components} c LEFT JOIN {_suppliers} s ON s.id = c.supplier_id"
+)
+
+_insert_trigger = f"{SEARCH_TABLE}_components_insert"
+
+# The index is kept in sync with the components and suppliers tables by triggers, so every insert, update and delete,
+# also through plain SQL like the bulk importer, updates the index in the same transaction
+SEARCH_SCHEMA = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5({_columns}, tokenize = 'unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS {_insert_trigger} AFTER INSERT ON {_components} BEGIN "
+    f"INSERT INTO {SEARCH_TABLE} (rowid, {_columns}) "
+    f"VALUES (new.id, new.name, new.number, new.description, new.material, (SELECT name FROM {_suppliers} WHERE id = new.supplier_id)); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_components_delete AFTER DELETE ON {_components} BEGIN "
+    f"DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id; END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_components_update AFTER UPDATE OF id, name, number, description, material, supplier_id ON {_components} BEGIN "
+    f"DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id; "
+    f"INSERT INTO {SEARCH_TABLE} (rowid, {_columns}) "
+    f"VALUES (new.id, new.name, new.number, new.description, new.material, (SELECT name FROM {_suppliers} WHERE id = new.supplier_id)); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_suppliers_update AFTER UPDATE OF name ON {_suppliers} BEGIN "
+    f"UPDATE {SEARCH_TABLE} SET supplier = new.name WHERE rowid IN (SELECT id FROM {_components} WHERE supplier_id = new.id); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_suppliers_delete AFTER DELETE ON {_suppliers} BEGIN "
+    f"UPDATE {SEARCH_TABLE} SET supplier = NULL WHERE rowid IN (SELECT id FROM {_components} WHERE supplier_id = old.id); END",
+)
+
+
+# Creates the search index and its triggers if they do not exist yet
+def create_search_index(connection):
+    for statement in SEARCH_SCHEMA:
+        connection.exec_driver_sql(statement)
+
+
+# Drops the search index and its triggers
+def drop_search_index(connection):
+    for (trigger,) in connection.exec_driver_sql(f"SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE '{SEARCH_TABLE}%'").fetchall():
+        connection.exec_driver_sql(f"DROP TRIGGER {trigger}")
+    connection.exec_driver_sql(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+# Indexes the components inserted inside the context with a single INSERT ... SELECT instead of the insert trigger,
+# which is several times slower for bulk inserts. The trigger is dropped inside the transaction, which is opened
+# explicitly, and recreated on exit, also if the inserts fail. A rollback restores it as well, so the context must not
+# contain a commit.
+@contextmanager
+def bulk_index_inserts(connection):
+    if not connection.exec_driver_sql(f"SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name = '{_insert_trigger}'").scalar():
+        yield
+        return
+    begin_transaction(connection)
+    last_id = connection.exec_driver_sql(f"SELECT COALESCE(MAX(id), 0) FROM {_components}").scalar()
+    connection.exec_driver_sql(f"DROP TRIGGER {_insert_trigger}")
+    try:
+        yield
+        connection.exec_driver_sql(f"INSERT INTO {SEARCH_TABLE} (rowid, {_columns}) {_select_component_text} WHERE c.id > ?", (last_id,))
+    finally:
+        connection.exec_driver_sql(SEARCH_SCHEMA[1])
+
+
+# Refills the search index from the components and suppliers tables, e.g. for databases which were changed while the
+# triggers did not exist. Returns the number of indexed components.
+def rebuild_search_index(connection):
+    create_search_index(connection)
+    connection.exec_driver_sql(f"DELETE FROM {SEARCH_TABLE}")
+    connection.exec_driver_sql(f"INSERT INTO {SEARCH_TABLE} (rowid, {_columns}) {_select_component_text}")
+    connection.exec_driver_sql(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+    return connection.exec_driver_sql(f"SELECT count(*) FROM {SEARCH_TABLE}").scalar()
+
+
+# Converts user input into an FTS5 query. Every word is quoted, so characters like '-' or '"' can not cause query
+# syntax errors, and a trailing '*' makes the word a prefix query, e.g. 'ISO47*' finds 'ISO4762'. All words have to
+# match. Returns None if the input contains no words.
+def search_query(text):
+    terms = [f'"{word}"{star}' for word, star in re.findall(r'(\w+)(\*?)', text or '')]
+    return ' '.join(terms) or None
+
+
+# Returns a snippet as HTML, the text is escaped and the matched terms are wrapped in <mark> elements
+def snippet_html(snippet):
+    if snippet is None:
+        return None
+    return html.escape(snippet).replace(_MATCH_START, '<mark>').replace(_MATCH_END, '</mark>')
+
+
+# Searches the components with the FTS5 index, ranked by BM25 with the weights of SEARCH_COLUMNS (best match first).
+# Returns a list of dicts with the id, uuid, number and name of the component, its score (higher is better) and
+# an HTML snippet of the best matching column with the matched terms highlighted.
+def search_components(connection, text, limit = 50, offset = 0, include_archived = False):
+    query = search_query(text)
+    if query is None:
+        return []
+    weights = ', '.join(str(weight) for weight in SEARCH_COLUMNS.values())
+    where = "" if include_archived else "AND COALESCE(c.is_archived, 0) = 0"
+    rows = connection.exec_driver_sql(
+        f"SELECT c.id, c.uuid, c.number, c.name, bm25({SEARCH_TABLE}, {weights}) AS score, "
+        f"snippet({SEARCH_TABLE}, -1, '{_MATCH_START}', '{_MATCH_END}', '…', 16) "
+        f"FROM {SEARCH_TABLE} JOIN {_components} c ON c.id = {SEARCH_TABLE}.rowid "
+        f"WHERE {SEARCH_TABLE} MATCH ? {where} "
+        f"ORDER BY score LIMIT ? OFFSET ?",
+        (query, limit, offset)).fetchall()
+    return [
+        {'id': row[0], 'uuid': row[1], 'number': row[2], 'name': row[3], 'score': -row[4], 'snippet': snippet_html(row[5])}
+        for row in rows
+    ]
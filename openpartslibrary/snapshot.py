@@ -0,0 +1,79 @@
+import os
+import sqlite3
+import uuid
+from pathlib import Path
+
+from .profiles import apply_pragmas, read_pragmas
+
+
+# Pages copied per step of the online backup and the pause between the steps, in which writers get the database lock
+SNAPSHOT_STEP_PAGES = 1024
+SNAPSHOT_STEP_SLEEP = 0.005
+
+# Writes from other connections restart a stepwise copy, after this many restarts the rest is copied in one step
+SNAPSHOT_MAX_RESTARTS = 3
+
+
+class _Restarted(Exception):
+    pass
+
+
+# Copies the database in steps, returns False if the copy was restarted too often by concurrent writes
+def _backup_in_steps(source, destination, step_pages, step_sleep):
+    state = {'remaining': None, 'restarts': 0}
+
+    def progress(status, remaining, total):
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > SNAPSHOT_MAX_RESTARTS:
+                raise _Restarted()
+        state['remaining'] = remaining
+
+    try:
+        source.backup(destination, pages = step_pages, progress = progress, sleep = step_sleep)
+        return True
+    except _Restarted:
+        return False
+
+
+# Writes a point-in-time consistent copy of the database of the engine to destination_path while the database stays
+# in use. In WAL mode the copy is made in a single read transaction, which does not block writers. With the rollback
+# journal the pages are copied in steps of step_pages, writers get the lock between the steps. A write from another
+# connection restarts the copy, after SNAPSHOT_MAX_RESTARTS restarts the rest is copied in a single step, which blocks
+# writers until it is done. With compact = True the copy is written with VACUUM INTO, without free pages and with
+# defragmented tables and indexes, in a single read transaction. The copy uses the rollback journal, so it can be
+# opened read-only and archived as a single file. The copy is renamed to destination_path when complete.
+# Returns the destination path.
+def snapshot_database(engine, destination_path, compact = False, step_pages = SNAPSHOT_STEP_PAGES, step_sleep = SNAPSHOT_STEP_SLEEP):
+    destination_path = Path(destination_path)
+    temporary_path = destination_path.with_name(f"{destination_path.name}.{uuid.uuid4().hex}.tmp")
+    source = engine.raw_connection()
+    try:
+        if compact:
+            # VACUUM INTO does not change the source, but is refused by connections of the read-only profile
+            query_only = read_pragmas(source.driver_connection, ('query_only',))
+            apply_pragmas(source.driver_connection, {'query_only': 'OFF'})
+            try:
+                source.driver_connection.execute("VACUUM INTO ?", (str(temporary_path),))
+            finally:
+                apply_pragmas(source.driver_connection, query_only)
+        else:
+            wal = str(read_pragmas(source.driver_connection, ('journal_mode',))['journal_mode']).lower() == 'wal'
+            destination = sqlite3.connect(temporary_path)
+            try:
+                if wal or not _backup_in_steps(source.driver_connection, destination, step_pages, step_sleep):
+                    source.driver_connection.backup(destination)
+            finally:
+                destination.close()
+        destination = sqlite3.connect(temporary_path)
+        try:
+            destination.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            destination.close()
+        os.replace(temporary_path, destination_path)
+    except BaseException:
+        temporary_path.unlink(missing_ok = True)
+        raise
+    finally:
+        source.close()
+    return destination_path
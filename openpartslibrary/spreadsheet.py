@@ -0,0 +1,312 @@
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from xml.etree import ElementTree
+
+import pandas as pd
+
+
+# Default number of rows per chunk of the streaming spreadsheet readers
+DEFAULT_CHUNK_SIZE = 10000
+
+# Formats which contain several sheets, CSV and parquet files only contain a single sheet
+MULTI_SHEET_FORMATS = ('ods', 'xlsx')
+
+SPREADSHEET_SUFFIXES = ('.ods', '.xlsx', '.xlsm', '.csv', '.txt', '.parquet', '.pq')
+
+_TABLE_NS = 'urn:oasis:names:tc:opendocument:xmlns:table:1.0'
+_OFFICE_NS = 'urn:oasis:names:tc:opendocument:xmlns:office:1.0'
+_TEXT_NS = 'urn:oasis:names:tc:opendocument:xmlns:text:1.0'
+
+_ODS_TABLE = f'{{{_TABLE_NS}}}table'
+_ODS_ROW = f'{{{_TABLE_NS}}}table-row'
+_ODS_CELLS = (f'{{{_TABLE_NS}}}table-cell', f'{{{_TABLE_NS}}}covered-table-cell')
+_ODS_TABLE_NAME = f'{{{_TABLE_NS}}}name'
+_ODS_ROWS_REPEATED = f'{{{_TABLE_NS}}}number-rows-repeated'
+_ODS_COLUMNS_REPEATED = f'{{{_TABLE_NS}}}number-columns-repeated'
+_ODS_VALUE_TYPE = f'{{{_OFFICE_NS}}}value-type'
+_ODS_VALUE = f'{{{_OFFICE_NS}}}value'
+_ODS_DATE_VALUE = f'{{{_OFFICE_NS}}}date-value'
+_ODS_ANNOTATION = f'{{{_OFFICE_NS}}}annotation'
+_ODS_PARAGRAPH = f'{{{_TEXT_NS}}}p'
+_ODS_SPACE = f'{{{_TEXT_NS}}}s'
+_ODS_SPACE_COUNT = f'{{{_TEXT_NS}}}c'
+_ODS_TAB = f'{{{_TEXT_NS}}}tab'
+_ODS_LINE_BREAK = f'{{{_TEXT_NS}}}line-break'
+
+
+# Returns the file format of a spreadsheet based on its suffix
+def spreadsheet_format(spreadsheet_file_path):
+    suffix = Path(spreadsheet_file_path).suffix.lower()
+    if suffix in ('.csv', '.txt'):
+        return 'csv'
+    if suffix in ('.parquet', '.pq'):
+        return 'parquet'
+    if suffix == '.ods':
+        return 'ods'
+    if suffix in ('.xlsx', '.xlsm'):
+        return 'xlsx'
+    raise ValueError(f"Unsupported spreadsheet format: {suffix}")
+
+
+# Reads a sheet of a spreadsheet in chunks of chunk_size rows and yields a pandas dataframe per chunk.
+# Only one chunk is held in memory at a time. The index of every chunk is the 0-based row number below the
+# header row, so index + 2 is the row number in the spreadsheet. CSV and parquet files only contain a single
+# sheet, the sheet name is ignored for these formats.
+def iter_spreadsheet_chunks(spreadsheet_file_path, sheet_name, chunk_size = DEFAULT_CHUNK_SIZE, dtype = None):
+    spreadsheet_path = Path(spreadsheet_file_path).expanduser().resolve()
+    file_format = spreadsheet_format(spreadsheet_path)
+    if file_format == 'csv':
+        return _iter_csv_chunks(spreadsheet_path, chunk_size, dtype)
+    if file_format == 'parquet':
+        return _iter_parquet_chunks(spreadsheet_path, chunk_size)
+    if file_format == 'ods':
+        return _iter_row_chunks(_iter_ods_rows(spreadsheet_path, sheet_name), chunk_size)
+    return _iter_row_chunks(_iter_xlsx_rows(spreadsheet_path, sheet_name), chunk_size)
+
+
+# Reads a whole sheet through the streaming readers, for small sheets which are needed as a whole
+def read_spreadsheet_sheet(spreadsheet_file_path, sheet_name, dtype = None):
+    chunks = list(iter_spreadsheet_chunks(spreadsheet_file_path, sheet_name, dtype = dtype))
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks)
+
+
+# Reads all chunks of a sheet into a list, runs in the worker processes of parse_spreadsheets
+def read_spreadsheet_chunks(spreadsheet_file_path, sheet_name, chunk_size = DEFAULT_CHUNK_SIZE, dtype = None):
+    return list(iter_spreadsheet_chunks(spreadsheet_file_path, sheet_name, chunk_size, dtype))
+
+
+# Returns the sorted spreadsheet files of a directory, or the given list of files
+def find_spreadsheets(spreadsheet_file_paths):
+    if isinstance(spreadsheet_file_paths, (str, os.PathLike)):
+        directory_path = Path(spreadsheet_file_paths).expanduser().resolve()
+        if not directory_path.is_dir():
+            return [directory_path]
+        return sorted(path for path in directory_path.iterdir() if path.is_file() and path.suffix.lower() in SPREADSHEET_SUFFIXES and not path.name.startswith('~$'))
+    return [Path(path).expanduser().resolve() for path in spreadsheet_file_paths]
+
+
+# Parses the sheets of several spreadsheet files in a process pool and yields (path, sheets) per file, in the
+# order of the given files. sheets maps the sheet name to the list of chunks of the sheet, or is the exception
+# which was raised while parsing the file. sheet_names maps the sheet names to the dtype of the sheet, files
+# with a single sheet only get the first sheet. At most two tasks per worker are parsed ahead of the consumer,
+# which bounds the memory held by parsed but not yet consumed sheets.
+# The pool uses the 'spawn' start method on Windows, so the calling script needs an if __name__ == '__main__' guard there.
+def parse_spreadsheets(spreadsheet_file_paths, sheet_names, chunk_size = DEFAULT_CHUNK_SIZE, workers = None):
+    tasks = []
+    for path in spreadsheet_file_paths:
+        try:
+            multi_sheet = spreadsheet_format(path) in MULTI_SHEET_FORMATS
+        except ValueError:
+            # the error of the unsupported format is raised and reported when parsing the file
+            multi_sheet = False
+        for sheet_name, dtype in list(sheet_names.items())[:None if multi_sheet else 1]:
+            tasks.append((path, sheet_name, dtype))
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        yield from _group_sheets((path, sheet_name, _parse_sheet(path, sheet_name, chunk_size, dtype)) for path, sheet_name, dtype in tasks)
+        return
+
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        yield from _group_sheets(_iter_parsed_sheets(executor, tasks, chunk_size, 2 * workers))
+
+
+def _parse_sheet(path, sheet_name, chunk_size, dtype):
+    try:
+        return read_spreadsheet_chunks(path, sheet_name, chunk_size, dtype)
+    except Exception as e:
+        return e
+
+
+def _iter_parsed_sheets(executor, tasks, chunk_size, window):
+    pending = deque()
+    remaining = iter(tasks)
+    while True:
+        for path, sheet_name, dtype in remaining:
+            pending.append((path, sheet_name, executor.submit(read_spreadsheet_chunks, path, sheet_name, chunk_size, dtype)))
+            if len(pending) >= window:
+                break
+        if not pending:
+            return
+        path, sheet_name, future = pending.popleft()
+        try:
+            yield path, sheet_name, future.result()
+        except Exception as e:
+            yield path, sheet_name, e
+
+
+# Groups parsed sheets by file, the first error of a file replaces its sheets
+def _group_sheets(parsed_sheets):
+    current_path = None
+    sheets = None
+    for path, sheet_name, result in parsed_sheets:
+        if path != current_path:
+            if current_path is not None:
+                yield current_path, sheets
+            current_path = path
+            sheets = {}
+        if isinstance(sheets, Exception):
+            continue
+        if isinstance(result, Exception):
+            sheets = result
+        else:
+            sheets[sheet_name] = result
+    if current_path is not None:
+        yield current_path, sheets
+
+
+def _iter_csv_chunks(spreadsheet_path, chunk_size, dtype):
+    with pd.read_csv(spreadsheet_path, chunksize = chunk_size, dtype = dtype) as reader:
+        yield from reader
+
+
+def _iter_parquet_chunks(spreadsheet_path, chunk_size):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Reading parquet files requires the pyarrow package, install it with 'pip install pyarrow'") from e
+
+    start = 0
+    parquet_file = pq.ParquetFile(spreadsheet_path)
+    for batch in parquet_file.iter_batches(batch_size = chunk_size):
+        chunk = batch.to_pandas()
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        start += len(chunk)
+        yield chunk
+
+
+# Groups the (row number, values) tuples of a row reader into dataframes, the first row is the header
+def _iter_row_chunks(rows, chunk_size):
+    header = None
+    values = []
+    index = []
+    for row_number, row in rows:
+        if header is None:
+            header = [f"Unnamed: {i}" if value is None else str(value).strip() for i, value in enumerate(row)]
+            header_row_number = row_number
+            continue
+        row = list(row[:len(header)])
+        if len(row) < len(header):
+            row.extend([None] * (len(header) - len(row)))
+        values.append(row)
+        index.append(row_number - header_row_number - 1)
+        if len(values) >= chunk_size:
+            yield pd.DataFrame(values, columns = header, index = index)
+            values = []
+            index = []
+    if values:
+        yield pd.DataFrame(values, columns = header, index = index)
+
+
+def _iter_xlsx_rows(spreadsheet_path, sheet_name):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(spreadsheet_path, read_only = True, data_only = True)
+    try:
+        if sheet_name not in workbook.sheetnames:
+            raise ValueError(f"Worksheet named '{sheet_name}' not found")
+        for row_number, row in enumerate(workbook[sheet_name].iter_rows(values_only = True), start = 1):
+            # empty rows are skipped, the row number keeps the position in the sheet
+            if all(value is None or value == '' for value in row):
+                continue
+            yield row_number, row
+    finally:
+        workbook.close()
+
+
+# Reads the text of an OpenDocument cell, paragraphs are joined by new lines and annotations are ignored
+def _ods_cell_text(cell):
+    paragraphs = []
+    for paragraph in cell.iter(_ODS_PARAGRAPH):
+        paragraphs.append(''.join(_ods_text_fragments(paragraph)))
+    return '\n'.join(paragraphs)
+
+
+def _ods_text_fragments(element):
+    if element.text:
+        yield element.text
+    for child in element:
+        if child.tag == _ODS_SPACE:
+            yield ' ' * int(child.get(_ODS_SPACE_COUNT, 1))
+        elif child.tag == _ODS_TAB:
+            yield '\t'
+        elif child.tag == _ODS_LINE_BREAK:
+            yield '\n'
+        elif child.tag != _ODS_ANNOTATION:
+            yield from _ods_text_fragments(child)
+        if child.tail:
+            yield child.tail
+
+
+# Converts an OpenDocument cell into a python value, following the conversion of the pandas odf reader
+def _ods_cell_value(cell):
+    value_type = cell.get(_ODS_VALUE_TYPE)
+    if value_type is None:
+        return None
+    if value_type == 'float':
+        value = float(cell.get(_ODS_VALUE))
+        return int(value) if value.is_integer() else value
+    if value_type in ('percentage', 'currency'):
+        return float(cell.get(_ODS_VALUE))
+    if value_type == 'boolean':
+        return _ods_cell_text(cell) == 'TRUE'
+    if value_type == 'date':
+        return pd.Timestamp(cell.get(_ODS_DATE_VALUE))
+    text = _ods_cell_text(cell)
+    if text == '#N/A':
+        return None
+    if value_type == 'time':
+        return pd.Timestamp(text).time()
+    return text
+
+
+# Parses the rows of one sheet of an *.ods file with a streaming XML parser. Every parsed row is removed
+# from the element tree once it has been read, so the memory use does not grow with the size of the sheet.
+# Repeated empty rows and cells (LibreOffice stores the unused part of a sheet this way) are not expanded.
+def _iter_ods_rows(spreadsheet_path, sheet_name):
+    with zipfile.ZipFile(spreadsheet_path) as archive, archive.open('content.xml') as content:
+        found = False
+        parents = []
+        row_number = 0
+        for event, element in ElementTree.iterparse(content, events = ('start', 'end')):
+            if event == 'start':
+                if element.tag == _ODS_TABLE:
+                    found = element.get(_ODS_TABLE_NAME) == sheet_name
+                    row_number = 0
+                parents.append(element)
+                continue
+
+            parents.pop()
+            if element.tag == _ODS_TABLE and found:
+                return
+            if element.tag != _ODS_ROW:
+                continue
+
+            rows_repeated = int(element.get(_ODS_ROWS_REPEATED, 1))
+            if found:
+                row = []
+                pending_empty = 0
+                for cell in element:
+                    if cell.tag not in _ODS_CELLS:
+                        continue
+                    columns_repeated = int(cell.get(_ODS_COLUMNS_REPEATED, 1))
+                    value = _ods_cell_value(cell)
+                    if value is None:
+                        pending_empty += columns_repeated
+                        continue
+                    row.extend([None] * pending_empty)
+                    row.extend([value] * columns_repeated)
+                    pending_empty = 0
+                if row:
+                    for repeat in range(rows_repeated):
+                        yield row_number + repeat + 1, row
+            row_number += rows_repeated
+            if parents:
+                parents[-1].remove(element)
+    if not found:
+        raise ValueError(f"Worksheet named '{sheet_name}' not found")
@@ -0,0 +1,182 @@
+import io
+import os
+import threading
+import uuid
+import zipfile
+from collections import OrderedDict
+from pathlib import Path
+
+
+# Preview image which FreeCAD saves in every FCStd file, 256 x 256 pixels
+THUMBNAIL_MEMBER = 'thumbnails/Thumbnail.png'
+
+# Edge length of the cached thumbnails in pixels, and the sizes which can be requested
+THUMBNAIL_SIZE = 64
+THUMBNAIL_SIZES = (32, 64, 128, 256)
+
+# Cache key of thumbnails which could not be resized, see ThumbnailCache.thumbnail
+ORIGINAL_SIZE = 'original'
+
+# Upper limit of the thumbnail cache on disk, the least recently used thumbnails are removed beyond it
+THUMBNAIL_CACHE_SIZE = 64 * 1024 * 1024
+
+# File suffix of the cache entries and its media type. Entries with the suffix '.none' record files without thumbnail.
+THUMBNAIL_MEDIA_TYPES = {'.webp': 'image/webp', '.png': 'image/png'}
+_NO_THUMBNAIL = '.none'
+
+
+# Returns the thumbnail of an FCStd file (path or binary file object) as PNG bytes, None if it has none or is no FCStd
+def read_thumbnail(source):
+    try:
+        with zipfile.ZipFile(source) as archive:
+            return archive.read(THUMBNAIL_MEMBER)
+    except (KeyError, zipfile.BadZipFile):
+        return None
+
+
+# Scales a PNG image down to fit size x size pixels, returns (image bytes, suffix). The thumbnail is encoded as WebP
+# if Pillow supports it, otherwise as PNG. Returns None if Pillow is not installed and the image can not be resized.
+def resize_thumbnail(png, size = THUMBNAIL_SIZE):
+    try:
+        from PIL import Image, features
+    except ImportError:
+        return None
+    with Image.open(io.BytesIO(png)) as image:
+        image.thumbnail((size, size), Image.LANCZOS)
+        output = io.BytesIO()
+        if features.check('webp'):
+            image.save(output, format = 'WEBP', quality = 80, method = 6)
+            return output.getvalue(), '.webp'
+        image.save(output, format = 'PNG', optimize = True)
+        return output.getvalue(), '.png'
+
+
+# Thumbnails on disk, by content hash of the CAD file and size in <root>/<first two hex digits>/<digest>-<size><suffix>,
+# so cached thumbnails never change. The total size is limited to max_bytes, beyond it the least recently used
+# thumbnails are removed. The order of use is kept in memory and in the modification times of the files, so it
+# survives restarts. Several processes can share a cache directory, each of them enforces the limit for the
+# thumbnails it knows of.
+class ThumbnailCache:
+    def __init__(self, root_path, max_bytes = THUMBNAIL_CACHE_SIZE, size = THUMBNAIL_SIZE):
+        self.root_path = Path(root_path)
+        self.max_bytes = max_bytes
+        self.size = size
+        self._entries = None
+        self._total = 0
+        self._lock = threading.Lock()
+
+    # Reads the entries of the cache directory on first use, ordered from least to most recently used
+    def _load(self):
+        if self._entries is not None:
+            return
+        entries = []
+        if self.root_path.is_dir():
+            for directory in os.scandir(self.root_path):
+                if not directory.is_dir():
+                    continue
+                for entry in os.scandir(directory.path):
+                    if entry.name.endswith('.tmp'):
+                        continue
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, Path(entry.name).stem, Path(entry.path), stat.st_size))
+        entries.sort()
+        self._entries = OrderedDict((key, (path, size)) for _, key, path, size in entries)
+        self._total = sum(size for path, size in self._entries.values())
+
+    def _key(self, digest, size):
+        return f"{digest}-{size or self.size}"
+
+    # Returns True if the thumbnail is cached, without marking it as used
+    def cached(self, digest, size = None):
+        with self._lock:
+            self._load()
+            return self._key(digest, size) in self._entries
+
+    # Returns the path of a cached thumbnail and marks it as used, None if it is not cached. The path of an entry
+    # for a file without thumbnail has the suffix '.none'.
+    def get(self, digest, size = None):
+        key = self._key(digest, size)
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            try:
+                os.utime(entry[0])
+            except FileNotFoundError:
+                # removed by another process sharing the cache
+                self._total -= entry[1]
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    # Stores a thumbnail (None for a file without thumbnail) and removes the least recently used ones beyond the limit
+    def put(self, digest, data, suffix = '.png', size = None):
+        key = self._key(digest, size)
+        if data is None:
+            data, suffix = b'', _NO_THUMBNAIL
+        path = self.root_path / digest[:2] / f"{key}{suffix}"
+        path.parent.mkdir(parents = True, exist_ok = True)
+        temporary_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        temporary_path.write_bytes(data)
+        os.replace(temporary_path, path)
+        with self._lock:
+            self._load()
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total -= previous[1]
+            self._entries[key] = (path, len(data))
+            self._total += len(data)
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                _, (old_path, old_size) = self._entries.popitem(last = False)
+                self._total -= old_size
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
+        return path
+
+    # Returns the path of the thumbnail of a CAD file, extracted and resized on first use, None if the file has no
+    # thumbnail. open_file is called to read the file only if the thumbnail is not cached yet and returns a path or
+    # binary file object.
+    def thumbnail(self, digest, open_file, size = None):
+        path = self.get(digest, size)
+        if path is None:
+            png = read_thumbnail(open_file())
+            resized = resize_thumbnail(png, size or self.size) if png is not None else (None, None)
+            if resized is None:
+                # without Pillow the thumbnail is cached in the size it has in the file, not under the requested size
+                return self.put(digest, png, '.png', ORIGINAL_SIZE)
+            path = self.put(digest, *resized, size)
+        return path if path.suffix != _NO_THUMBNAIL else None
+
+    # Removes all thumbnails, returns the number of removed files
+    def clear(self):
+        with self._lock:
+            self._load()
+            removed = 0
+            for path, _ in self._entries.values():
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+            self._entries.clear()
+            self._total = 0
+        return removed
+
+
+# Extracts the thumbnails of the given CAD files, a dict digest -> callable returning a path or binary file object,
+# which are not cached yet. Files which can not be read are skipped. Returns the number of extracted thumbnails.
+def precompute_thumbnails(cache, files, size = None):
+    extracted = 0
+    for digest, open_file in files.items():
+        if cache.cached(digest, size):
+            continue
+        try:
+            cache.thumbnail(digest, open_file, size)
+            extracted += 1
+        except (OSError, ValueError):
+            continue
+    return extracted
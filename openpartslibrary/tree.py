@@ -0,0 +1,73 @@
+from sqlalchemy import Integer, cast, literal, null, select
+
+from .models import Component, ComponentComponent
+
+
+# A component in a loaded tree with its children down to the loaded depth. A component which is used in several
+# places of the tree appears in one node per place, all nodes share the same Component object.
+class TreeNode:
+    def __init__(self, component, depth = 0):
+        self.component = component
+        self.depth = depth
+        self.children = []
+
+    # Yields this node and all nodes below it, depth-first
+    def walk(self):
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    def to_dict(self):
+        return {
+            'uuid': self.component.uuid,
+            'number': self.component.number,
+            'name': self.component.name,
+            'children': [child.to_dict() for child in self.children],
+        }
+
+    def __repr__(self):
+        return f"<TreeNode(number={self.component.number}, depth={self.depth}, children={len(self.children)})>"
+
+
+# Loads the subtree below the component with the given uuid down to depth levels of children with one recursive
+# query, and assembles it in memory. Returns the root TreeNode, or None if there is no component with this uuid.
+def load_tree(session, uuid, depth = 5):
+    depth = int(depth)
+    if depth < 0:
+        raise ValueError("depth must not be negative")
+
+    tree = select(cast(null(), Integer).label('parent_id'), Component.id.label('id'), literal(0).label('depth')) \
+        .where(Component.uuid == uuid).cte('tree', recursive = True)
+    tree = tree.union(
+        select(ComponentComponent.parent_component_id, ComponentComponent.child_component_id, tree.c.depth + 1)
+        .join(tree, ComponentComponent.parent_component_id == tree.c.id)
+        .where(tree.c.depth < depth)
+    )
+    rows = session.execute(select(Component, tree.c.parent_id, tree.c.depth).join(tree, Component.id == tree.c.id)).all()
+    if not rows:
+        return None
+
+    components = {}
+    children_ids = {}
+    root_id = None
+    for component, parent_id, _ in rows:
+        components[component.id] = component
+        if parent_id is None:
+            root_id = component.id
+        else:
+            children_ids.setdefault(parent_id, {})[component.id] = None
+
+    # expands the edges from the root down to the requested depth
+    root = TreeNode(components[root_id])
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node.depth >= depth:
+            continue
+        for child_id in children_ids.get(node.component.id, ()):
+            child = TreeNode(components[child_id], node.depth + 1)
+            node.children.append(child)
+            stack.append(child)
+    return root
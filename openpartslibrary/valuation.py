@@ -0,0 +1,65 @@
+from decimal import Decimal
+
+from .models import Component, Supplier
+
+
+# Grouping keys of inventory_value and the SQL expressions they are computed from
+VALUATION_GROUPS = {
+    'currency': 'c.currency',
+    'supplier': 's.name',
+    'supplier_uuid': 's.uuid',
+    'lifecycle_state': 'c.lifecycle_state',
+    'material': 'c.material',
+}
+
+# unit_price is a Numeric(10, 2) column, the values are summed as integer cents so that the totals are exact
+PRICE_SCALE = 2
+
+
+# Computes the inventory value (unit_price * quantity) with a single aggregate query in the database, grouped by
+# currency and the given group_by keys (see VALUATION_GROUPS). The quantities are taken from Component.quantity, or
+# from the quantities mapping of component uuid -> quantity, which is loaded into a temporary table for the query.
+# Returns a list of dicts with the group keys, the number of components, the total quantity and the exact total value
+# as Decimal. No ORM objects are loaded.
+def inventory_value(session, group_by = ('currency',), quantities = None, include_archived = False):
+    if isinstance(group_by, str):
+        group_by = (group_by,)
+    group_by = tuple(dict.fromkeys(('currency',) + tuple(group_by)))
+    for key in group_by:
+        if key not in VALUATION_GROUPS:
+            raise ValueError(f"Unknown valuation group '{key}', expected one of {tuple(VALUATION_GROUPS)}")
+
+    components = Component.__tablename__
+    connection = session.connection()
+    if quantities is not None:
+        connection.exec_driver_sql("DROP TABLE IF EXISTS temp.valuation_quantities")
+        connection.exec_driver_sql("CREATE TEMP TABLE valuation_quantities (uuid VARCHAR(32) PRIMARY KEY, quantity INTEGER NOT NULL)")
+        connection.exec_driver_sql("INSERT OR REPLACE INTO valuation_quantities (uuid, quantity) VALUES (?, ?)", list(quantities.items()))
+        quantity_source = f"{components} c JOIN valuation_quantities q ON q.uuid = c.uuid"
+        quantity = "q.quantity"
+    else:
+        quantity_source = f"{components} c"
+        quantity = "COALESCE(c.quantity, 0)"
+
+    group_columns = [VALUATION_GROUPS[key] for key in group_by]
+    where = "" if include_archived else "WHERE COALESCE(c.is_archived, 0) = 0"
+    statement = (
+        f"SELECT {', '.join(group_columns)}, COUNT(*), SUM({quantity}), "
+        f"SUM(CAST(ROUND(COALESCE(c.unit_price, 0) * {10 ** PRICE_SCALE}) AS INTEGER) * {quantity}) "
+        f"FROM {quantity_source} LEFT JOIN {Supplier.__tablename__} s ON s.id = c.supplier_id "
+        f"{where} GROUP BY {', '.join(group_columns)} ORDER BY {', '.join(group_columns)}"
+    )
+    try:
+        rows = connection.exec_driver_sql(statement).fetchall()
+    finally:
+        if quantities is not None:
+            connection.exec_driver_sql("DROP TABLE IF EXISTS temp.valuation_quantities")
+
+    results = []
+    for row in rows:
+        result = dict(zip(group_by, row))
+        result['components'] = row[len(group_by)]
+        result['quantity'] = row[len(group_by) + 1] or 0
+        result['value'] = Decimal(row[len(group_by) + 2] or 0).scaleb(-PRICE_SCALE)
+        results.append(result)
+    return results
@@ -1,23 +1,24 @@
 import os
 import shutil
-import sqlite3
 import subprocess
 import uuid
 from pathlib import Path
 
 from flask import Flask
-from flask import render_template, url_for, send_from_directory, redirect, request, flash, session
+from flask import render_template, url_for, send_file, redirect, request, flash, session, jsonify, abort
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from .settings import load_settings, save_settings
 
-from sqlalchemy import or_
 
 from flask_cors import CORS
+from sqlalchemy.orm import selectinload
 
 from openpartslibrary.db import PartsLibrary
 from openpartslibrary.models import Supplier, File, Component, ComponentComponent, Material, User
+from openpartslibrary.thumbnails import THUMBNAIL_MEDIA_TYPES
+from openpartslibrary_flask.serving import send_stored_bytes, send_stored_file, unchanged_digest
 from openpartslibrary_flask.forms import CreateComponentForm, CreateSupplierForm, CreateMaterialForm, LoginForm, RegistrationForm, CreateFileForm
 
 
@@ -43,39 +44,21 @@ app.config['APP_PATH'] = os.path.dirname(os.path.abspath(__file__))
 # Add secret key
 app.config['SECRET_KEY'] = 'afs87fas7bfsa98fbasbas98fh78oizu'
 
+# With OPENPARTSLIBRARY_X_SENDFILE=1 stored files are sent by the web server in front of the app (X-Sendfile header)
+app.config['USE_X_SENDFILE'] = os.environ.get('OPENPARTSLIBRARY_X_SENDFILE') == '1'
+
 # Application paths
 # initialize
 
 db_path = DATA_DIR / 'parts.db'
 
-# Initialize the parts library
-pl = PartsLibrary(db_path = db_path, data_dir_path = DATA_DIR)
-
-
-def migrate_legacy_database_schema(db_path):
-    if not os.path.exists(db_path):
-        return
-
-    component_column_definitions = {
-        'material': 'VARCHAR(200)',
-    }
-
-    with sqlite3.connect(str(db_path)) as connection:
-        cursor = connection.cursor()
-        cursor.execute("PRAGMA table_info(components)")
-        component_columns = {row[1] for row in cursor.fetchall()}
+# Initialize the parts library, with OPENPARTSLIBRARY_ARCHIVE set a .oplp archive is served read-only
+ARCHIVE_PATH = os.environ.get('OPENPARTSLIBRARY_ARCHIVE')
+if ARCHIVE_PATH:
+    pl = PartsLibrary.mount(ARCHIVE_PATH)
+else:
+    pl = PartsLibrary(db_path = db_path, data_dir_path = DATA_DIR, profile = 'web')
 
-        for column_name, column_type in component_column_definitions.items():
-            if column_name in component_columns:
-                continue
-            cursor.execute(
-                f"ALTER TABLE components ADD COLUMN {column_name} {column_type}"
-            )
-
-        connection.commit()
-
-
-migrate_legacy_database_schema(db_path)
 
 def copy_sample_files():
     sample_dir = pl.sample_data_dir_path
@@ -99,8 +82,17 @@ def copy_sample_files():
 # Copy sample files to data dir
 #copy_sample_files()
 
-if not pl.session.query(Component).first():
+if pl.archive is None and not pl.session.query(Component).first():
     pl.import_from_spreadsheet(pl.get_default_sample_spreadsheet_path())
+pl.remove_session()
+# connections opened so far are not shared with forked worker processes of the WSGI server
+pl.engine.dispose()
+
+# Every request works with its own session (pl.session is thread-local), which is removed at the end of the request,
+# so a failed commit or a slow request does not affect other requests
+@app.teardown_appcontext
+def remove_session(exception = None):
+    pl.remove_session()
 
 
 def open_with_default_application(filepath):
@@ -123,6 +115,12 @@ def launch_application(executable_path, filepath):
     else:
         open_with_default_application(filepath)
 
+# Number of components per page of the component list
+COMPONENTS_PAGE_SIZE = 100
+
+# Component columns returned by the JSON API
+API_COMPONENT_COLUMNS = ('uuid', 'number', 'name', 'description', 'revision', 'lifecycle_state', 'material', 'unit_price', 'currency', 'quantity', 'is_archived', 'date_modified')
+
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'  # redirect unauthorized users
@@ -200,16 +198,56 @@ Component routes
 def components(search_query):
     search_query = request.args.get("search_query", "")
 
-    like_pattern = f"%{search_query}%"
-
-    components = pl.session.query(Component).filter(
-            or_(
-                Component.name.ilike(like_pattern),
-                Component.description.ilike(like_pattern)
-            )
-        ).limit(1000).all()
+    # search with the full-text search index, the components are shown in the order of their rank
+    snippets = {}
+    if search_query.strip():
+        results = pl.search(search_query, limit = 1000, include_archived = True)
+        snippets = {result['id']: result['snippet'] for result in results}
+        components_by_id = {component.id: component for component in pl.session.query(Component).options(selectinload(Component.cad_file), selectinload(Component.supplier)).filter(Component.id.in_(snippets))}
+        components = [components_by_id[id] for id in snippets if id in components_by_id]
+        next_page_url = None
+    else:
+        # one page of the library, the next page continues after the cursor
+        order_by = request.args.get('order_by', 'number')
+        try:
+            page = pl.list_components(order_by = order_by, cursor = request.args.get('cursor'), limit = COMPONENTS_PAGE_SIZE, load = ('cad_file', 'supplier'))
+        except ValueError as e:
+            return str(e), 400
+        components = page.items
+        next_page_url = page.next_cursor and url_for('components', order_by = order_by, cursor = page.next_cursor)
     
-    return render_template('component/component-list.html', components = components, len = len, search_query = search_query, user = current_user)
+    return render_template('component/component-list.html', components = components, snippets = snippets, next_page_url = next_page_url, len = len, search_query = search_query, user = current_user)
+
+# Lists the components as JSON, one page per request. Query parameters: order_by ('number', 'name' or 'date_modified'),
+# descending (0 or 1), limit and cursor (the next_cursor of the previous page).
+@app.route('/api/components')
+def api_components():
+    try:
+        page = pl.list_components(
+            order_by = request.args.get('order_by', 'number'),
+            cursor = request.args.get('cursor'),
+            limit = request.args.get('limit', COMPONENTS_PAGE_SIZE, type = int),
+            descending = request.args.get('descending', 0, type = int) == 1,
+            columns = API_COMPONENT_COLUMNS,
+        )
+    except ValueError as e:
+        return jsonify(error = str(e)), 400
+    for item in page.items:
+        item['unit_price'] = str(item['unit_price']) if item['unit_price'] is not None else None
+        item['date_modified'] = item['date_modified'].isoformat() if item['date_modified'] else None
+    return jsonify(components = page.items, next_cursor = page.next_cursor)
+
+# Returns the component hierarchy as Cytoscape.js elements. Query parameters: root (uuid of the component whose subtree
+# is returned) and include_archived (0 or 1). The JSON is cached by the library until a component or link changes.
+@app.route('/api/hierarchy')
+def api_hierarchy():
+    graph = pl.component_graph(
+        root_uuid = request.args.get('root'),
+        include_archived = request.args.get('include_archived', 1, type = int) == 1,
+    )
+    if graph is None:
+        return jsonify(error = f"Component not found with UUID: {request.args.get('root')}"), 404
+    return app.response_class(graph.to_cytoscape_json(), mimetype = 'application/json')
 
 @app.route('/component/create', methods = ['GET', 'POST'])
 def component_create():
@@ -224,14 +262,12 @@ def component_create():
         if cad_file.filename == "":
             return "No selected cad file", 400
 
-        file_uuid = str(uuid.uuid4())
+        # Save the upload next to the blob store and move it into the blob store, identical files are stored once
+        upload_path = pl.blob_store.root_path / f"upload-{uuid.uuid4()}.tmp"
+        cad_file.save(upload_path)
 
-        # Sanitize filename and save
-        file_name = file_uuid + '.FCStd'
-        cad_file.save(CAD_DIR / file_name)
-        
-        # Create a new file
-        cad_file = File(uuid = file_uuid, name = file_name, description = 'This is a CAD file.')
+        # Create a new file, served from its blob as /static/cad/<file uuid>.FCStd
+        cad_file = pl.add_cad_file(upload_path, name = secure_filename(cad_file.filename) or 'model.FCStd', move = True)
 
         # Create a new component
         component = Component(
@@ -259,10 +295,10 @@ def component_view(uuid):
         return f"Component not found with UUID: {uuid}", 404
     component_cad_filepath = None
     if component.cad_file is not None:
-        component_cad_filepath = str((CAD_DIR / f"{component.cad_file.uuid}.FCStd").resolve())
+        component_cad_filepath = f"{component.cad_file.uuid}.FCStd"
     files = component.files if component else []
-    used_in_files = []
-    return render_template('component/component-read.html', component = component, len = len, component_cad_filepath = component_cad_filepath, files = files, used_in_files = used_in_files) 
+    used_in = pl.where_used(component.uuid)
+    return render_template('component/component-read.html', component = component, len = len, component_cad_filepath = component_cad_filepath, files = files, used_in = used_in) 
 
 @app.route('/update-component/<uuid>', methods = ['GET', 'POST'])
 def component_update(uuid):
@@ -281,7 +317,10 @@ def component_update(uuid):
 @app.route('/component/archivate/<uuid>', methods = ['GET', 'POST'])
 def component_archivate(uuid):
     component = pl.session.query(Component).filter_by(uuid = uuid).first()
+    if not component:
+        return redirect(url_for('components'))
     component.is_archived = True
+    pl.session.commit()
     return redirect(url_for('components'))
 
 ''' 
@@ -512,13 +551,50 @@ Viewer routes
 '''
 @app.route('/viewer/<filename>')
 def viewer(filename):
-    filepath = url_for('static', filename=f'data/cad/{filename}')
+    filepath = url_for('serve_model_file', filename = filename)
     print(f"Serving file to viewer : {filepath}")
     return render_template('viewer/viewer.html', filepath = filepath)
 
+# Serves the thumbnail of a CAD file, optionally with ?size= (32, 64, 128 or 256 pixels). The content of a file uuid
+# never changes, so browsers keep the thumbnail for a year without asking again.
+@app.route('/thumbnail/<file_uuid>')
+def thumbnail(file_uuid):
+    try:
+        path = pl.thumbnail(file_uuid, size = request.args.get('size', type = int))
+    except ValueError:
+        abort(400)
+    if path is None:
+        abort(404)
+    response = send_file(path, mimetype = THUMBNAIL_MEDIA_TYPES[path.suffix], etag = path.stem, max_age = 365 * 24 * 3600)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+# Sends a stored file (CAD file or attachment) named <file uuid><suffix>, see serving.send_stored_file. Files which are
+# unchanged since they were stored, and all files of a mounted archive, get their content hash as strong ETag and are
+# kept by browsers for a year, other files are revalidated.
+def serve_stored_file(directory, filename):
+    digest = pl.session.query(File.content_hash).filter_by(uuid = Path(filename).stem).scalar()
+    if pl.archive is not None:
+        try:
+            data = pl.read_stored_file(filename, directory = directory)
+        except KeyError:
+            abort(404)
+        return send_stored_bytes(data, filename, content_hash = digest, immutable = digest is not None)
+    try:
+        path = pl.stored_file_path(filename, directory = directory)
+    except KeyError:
+        abort(404)
+    digest = unchanged_digest(pl.blob_store, path, digest)
+    return send_stored_file(path, filename, content_hash = digest, immutable = digest is not None)
+
 @app.route('/static/cad/<filename>')
 def serve_model_file(filename):
-    return send_from_directory(str(CAD_DIR), filename)
+    return serve_stored_file('cad', filename)
+
+@app.route('/static/files/<filename>')
+def serve_attached_file(filename):
+    return serve_stored_file('files', filename)
 
 
 ''' 
@@ -526,10 +602,16 @@ def serve_model_file(filename):
 Desktop application startup routes
 **********************************
 '''
+# Opens a CAD file of the library with FreeCAD. The file is opened as private copy (see PartsLibrary.edit_stored_file),
+# the blob it was stored as is never changed.
 @app.route('/run-freecad-gui/<filepath>')
 def run_freecad_gui(filepath):
+    try:
+        path = pl.edit_stored_file(filepath)
+    except KeyError:
+        abort(404)
     settings = load_settings()
-    launch_application(settings['executables'].get('FreeCAD_GUI', ''), filepath)
+    launch_application(settings['executables'].get('FreeCAD_GUI', ''), path)
     return ('', 204)
 
 @app.route('/run-libreoffice-gui/<filepath>')
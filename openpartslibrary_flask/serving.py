@@ -0,0 +1,92 @@
+import io
+import mimetypes
+
+from flask import request, send_file, Response
+from werkzeug.wsgi import wrap_file
+
+
+# Lifetime of responses for files which never change, one year is the longest browsers honour
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+# Files named <uuid><suffix> with a recorded content hash never change: browsers keep them without asking again.
+# Other files are revalidated on every use, which costs a 304 response while they are unchanged.
+def _cache_headers(response, immutable):
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
+# Returns the content hash of a stored file if the file still has the content of its blob, None otherwise, e.g. for a
+# file which was saved again by FreeCAD
+def unchanged_digest(blob_store, path, digest):
+    if digest is None or not blob_store.unchanged(digest, path):
+        return None
+    return digest
+
+
+# Sends a stored file of the library from its path, the file in the data directory or its blob, under the name
+# filename. The ETag is the content hash if known, otherwise Werkzeug's ETag from modification time and size.
+# Conditional requests (If-None-Match, If-Modified-Since) are answered with 304 and byte ranges with 206. The file is
+# passed to the WSGI server as file wrapper, which servers like gunicorn send with sendfile, or to the web server in
+# front with X-Sendfile if USE_X_SENDFILE is configured.
+def send_stored_file(path, filename, content_hash = None, immutable = False):
+    response = send_file(path, download_name = filename, etag = content_hash or True, conditional = True, max_age = IMMUTABLE_MAX_AGE if immutable else None)
+    return _cache_headers(response, immutable)
+
+
+# Binary file over a buffer in memory, e.g. the memoryview of a member of a memory-mapped archive. Reads return
+# slices of the buffer, so it is never copied as a whole.
+class BufferReader(io.RawIOBase):
+    def __init__(self, data):
+        self._view = memoryview(data).cast('B')
+        self._position = 0
+        self.size = len(self._view)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence = io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self.size}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def read(self, size = -1):
+        end = self.size if size is None or size < 0 else self._position + size
+        data = bytes(self._view[self._position:end])
+        self._position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self._view[self._position:self._position + len(buffer)]
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+
+# Sends the content of a stored file which is held in memory, e.g. read from a mounted archive, with the same
+# conditional request and byte range handling as send_stored_file. The content is streamed in blocks from the buffer,
+# byte ranges are read by seeking in it. Without content hash the response has no ETag, as it would have to be
+# computed from the whole content.
+def send_stored_bytes(data, filename, content_hash = None, immutable = False):
+    reader = BufferReader(data)
+    response = Response(wrap_file(request.environ, reader), mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream', direct_passthrough = True)
+    response.content_length = reader.size
+    if content_hash:
+        response.set_etag(content_hash)
+    response = response.make_conditional(request, accept_ranges = True, complete_length = reader.size)
+    return _cache_headers(response, immutable)
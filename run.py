@@ -2,16 +2,14 @@ import os
 import uuid
 import webbrowser
 import webview
-import json
 from datetime import datetime
-import zipfile
 
 import networkx as nx
 
 import matplotlib.pyplot as plt
 
 from openpartslibrary.db import PartsLibrary
-from openpartslibrary.models import Part, Supplier, File, Component, ComponentComponent
+from openpartslibrary.models import Part, Supplier, File, Component
 
 '''
 OpenPartsLibrary - run.py (Overview)
@@ -242,20 +240,8 @@ print('*  Aleksander Sadowski,  Nandana Gopala Krishnan (C) 2025  *')
 print('************************************************************') 
 pl.display()
 
-# Query all relationships
-relationships = pl.session.query(ComponentComponent).all()
-
-# Build directed graph
-G = nx.DiGraph()
-
-for rel in relationships:
-    parent = pl.session.query(Component).filter_by(id=rel.parent_component_id).first()
-    child = pl.session.query(Component).filter_by(id=rel.child_component_id).first()
-
-    if parent and child:
-        G.add_node(parent.id, name=parent.name)
-        G.add_node(child.id, name=child.name)
-        G.add_edge(child.id, parent.id)
+# Build the directed graph of the component hierarchy (assembly -> child) with two bulk queries
+G = pl.component_graph().to_networkx()
 
 
 # Show directed networkx graph in matpolotlib
@@ -269,24 +255,8 @@ nx.draw(G, pos, with_labels=True, labels=labels, node_size=1500, node_color="sky
 plt.title("Component Hierarchy Graph Viewer")
 plt.show()
 
-# Convert NetworkX graph to Cytoscape.js format
-cy_data = {"nodes": [], "edges": []}
-
-for node_id, attrs in G.nodes(data=True):
-    cy_data["nodes"].append({
-        "data": {
-            "id": str(node_id), 
-            "label": attrs.get("name", str(node_id))
-        }
-    })
-
-for source, target in G.edges():
-    cy_data["edges"].append({
-        "data": {
-            "source": str(source), 
-            "target": str(target)
-        }
-    })
+# Cytoscape.js elements of the same graph, cached by the library until a component or link changes
+cy_data_json = pl.component_graph().to_cytoscape_json()
 
 # Create a self-contained HTML string
 html_content = f"""
@@ -300,7 +270,7 @@ html_content = f"""
 <body style="width: 100vw; height: 100vh; margin: 0; padding: 0;">
     <div id="cy" style="width: 100%; height: 100%; margin: 0; padding: 0;"></div>
     <script>
-    var cyData = {json.dumps(cy_data)};
+    var cyData = {cy_data_json};
     
     var cy = cytoscape({{
         container: document.getElementById('cy'),
@@ -357,65 +327,15 @@ webbrowser.open(f"file://{path}")
 webview.create_window("Component Hierarchy Graph Viewer", graph_html_filepath, width=800, height=600)
 webview.start()
 
-# Export NetworkX graph to CycloneDX HBOM
+# Export the component hierarchy as CycloneDX HBOM
 cylonedx_hbom_json_filepath = os.path.join(EXPORT_DIR, "cyclonedx-hbom-json-" + str(uuid.uuid4()) + ".json")
-
-bom = {
-    "bomFormat": "CycloneDX",
-    "specVersion": "1.5",
-    "serialNumber": f"urn:uuid:{uuid.uuid4()}",
-    "version": 1,
-    "metadata": {
-        "timestamp": datetime.utcnow().isoformat() + "Z",
-        "tools": [
-            {
-                "vendor": "Custom",
-                "name": "NetworkX-to-CycloneDX Converter",
-                "version": "1.0"
-            }
-        ]
-    },
-    "components": [],
-    "dependencies": []
-}
-
-# Keep track of mapping from graph IDs to bom-ref
-node_to_ref = {}
-
-# Add components as devices
-for node_id, attrs in G.nodes(data=True):
-    comp_ref = f"device-{node_id}"
-    node_to_ref[node_id] = comp_ref
-
-    bom["components"].append({
-        "bom-ref": comp_ref,
-        "type": "device",   # <-- key change here
-        "name": attrs.get("name", str(node_id)),
-        "version": "1.0"
-    })
-
-# Add dependencies (parent -> child)
-for parent, child in G.edges():
-    bom["dependencies"].append({
-        "ref": node_to_ref[parent],
-        "dependsOn": [node_to_ref[child]]
-    })
-
-# Export to JSON
-with open(cylonedx_hbom_json_filepath, "w", encoding="utf-8") as f:
-    json.dump(bom, f, indent=2)
+pl.export_cyclonedx(cylonedx_hbom_json_filepath)
 
 # Create the output filename with current date and time
 output_filename = f"parts-{datetime.now().strftime('%Y%m%d-%H%M%S')}.oplp"
 output_path = os.path.join(EXPORT_DIR, output_filename)
 
-# Create the zip file
-with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-    for root, dirs, files in os.walk(LIBRARY_DATA_DIR):
-        for file in files:
-            file_path = os.path.join(root, file)
-            # Preserve folder structure inside zip
-            arcname = os.path.relpath(file_path, os.path.dirname(LIBRARY_DATA_DIR))
-            zipf.write(file_path, arcname)
+# Create the archive of the database and the stored files
+pl.export_archive(output_path)
 
 print(f"Created archive: {output_filename}")
@@ -36,6 +36,7 @@ setup(
         'WTForms',
         'Flask-Login',
         'email_validator',
+        'Pillow',
     ],
     python_requires='>=3.10',
 
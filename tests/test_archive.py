@@ -0,0 +1,45 @@
+import zipfile
+
+from openpartslibrary.db import PartsLibrary
+
+
+def _add_file(pl, tmp_path, content):
+    source_path = tmp_path / 'part.FCStd'
+    source_path.write_bytes(content)
+    file = pl.add_cad_file(source_path)
+    pl.session.commit()
+    return f"{file.uuid}.FCStd"
+
+
+# Files kept in the blob store only are exported under data/cad/<file uuid><suffix>
+def test_export_archive_includes_blob_files(tmp_path):
+    pl = PartsLibrary(data_dir_path = tmp_path / 'library')
+    name = _add_file(pl, tmp_path, b'PK first version')
+    pl.export_archive(tmp_path / 'full.oplp')
+    with zipfile.ZipFile(tmp_path / 'full.oplp') as archive:
+        assert archive.read(f"data/cad/{name}") == b'PK first version'
+
+
+# A file changed after it was opened for editing is hashed again and included in an incremental export
+def test_incremental_export_includes_edited_files(tmp_path):
+    pl = PartsLibrary(data_dir_path = tmp_path / 'library')
+    name = _add_file(pl, tmp_path, b'PK first version')
+    pl.export_archive(tmp_path / 'full.oplp')
+
+    with open(pl.edit_stored_file(name), 'ab') as f:
+        f.write(b' and an edit')
+    manifest = pl.export_archive(tmp_path / 'incremental.oplp', base = tmp_path / 'full.oplp')
+    assert manifest['files'][f"data/cad/{name}"]['archive'] == manifest['id']
+    with zipfile.ZipFile(tmp_path / 'incremental.oplp') as archive:
+        assert archive.read(f"data/cad/{name}") == b'PK first version and an edit'
+
+
+# A copy opened for editing but not changed is not hashed again and not included in an incremental export
+def test_incremental_export_skips_unchanged_copies(tmp_path):
+    pl = PartsLibrary(data_dir_path = tmp_path / 'library')
+    name = _add_file(pl, tmp_path, b'PK first version')
+    pl.export_archive(tmp_path / 'full.oplp')
+
+    pl.edit_stored_file(name)
+    manifest = pl.export_archive(tmp_path / 'incremental.oplp', base = tmp_path / 'full.oplp')
+    assert manifest['files'][f"data/cad/{name}"]['archive'] == manifest['base']
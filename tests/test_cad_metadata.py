@@ -0,0 +1,19 @@
+import shutil
+from pathlib import Path
+
+from openpartslibrary.db import PartsLibrary
+
+
+SAMPLE_CAD_DIR = Path(__file__).resolve().parent.parent / 'openpartslibrary' / 'sample' / 'components-cad'
+
+
+# A CAD file which was edited after its metadata was extracted is read again, files which did not change are skipped
+def test_extract_cad_metadata_reads_edited_files(tmp_path):
+    pl = PartsLibrary(data_dir_path = tmp_path / 'library')
+    file = pl.add_cad_file(SAMPLE_CAD_DIR / 'DIN934_M3.FCStd')
+    pl.session.commit()
+    assert pl.extract_cad_metadata(workers = 1) == (1, {})
+    assert pl.extract_cad_metadata(workers = 1) == (0, {})
+
+    shutil.copyfile(SAMPLE_CAD_DIR / 'DIN934_M4.FCStd', pl.edit_stored_file(f"{file.uuid}.FCStd"))
+    assert pl.extract_cad_metadata(workers = 1) == (1, {})
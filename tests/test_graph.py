@@ -0,0 +1,46 @@
+import pytest
+
+from openpartslibrary.db import PartsLibrary
+from openpartslibrary.graph import bulk_counter_inserts
+from openpartslibrary.search import bulk_index_inserts
+
+
+def _counter_triggers(connection):
+    return set(connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'modification_counters_%_insert'").scalars())
+
+
+# A batch which fails inside bulk_counter_inserts must leave the insert triggers of the counters in place, so the
+# cached graphs are still invalidated by later inserts
+def test_bulk_counter_inserts_keeps_triggers_after_failed_batch(tmp_path):
+    pl = PartsLibrary(data_dir_path = tmp_path)
+    pl.session.commit()
+    triggers = _counter_triggers(pl.session.connection())
+    assert len(triggers) == 2
+
+    connection = pl.session.connection()
+    with pytest.raises(RuntimeError):
+        with bulk_index_inserts(connection), bulk_counter_inserts(connection):
+            connection.exec_driver_sql("INSERT INTO components (uuid, number, name) VALUES ('c1', 'N1', 'Assembly')")
+            raise RuntimeError('batch failed')
+    pl.session.rollback()
+    assert _counter_triggers(pl.session.connection()) == triggers
+
+    connection = pl.session.connection()
+    connection.exec_driver_sql("INSERT INTO components (uuid, number, name) VALUES (?, ?, ?)", [('a', 'N1', 'Assembly'), ('b', 'N2', 'Screw')])
+    pl.session.commit()
+    assert len(pl.component_graph()) == 0
+    pl.add_child('a', 'b')
+    pl.session.commit()
+    assert list(pl.component_graph().uuids) == ['a', 'b']
+
+
+def test_bulk_counter_inserts_increments_counter_once(tmp_path):
+    pl = PartsLibrary(data_dir_path = tmp_path)
+    graph = pl.component_graph(include_unlinked = True)
+    connection = pl.session.connection()
+    with bulk_counter_inserts(connection):
+        connection.exec_driver_sql("INSERT INTO components (uuid, number, name) VALUES (?, ?, ?)", [('a', 'N1', 'Assembly'), ('b', 'N2', 'Screw')])
+    pl.session.commit()
+    assert _counter_triggers(pl.session.connection())
+    assert pl.component_graph(include_unlinked = True) is not graph
+    assert len(pl.component_graph(include_unlinked = True)) == 2
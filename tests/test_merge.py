@@ -0,0 +1,29 @@
+from openpartslibrary.db import PartsLibrary
+from openpartslibrary.models import Component
+
+
+def _add_components(pl, *uuids):
+    for uuid in uuids:
+        pl.session.add(Component(uuid = uuid, number = uuid.upper(), name = f"Component {uuid}"))
+    pl.session.commit()
+
+
+# A link which would create a cycle is rejected, the other links of its batch are inserted and counted once
+def test_import_archive_counts_links_of_batch_with_cycle(tmp_path):
+    source = PartsLibrary(data_dir_path = tmp_path / 'source')
+    _add_components(source, 'p', 'c', 'd')
+    source.export_archive(tmp_path / 'components.oplp')
+
+    target = PartsLibrary(data_dir_path = tmp_path / 'target')
+    target.import_archive(tmp_path / 'components.oplp')
+    target.add_child('c', 'p')
+
+    source.add_child('p', 'd')
+    source.add_child('p', 'c')
+    source.export_archive(tmp_path / 'links.oplp')
+
+    report = target.import_archive(tmp_path / 'links.oplp')
+    assert report.rejected_links == [('p', 'c')]
+    assert report.inserted['component_component'] == 1
+    assert target.contains('p', 'd')
+    assert not target.contains('p', 'c')
@@ -0,0 +1,63 @@
+import sqlite3
+import zipfile
+
+from openpartslibrary.db import PartsLibrary
+
+
+# Schema of the libraries written by the first releases, before the migrations (see migrations.MIGRATIONS)
+BASELINE_SCHEMA = """
+CREATE TABLE files (
+    id INTEGER NOT NULL, uuid VARCHAR(32) NOT NULL, name VARCHAR(200) NOT NULL, description VARCHAR(1000),
+    date_created DATETIME, date_modified DATETIME,
+    PRIMARY KEY (id), UNIQUE (uuid)
+);
+CREATE TABLE suppliers (
+    id INTEGER NOT NULL, uuid VARCHAR(32) NOT NULL, name VARCHAR(200) NOT NULL, description VARCHAR(1000),
+    street VARCHAR(200), house_number VARCHAR(20), postal_code VARCHAR(20), city VARCHAR(100), country VARCHAR(100),
+    date_created DATETIME, date_modified DATETIME,
+    PRIMARY KEY (id), UNIQUE (uuid)
+);
+CREATE TABLE components (
+    id INTEGER NOT NULL, uuid VARCHAR(32) NOT NULL, name VARCHAR(200) NOT NULL, number VARCHAR(50) NOT NULL,
+    description VARCHAR(1000), revision VARCHAR(10), lifecycle_state VARCHAR(50), owner VARCHAR(100),
+    material VARCHAR(200), unit_price NUMERIC(10, 2), currency VARCHAR(3), cad_file_id INTEGER, supplier_id INTEGER,
+    manufacturer_number VARCHAR(100), date_created DATETIME, date_modified DATETIME, is_archived BOOLEAN,
+    PRIMARY KEY (id), UNIQUE (id), UNIQUE (uuid),
+    FOREIGN KEY(cad_file_id) REFERENCES files (id), FOREIGN KEY(supplier_id) REFERENCES suppliers (id)
+);
+CREATE TABLE component_component (
+    id INTEGER NOT NULL, parent_component_id INTEGER NOT NULL, child_component_id INTEGER NOT NULL,
+    PRIMARY KEY (id), CONSTRAINT uq_parent_child UNIQUE (parent_component_id, child_component_id),
+    FOREIGN KEY(parent_component_id) REFERENCES components (id), FOREIGN KEY(child_component_id) REFERENCES components (id)
+);
+CREATE TABLE component_file (
+    id INTEGER NOT NULL, component_id INTEGER NOT NULL, file_id INTEGER NOT NULL, date_linked DATETIME,
+    PRIMARY KEY (id),
+    FOREIGN KEY(component_id) REFERENCES components (id), FOREIGN KEY(file_id) REFERENCES files (id)
+);
+INSERT INTO files (id, uuid, name) VALUES (1, 'f1', 'frame.FCStd');
+INSERT INTO components (id, uuid, name, number, cad_file_id, is_archived) VALUES (1, 'c1', 'Machine frame', 'N1', 1, 0);
+INSERT INTO components (id, uuid, name, number, is_archived) VALUES (2, 'c2', 'Hex screw', 'N2', 0);
+INSERT INTO component_component (parent_component_id, child_component_id) VALUES (1, 2);
+"""
+
+
+# Writes an archive like the first releases did: the data directory zipped without manifest
+def _baseline_archive(tmp_path):
+    database_path = tmp_path / 'parts.db'
+    connection = sqlite3.connect(database_path)
+    connection.executescript(BASELINE_SCHEMA)
+    connection.close()
+    archive_path = tmp_path / 'baseline.oplp'
+    with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.write(database_path, 'data/parts.db')
+        archive.writestr('data/cad/f1.FCStd', b'PK frame')
+    return archive_path
+
+
+# The database of an archive with an older schema is migrated when it is extracted, before it is opened read-only
+def test_mount_migrates_baseline_archive(tmp_path):
+    pl = PartsLibrary.mount(_baseline_archive(tmp_path), cache_dir_path = tmp_path / 'cache')
+    assert [result['uuid'] for result in pl.search('screw')] == ['c2']
+    assert [component.uuid for component in pl.where_used('c2')] == ['c1']
+    assert bytes(pl.read_stored_file('f1.FCStd')) == b'PK frame'
@@ -0,0 +1,16 @@
+from openpartslibrary.db import PartsLibrary
+
+
+def _synchronous(pl):
+    return pl.session.connection().exec_driver_sql("PRAGMA synchronous").scalar()
+
+
+# The import settings are restored when bulk_import exits, also on the connection the session still holds
+def test_bulk_import_restores_pragmas_of_held_connection(tmp_path):
+    pl = PartsLibrary(data_dir_path = tmp_path, profile = 'bulk-import')
+    normal = _synchronous(pl)
+    with pl.bulk_import():
+        assert _synchronous(pl) == 0
+    assert _synchronous(pl) == normal
+    pl.session.commit()
+    assert _synchronous(pl) == normal
@@ -0,0 +1,22 @@
+from types import SimpleNamespace
+
+import pytest
+
+from openpartslibrary.db import PartsLibrary
+from openpartslibrary.models import Component
+from openpartslibrary.purge import LIBRARY_TABLES
+
+
+# A failed delete_all is rolled back completely, including the dropped search index
+def test_failed_delete_all_keeps_search_index(tmp_path, monkeypatch):
+    pl = PartsLibrary(data_dir_path = tmp_path)
+    pl.session.add(Component(uuid = 'c1', number = 'N1', name = 'Hex screw'))
+    pl.session.commit()
+    monkeypatch.setattr('openpartslibrary.purge.LIBRARY_TABLES', LIBRARY_TABLES + (SimpleNamespace(name = 'missing_table'),))
+    with pytest.raises(Exception, match = 'missing_table'):
+        pl.delete_all()
+
+    assert [result['uuid'] for result in pl.search('hex')] == ['c1']
+    pl.session.add(Component(uuid = 'c2', number = 'N2', name = 'Hex nut'))
+    pl.session.commit()
+    assert [result['uuid'] for result in pl.search('nut')] == ['c2']
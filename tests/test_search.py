@@ -0,0 +1,36 @@
+import pytest
+
+from openpartslibrary.db import PartsLibrary
+from openpartslibrary.search import bulk_index_inserts
+
+
+def _insert_trigger_exists(connection):
+    return connection.exec_driver_sql("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name = 'components_fts_components_insert'").scalar() == 1
+
+
+# A batch which fails inside bulk_index_inserts must leave the insert trigger of the search index in place
+def test_bulk_index_inserts_keeps_trigger_after_failed_batch(tmp_path):
+    pl = PartsLibrary(data_dir_path = tmp_path)
+    pl.session.commit()
+    connection = pl.session.connection()
+    with pytest.raises(RuntimeError):
+        with bulk_index_inserts(connection):
+            connection.exec_driver_sql("INSERT INTO components (uuid, number, name) VALUES ('c1', 'N1', 'Hex screw')")
+            raise RuntimeError('batch failed')
+    pl.session.rollback()
+
+    connection = pl.session.connection()
+    assert _insert_trigger_exists(connection)
+    connection.exec_driver_sql("INSERT INTO components (uuid, number, name) VALUES ('c2', 'N2', 'Hex nut')")
+    pl.session.commit()
+    assert [result['uuid'] for result in pl.search('hex')] == ['c2']
+
+
+def test_bulk_index_inserts_indexes_inserted_components(tmp_path):
+    pl = PartsLibrary(data_dir_path = tmp_path)
+    connection = pl.session.connection()
+    with bulk_index_inserts(connection):
+        connection.exec_driver_sql("INSERT INTO components (uuid, number, name) VALUES (?, ?, ?)", [('c1', 'N1', 'Hex screw'), ('c2', 'N2', 'Washer')])
+    pl.session.commit()
+    assert _insert_trigger_exists(pl.session.connection())
+    assert [result['uuid'] for result in pl.search('hex')] == ['c1']
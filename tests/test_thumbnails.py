@@ -0,0 +1,33 @@
+import io
+import zipfile
+
+import pytest
+
+from openpartslibrary.thumbnails import THUMBNAIL_MEMBER, ThumbnailCache
+
+
+def _fcstd(png):
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w') as archive:
+        archive.writestr(THUMBNAIL_MEMBER, png)
+    output.seek(0)
+    return output
+
+
+# A thumbnail which could not be resized is not cached under the requested size
+def test_unresized_thumbnail_is_not_cached_under_requested_size(tmp_path, monkeypatch):
+    monkeypatch.setattr('openpartslibrary.thumbnails.resize_thumbnail', lambda png, size: None)
+    cache = ThumbnailCache(tmp_path)
+    path = cache.thumbnail('ab' * 32, lambda: _fcstd(b'original png'), size = 64)
+    assert path.read_bytes() == b'original png'
+    assert not cache.cached('ab' * 32, 64)
+
+
+def test_thumbnail_is_cached_under_requested_size(tmp_path):
+    pytest.importorskip('PIL')
+    from PIL import Image
+    image = io.BytesIO()
+    Image.new('RGB', (256, 256)).save(image, format = 'PNG')
+    cache = ThumbnailCache(tmp_path)
+    cache.thumbnail('ab' * 32, lambda: _fcstd(image.getvalue()), size = 64)
+    assert cache.cached('ab' * 32, 64)
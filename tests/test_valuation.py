@@ -0,0 +1,18 @@
+from decimal import Decimal
+
+from openpartslibrary.db import PartsLibrary
+from openpartslibrary.models import Component
+
+
+# Values in different currencies are returned per currency and never added up
+def test_total_value_per_currency(tmp_path):
+    pl = PartsLibrary(data_dir_path = tmp_path)
+    pl.session.add_all([
+        Component(uuid = 'c1', number = 'N1', name = 'Screw', unit_price = Decimal('0.25'), currency = 'EUR', quantity = 100),
+        Component(uuid = 'c2', number = 'N2', name = 'Nut', unit_price = Decimal('0.10'), currency = 'EUR', quantity = 50),
+        Component(uuid = 'c3', number = 'N3', name = 'Motor', unit_price = Decimal('99.00'), currency = 'USD', quantity = 2),
+    ])
+    pl.session.commit()
+    assert pl.total_value() == {'EUR': Decimal('30.00'), 'USD': Decimal('198.00')}
+    assert pl.total_value(currency = 'EUR') == Decimal('30.00')
+    assert pl.total_value(currency = 'CHF') == Decimal(0)